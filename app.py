@@ -1,32 +1,38 @@
 try:
+    import asyncio
     import uvicorn as uvicorn
 
-    from fastapi import APIRouter, FastAPI, Path, Request
+    from fastapi import APIRouter, FastAPI, Path, Query, Request, Response
     from fastapi.exceptions import RequestValidationError
-    from fastapi.responses import JSONResponse
-    from fastapi.middleware.wsgi import WSGIMiddleware
-
-    from flask import Flask, render_template, request, make_response, send_from_directory, session
-    from flask_babel import Babel, _
-    # _ to evaluate the text and translate it
-    from flask_babel import lazy_gettext as _l
-    import sqlite3
-    # lazy_gettext is like the _ but handle the later evaluation of the text
-        
-    # To handle apscheduler
-    from apscheduler.schedulers.asyncio import AsyncIOScheduler
-    from apscheduler.jobstores.memory import MemoryJobStore
+    from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, StreamingResponse
+    from fastapi.staticfiles import StaticFiles
+    from starlette.exceptions import HTTPException as StarletteHTTPException
+
+    import functools
     from contextlib import asynccontextmanager
-    from lock import *
-    #from apscheduler.schedulers.background import BackgroundScheduler  # To schedule the check
+    from typing import List, Literal
+    from cluster import Leadership, SharedStateSync
     #import datetime
     
     # Own modules
     from models import *
+    from cache import RenderCache
+    from snapshots import ApiSnapshot
+    from templating import LANGUAGES, best_match, gettext_function, render_template
+    from probe import ProbeClient, ProbeResult
+    from probe_scheduler import PROBE_INTERVAL, ProbeScheduler
+    from delivery import deliveries
+    from reports import reports
+    from stream import encode_event, status_stream
     from fastapi_custom import ALL_HTTP_METHODS, hide_422, hide_default_responses, use_route_names_as_operation_ids
     from utilities import *
     from logger_config import *
     
+    import backup
+    import db
+    import export
+    import http_cache
+    import retention
     import sql
 except ImportError as e:
     logger.warning(f"[LOG] Error on startup: not all packages could be properly imported:\n{e}.")
@@ -35,82 +41,102 @@ except ImportWarning as w:
     logger.warning(f"[LOG] Warning on startup: not all packages could be properly imported:\n{w}")
 
 
-# Load JSON files ######################################################################################################
-JSON_FILE_WEBHOOKS = "webhooks.json"
-webhooks = Webhooks.load_from_json_file(JSON_FILE_WEBHOOKS)
+# Create the tables of the database if needed
+sql.init_db()
+
+# Load the webhooks and JSON files #####################################################################################
+webhooks = Webhooks.load_from_db()
 
 JSON_FILE_SERVICES = "services.json"
 services = Services.load_from_json_file(JSON_FILE_SERVICES, webhooks=webhooks)
-webhooks._set_services(webhooks)
-
-# APSCHEDULER ##########################################################################################################
-
-def refreshServices():
-    logger.info("[LOG]: Refreshing the services")
-    session = requests.Session()
-    
-    services.update_status(session)
-
-    session.close()
-    
-    services_name = services.names
-    
-    # Connect to the SQLite database
-    conn = sqlite3.connect('data/outage.sqlite3')
-    cursor = conn.cursor()
-    
-    for service in services_name:
-        up, time = services.get_service(service).up_time()
-        # convert time into unix timestamp
-        time = int(time.timestamp())
-        
-        table_name = service.replace('.', '_')  # Replace dots with underscores for table name
-        table_name = table_name.replace('-', '_')  # Replace dashes with underscores for table name
-
-        logger.info(f"[LOG]: Updating {service} status to {up} at {time}")
-        
-        # Insert the status update
-        cursor.execute(f'''
-            INSERT INTO {table_name} (timestamp, status, user)
-            VALUES (?, ?, ?)
-        ''', (time, up, 0))
-        
-        logger.info(f"[LOG]: {service} status updated successfully")
-    
-    # Commit the transaction
-    conn.commit()
+webhooks._set_services(services)
+# The statuses shared by the workers are more recent than the json file, if any
+services.load_snapshot()
+
+# Rendered pages and pre-serialized API responses, until the next refresh of the services
+render_cache = RenderCache()
+api_snapshot = ApiSnapshot.build(services)
+reports_generation = sql.get_version(sql.VERSION_REPORTS)  # The version of the user reports shown by the service pages
+
+
+def newGeneration():
+    """The statuses changed: encode the API responses again and drop the pages rendered before."""
+    global api_snapshot
+    api_snapshot = ApiSnapshot.build(services)
+    render_cache.invalidate()
+
+# PROBES ###############################################################################################################
+last_backup = None  # time.monotonic() of the last snapshot of the database taken by this worker
+last_retention = None  # time.monotonic() of the last application of the retention policy by this worker
+
+async def recordProbes(results: List[ProbeResult]):
+    """Store the results of a batch of probes (see `probe_scheduler.py`), once recorded by the services."""
+    rows, timings = [], []
+    for result in results:
+        # convert time into unix timestamp (`checked_at` is naive UTC, like the dates of the user reports)
+        time_ = int(result.checked_at.replace(tzinfo=dt.timezone.utc).timestamp())
+
+        logger.info(f"[LOG]: Updating {result.name} status to {result.is_up} at {time_}")
+        rows.append((result.name, time_, result.is_up))
+        if result.latency is not None:
+            timings.append((result.name, time_, result.status_code, result.latency, result.dns, result.connect,
+                            result.tls, result.ttfb))
+
+    # The database and the json file are written from threads: the requests and the streams are served meanwhile
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, functools.partial(sql.insert_probe_results, rows, timings=timings))
+    await loop.run_in_executor(None, functools.partial(services.flush, debounce=FLUSH_DEBOUNCE))
+    # Share the new statuses with the other workers
+    await services.save_snapshot()
+
+    # The responses built before are now outdated
+    newGeneration()
+
+    # Take a snapshot of the database for the downloads every BACKUP_INTERVAL (in a thread: it reads the whole file)
+    global last_backup
+    if last_backup is None or time.monotonic() - last_backup >= backup.BACKUP_INTERVAL:
+        last_backup = time.monotonic()
+        try:
+            await loop.run_in_executor(None, backup.make_backup)
+        except Exception as e:
+            logger.error(f"[LOG]: Could not take a snapshot of the database: {e}")
+
+    # Compact, archive and drop the expired history every RETENTION_INTERVAL (in a thread: it may copy whole months)
+    global last_retention
+    if last_retention is None or time.monotonic() - last_retention >= retention.RETENTION_INTERVAL:
+        last_retention = time.monotonic()
+        try:
+            await loop.run_in_executor(None, retention.apply_retention)
+        except Exception as e:
+            logger.error(f"[LOG]: Could not apply the retention policy: {e}")
+
+
+# The website ##########################################################################################################
+# Its routes are added to the FastAPI app at the end, after the API routes (`/{service}` would catch `/api` otherwise)
+website = APIRouter(include_in_schema=False, default_response_class=HTMLResponse)
 
-    # Close the connection
-    conn.close()
-
-    logger.info("[LOG]: Finished Refreshing the services")
-
-
-
-# ------------------ Start the Flask app ------------------
-app = Flask("UCLouvainDown")
-
-LANGUAGES=["en", "fr"]
 wanted_language = None
 
-def get_locale():
+def get_locale(request: Request):
     if wanted_language is None:
-        return request.accept_languages.best_match(LANGUAGES)
+        return best_match(request.headers.get("accept-language", ""))
     return wanted_language
 
-babel = Babel(app, locale_selector=get_locale)
 
-
-@app.route("/")
-async def index():
+@website.get("/")
+async def index(request: Request):
     """Render homepage, with an overview of all services."""
     logger.info(f"[LOG]: HTTP request for homepage")
-    return render_template("index.html", serviceList=all_service_details().root.values(), get_locale=get_locale())
-
-@app.route("/language")
-def languageChange():
+    locale = get_locale(request)
+    return render_cache.get_or_render(
+        ("index", None, locale),
+        lambda: render_template(request, "index.html", locale, serviceList=services.root.values(),
+                                get_locale=locale))
+
+@website.get("/language")
+async def languageChange(request: Request):
     global wanted_language
-    user_language = request.args.get("choice")
+    user_language = request.query_params.get("choice")
     
     logger.info(f"[LOG]: User requested {user_language} language")
     
@@ -121,20 +147,20 @@ def languageChange():
     logger.warning(f"[LOG]: User passed a non supported language")
     return "400"
 
-@app.route("/serviceList")
-def serviceList():
+@website.get("/serviceList")
+async def serviceList(request: Request):
     dictService = []
     
     for service in services:
         dictService.append(dict(service=service, reportedStatus=service.is_up_user))
-    return render_template("serviceList.html", servicesInfo=dictService)
+    return render_template(request, "serviceList.html", get_locale(request), servicesInfo=dictService)
 
 
-@app.route("/request")
-def requestServie():
-    serviceName = request.args.get('service-name', "")
-    url = request.args.get('url', "")
-    info = request.args.get('info', "")
+@website.get("/request")
+async def requestServie(request: Request):
+    serviceName = request.query_params.get('service-name', "")
+    url = request.query_params.get('url', "")
+    info = request.query_params.get('info', "")
     
     # No form submitted No feedback
     feedback = "" 
@@ -144,110 +170,189 @@ def requestServie():
         # IF I REMOVE THIS LINE NO MORE NEED FOR THAT DEPRECATED FILE
         feedback = "Form submitted successfully!"
 
-    return render_template("request.html", feedback=feedback)
+    return render_template(request, "request.html", get_locale(request), feedback=feedback)
 
 
 # To handle error reporting
-@app.route('/process', methods=['GET'])
-def process():
-    user_choice = request.args.get('choice', 'default_value')
-    service = request.args.get('service', None)
+@website.get('/process')
+async def process(request: Request):
+    user_choice = request.query_params.get('choice', 'default_value')
+    service = request.query_params.get('service', None)
+    _ = gettext_function(get_locale(request))
+    # Buffered, and written in batches (see `reports.py`): the request never waits on the database
+    # Behind the router of the host, the address of the user comes from `X-Forwarded-For` (see the `Procfile`)
+    client = request.client.host if request.client is not None else ""
 
     if user_choice == 'yes':
-        logger.info('Great! The website is working for you.')
-        
-        ### HERE GOES THE SQL FOR USER REPORT
-
+        if service in services.root:
+            reports.submit(service, client, True)
         return _('Great! The website is working for you.')
     elif user_choice == 'no':
-        logger.info('The website is down for me too.')
-        
-        ### HERE GOES THE SQL FOR USER REPORT
-
-
+        if service in services.root:
+            reports.submit(service, client, False)
         return _('The website is down for me too.')
     else:
         return _('Invalid choice or no choice provided')
 
 
-@app.route("/extract")
-def extractLog():
-    get_what_to_extract = request.args.get("get")
-
-    if get_what_to_extract.lower() == "all" or get_what_to_extract.lower == "outage":
-        # send the data/outage.sqlite3 file
-        return send_from_directory("data", "outage.sqlite3")
-    # Make some smarter query using SQL
-    else:
-        return render_template("404.html")
-
-
-@app.route('/robots.txt')
-@app.route('/sitemap.xml')
-def static_from_root():
-    return send_from_directory(app.static_folder, request.path[1:])   
+EXPORT_FORMATS = {"csv": (export.csv_chunks, "text/csv"), "ndjson": (export.ndjson_chunks, "application/x-ndjson")}
+EXPORT_SOURCES = {"probe": [sql.SOURCE_PROBE], "user": [sql.SOURCE_USER], "all": [sql.SOURCE_PROBE, sql.SOURCE_USER]}
 
-@app.route("/info")
-def info_website():
-    return render_template("info.html")
 
-
-@app.route("/<service>")
-async def service_details_app(service: str):
-    """Render a page with details of one service."""
-    if service not in services:
-        return page_not_found()
-    print(f"[LOG]: HTTP request for {service}")
+@website.get("/extract")
+async def extractLog(request: Request):
     """
-    data: looks like this: {"time": ["2021-10-10 10:10:10"], "status": [1]}
+    Download the history: `?get=all` for the whole database (its latest snapshot, gzipped), else the statuses,
+    streamed as CSV (`format=csv`, the default) or newline-delimited json (`format=ndjson`). They can be filtered with
+    `service` (repeated for several services), `from` and `to` (unix timestamps) and `source` (`probe`, `user` or
+    `all`), and compressed with `gzip=1`.
     """
-    timeArray, UPArray = sql.get_latest_status(service)
-    userTimeArray, userUPArray = sql.get_latest_user_report(service)
-    percent_up = sql.get_percentage_uptime(service)
-    percent_down = 1 - percent_up
-        
-    return render_template("itemWebsite.html", service=service_details(service), data={"time": timeArray, "status": UPArray}, data_user={"time": userTimeArray, "status": userUPArray} , percent={"up": percent_up, "down": percent_down})
-
-
-@app.errorhandler(404)
-def page_not_found(_=None):
-    return render_template("404.html")
-
-# Setup Scheduler to periodically check the status of the website
-# When the scheduler need to be stopped
-
-fd = acquire("myfile.lock")
-
-if fd is None:
-    logger.error("[LOG]: Could not acquire lock, exiting.")
-    @asynccontextmanager
-    async def lifespan(api: FastAPI):
-        #Dummy
-        yield
-else:
-    jobStores = {
-        "default": MemoryJobStore()
-    }
-
-    scheduler = AsyncIOScheduler(jobstores=jobStores, timezone="UTC")
-
-    # Execute the refreshServices function every RECHECK_AFTER minutes
-    @scheduler.scheduled_job("interval", seconds=RECHECK_AFTER, next_run_time=dt.datetime.utcnow())
-    def scheduledRefresh():
-        refreshServices() 
-    
-    @asynccontextmanager
-    async def lifespan(api: FastAPI):
-        # Start the scheduler
-        scheduler.start()
-        yield
-        # Stop the scheduler
-        scheduler.shutdown()
+    get_what_to_extract = request.query_params.get("get")
+
+    if get_what_to_extract is not None:
+        if get_what_to_extract.lower() in ("all", "outage"):
+            # send the latest snapshot of data/outage.sqlite3 (supports Range requests, to resume a download)
+            path = backup.latest_backup()
+            if path is None:
+                return HTMLResponse("The database is not available yet, please retry in a few minutes.",
+                                    status_code=503, headers={"Retry-After": str(RECHECK_AFTER)})
+            return FileResponse(path, media_type="application/gzip", filename="outage.sqlite3.gz")
+        return page_not_found(request)
+
+    params = request.query_params
+    service_names = params.getlist("service") or sorted(services.names)
+    try:
+        start = int(params.get("from", 0))
+        end = int(params["to"]) if "to" in params else None
+        encode, media_type = EXPORT_FORMATS[params.get("format", "csv")]
+        sources = EXPORT_SOURCES[params.get("source", "all")]
+    except (KeyError, ValueError):
+        return page_not_found(request)
+    if any(name not in services for name in service_names):
+        return page_not_found(request)
+
+    # The rows are read, encoded and compressed batch by batch (in the thread pool), while they are sent
+    batches = sql.export_probe_results(service_names, start, end, sources)
+    chunks = encode(batches)
+    filename = f"outage.{params.get('format', 'csv')}"
+    if params.get("gzip") in ("1", "true"):
+        chunks, media_type, filename = export.gzip_chunks(chunks), "application/gzip", filename + ".gz"
+    return export.ExportResponse(batches, chunks, media_type=media_type,
+                                 headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+@website.get('/robots.txt')
+@website.get('/sitemap.xml')
+async def static_from_root(request: Request):
+    return FileResponse(os.path.join("static", request.url.path[1:]))
+
+@website.get("/info")
+async def info_website(request: Request):
+    return render_template(request, "info.html", get_locale(request))
+
+
+SERVICE_PAGE_INCIDENTS = 10  # Latest incidents listed on the page of a service
+SERVICE_PAGE_HISTORY = 7 * 24 * 3600  # [s] Range of the uptime chart of the page of a service
+SERVICE_PAGE_HISTORY_POINTS = 168  # Maximal number of points of that chart: one per hour
+
+
+@website.get("/{service}")
+def service_details_app(request: Request, service: str):
+    """Render a page with details of one service (in the thread pool: a page not cached yet reads the database)."""
+    if service not in services:
+        return page_not_found(request)
+    logger.info(f"[LOG]: HTTP request for {service}")
+    locale = get_locale(request)
+
+    def render():
+        """
+        data: looks like this: {"time": ["2021-10-10 10:10:10"], "status": [1]}
+        """
+        timeArray, UPArray = sql.get_latest_status(service)
+        userTimeArray, userUPArray = sql.get_latest_user_report(service)
+        percent_up = sql.get_percentage_uptime(service)
+        percent_down = 1 - percent_up
+        _, latency = sql.get_latency_stats(service)
+        uptime = sql.get_uptime(service)
+        now = int(time.time())
+        _, points = sql.get_history(service, now - SERVICE_PAGE_HISTORY, now + 1, SERVICE_PAGE_HISTORY_POINTS)
+        history = {"time": [dt.datetime.fromtimestamp(ts).strftime('%d/%m %H:%M') for ts, *_ in points],
+                   "uptime": [round(up / samples, 3) for _, samples, up, _, _ in points]}
+        incidents = incidents_content(service, limit=SERVICE_PAGE_INCIDENTS)
+        for incident in incidents["incidents"]:
+            incident["started"] = dt.datetime.fromtimestamp(incident["start"]).strftime('%Y-%m-%d %H:%M')
+
+        return render_template(request, "itemWebsite.html", locale, service=services.get_service(service), data={"time": timeArray, "status": UPArray}, data_user={"time": userTimeArray, "status": userUPArray} , percent={"up": percent_up, "down": percent_down}, latency=latency, uptime=uptime, history=history, incidents=incidents)
+
+    # The chart of the user reports changes with each batch of reports, not only with the refresh generation
+    return render_cache.get_or_render(("service", service, locale, reports_generation), render)
+
+
+def page_not_found(request: Request) -> HTMLResponse:
+    return HTMLResponse(render_template(request, "404.html", get_locale(request)), status_code=404)
+
+# Setup the scheduler that checks the status of each service when it is due (see `probe_scheduler.py`)
+# Only one worker (the leader) probes the services, see `cluster.py`
+# The connections (and DNS lookups) of the probes are reused for the lifetime of the application
+probe_client = ProbeClient()
+probe_scheduler = ProbeScheduler(services, probe_client, recordProbes)
+leadership = Leadership()
+
+
+async def becomeLeader():
+    """Start the probes and the delivery of the webhook callbacks, once this worker is the leader."""
+    # The statuses and webhooks changed by the previous leader
+    syncSharedState()
+    await deliveries.start()
+    # All services are probed right away, then each on its own schedule
+    probe_scheduler.start()
+
+
+async def resignLeadership():
+    """Stop the probes and the delivery of the webhook callbacks."""
+    await probe_scheduler.stop()
+    await deliveries.stop()
+
+
+def syncStatuses():
+    """Load the statuses and the version of the user reports changed by the other workers (or by a batch of reports)."""
+    global reports_generation
+    if services.load_snapshot():
+        newGeneration()
+    reports_generation = sql.get_version(sql.VERSION_REPORTS)
+
+
+def syncSharedState():
+    """Load the statuses and webhooks changed by the other workers."""
+    syncStatuses()
+    webhooks.reload()
+
+
+shared_state_sync = SharedStateSync(syncSharedState)
+
+
+@asynccontextmanager
+async def lifespan(api: FastAPI):
+    await status_stream.start()
+    await reports.start(syncStatuses)
+    probe_client.open()
+    shared_state_sync.start()
+    await leadership.start(becomeLeader)
+    yield
+    # Stop the scheduler
+    await leadership.stop(resignLeadership)
+    await shared_state_sync.stop()
+    await reports.stop()
+    probe_client.close()
+    await status_stream.stop()
+    # Write pending changes of the services before exiting
+    services.flush()
+    db.pool.close()
 
 
 
 # Define the FastAPI app and its routes ################################################################################
-# !!! DO NOT move the `api.mount(...)` statement before the `@api....` functions !!! ###################################
+# !!! DO NOT move the `api.include_router(website)` statement before the `@api....` functions !!! ######################
 api = FastAPI(
     title="UCLouvainDown API",
     version="v0.1.0",
@@ -262,6 +367,9 @@ api = FastAPI(
         is a graphic representation of the same data.</li>
       <li>A webhook interface is also provided, please refer to [the webhook section](/api/docs#tag/Webhooks) of the 
         documentation for the details.</li>
+      <li>The statuses only change when the services are checked again, every few minutes. The status endpoints tell
+        until when their responses can be cached (`Cache-Control`), and answer `304 Not Modified` to requests with
+        the `ETag` of the current response in `If-None-Match`.</li>
     </ul>
     An issue or request? Please let us know [over on github](https://github.com/Tfloow/UCLouvainDown).
     """,
@@ -297,6 +405,40 @@ webhook_403_response = JSONResponse(
 webhook_404_response = JSONResponse(
     content={"detail": "The webhook for which modifications were asked can't be found."},
     status_code=404)
+history_cursor_400_response = JSONResponse(
+    content={"detail": "Invalid cursor: pass the `next_cursor` of the previous page as is."},
+    status_code=400)
+not_modified_response = {"description": "The client already has the current version of the response (see the `ETag` "
+                                        "and `Last-Modified` headers of the responses)."}
+
+
+def time_until_refresh(service: str | None = None) -> float:
+    """
+    The time left until the next probe of a service [s], estimated from the last one on the other workers.
+
+    :param service: the only service the response depends on, `None` if it depends on all of them
+    """
+    next_probe = probe_scheduler.time_until_next(None if service is None else [service])
+    if next_probe is not None:
+        return next_probe
+    service_ = services.get_service(service) if service is not None else None
+    last_checked = services.last_checked if service_ is None else service_.last_checked
+    return PROBE_INTERVAL - (dt.datetime.utcnow() - last_checked).total_seconds()
+
+
+def snapshot_response(request_: Request, snapshot: ApiSnapshot, body: bytes, service: str | None = None) -> Response:
+    """
+    Serve a pre-serialized response, with the caching headers of its refresh generation (see `http_cache.py`).
+
+    :param snapshot: the snapshot from which the response comes
+    :param body: the json body of the response
+    :param service: the only service the response depends on, `None` if it depends on all of them
+    :returns: the response, or a `304 Not Modified` response if the client already has it
+    """
+    headers = http_cache.cache_headers(snapshot.generation, snapshot.last_modified, time_until_refresh(service))
+    if http_cache.not_modified(request_.headers, snapshot.generation, snapshot.last_modified):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 # FastAPI routes
@@ -307,23 +449,24 @@ webhook_404_response = JSONResponse(
         "200": {"content": {"application/json": {"schema": {"examples": [["Inginious", "ADE-scheduler"]]}}}}
     }
 )
-def services_overview():
+async def services_overview():
     """
     Get a list of the names of all services that are tracked (that is, regularly checked on their status) by this
     application. This are the only names accepted in requests requiring a service name, such as for example
     [`service_details`](/api/docs#operation/service_details).
     """
-    return services.names
+    return Response(content=api_snapshot.overview, media_type="application/json")
 
 
 @api.get(
     "/api/services/up/all",
     response_model=Dict[str, bool],
     responses={"200": {"content": {"application/json": {"schema": {"examples": [
-        {"Inginious": True, "ADE-scheduler": False}]}}}}
+        {"Inginious": True, "ADE-scheduler": False}]}}}},
+        "304": not_modified_response
     }
 )
-def all_service_statuses():
+async def all_service_statuses(request_: Request):
     """
     Get the current status (up or down) for all tracked services. The keys in the response are the name of a
     tracked service, values are booleans: `true` means the service is up and running, `false` means it is down.
@@ -336,7 +479,8 @@ def all_service_statuses():
      [`All Service Details` endpoint](/api/docs#operation/all_service_details) or the
      [`Service Details` endpoint](/api/docs#operation/service_details).*
     """
-    return {service.name: service.is_up for service in services.root}
+    snapshot = api_snapshot
+    return snapshot_response(request_, snapshot, snapshot.statuses)
 
 
 @api.get(
@@ -344,10 +488,12 @@ def all_service_statuses():
     response_model=bool,
     responses={
         "200": {"content": {"application/json": {"schema": {"title": None}}}},
+        "304": not_modified_response,
         "404": {"detail": "Service not tracked", "model": HTTPError}
     }
 )
-def service_status(
+async def service_status(
+        request_: Request,
         service: Annotated[
             str,
             Path(
@@ -366,17 +512,19 @@ def service_status(
 
     Service shall be a valid service, werkzeug already checks this for us with the enumeration of supported services.
     """
-    if service not in services:
+    snapshot = api_snapshot
+    if service not in snapshot.service_statuses:
         return api_unkown_service_response
 
-    return services.get_service(service).is_up
+    return snapshot_response(request_, snapshot, snapshot.service_statuses[service], service)
 
 
 @api.get(
     "/api/services/all",
-    response_model=Services
+    response_model=Services,
+    responses={"304": not_modified_response}
 )
-def all_service_details():
+async def all_service_details(request_: Request):
     """
     Get the following information on all tracked services:
       * The service url.
@@ -388,17 +536,46 @@ def all_service_details():
     **Note**: *for most applications, the details for only a few services are needed. Please use the
       [`service details endpoint`](/api/docs#operation/service_details) instead in those cases!*
     """
-    return services
+    snapshot = api_snapshot
+    return snapshot_response(request_, snapshot, snapshot.details)
+
+
+@api.get(
+    "/api/services/stream",
+    response_class=StreamingResponse,
+    responses={"200": {"content": {"text/event-stream": {"schema": {"type": "string", "examples": [
+        'event: snapshot\ndata: {"Inginious": {"name": "Inginious", "is_up": true, ...}, ...}\n\n'
+        'event: status\ndata: {"name": "Inginious", "is_up": false, ...}\n\n']}}}}}
+)
+async def service_stream():
+    """
+    Follow the status of all tracked services live, as [Server-Sent
+    Events](https://html.spec.whatwg.org/multipage/server-sent-events.html) (e.g. with an `EventSource` in a browser):
+      * A `snapshot` event is sent first, with the details of all services (as returned by the
+        [`All Service Details` endpoint](/api/docs#operation/all_service_details)).
+      * A `status` event is then sent each time the status of a service changes, with the details of that service (as
+        returned by the [`Service Details` endpoint](/api/docs#operation/service_details)).
+
+    **Note**: *clients that don't read the events fast enough are disconnected, they should reconnect and use the new
+    snapshot.*
+    """
+    def snapshot() -> bytes:
+        return encode_event("snapshot", services.model_dump(mode="json", by_alias=True))
+
+    return StreamingResponse(status_stream.subscribe(snapshot), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 @api.get(
     "/api/services/{service:str}",
     response_model=Service,
     responses={
+        "304": not_modified_response,
         "404": {"detail": "Service not tracked", "model": HTTPError}
     }
 )
-def service_details(
+async def service_details(
+        request_: Request,
         service: Annotated[
             str,
             Path(
@@ -420,10 +597,267 @@ def service_details(
 
     Service shall be a valid service, werkzeug already checks this for us with the enumeration of supported services.
     """
+    snapshot = api_snapshot
+    if service not in snapshot.service_details:
+        return api_unkown_service_response
+
+    return snapshot_response(request_, snapshot, snapshot.service_details[service], service)
+
+
+HISTORY_SOURCES = {"probe": sql.SOURCE_PROBE, "user": sql.SOURCE_USER}
+HISTORY_PAGE_SIZE = 1_000
+HISTORY_MAX_PAGE_SIZE = 10_000
+
+
+@api.get(
+    "/api/services/{service:str}/history",
+    response_model=ServiceHistory,
+    responses={
+        "400": {"detail": "Invalid cursor", "model": HTTPError},
+        "404": {"detail": "Service not tracked", "model": HTTPError}
+    }
+)
+def service_history(
+        service: Annotated[
+            str,
+            Path(
+                description="The service for which to get the history. It must be in the list of tracked services"
+                            "that can be requested at [this endpoint](/api/docs#operation/services_overview).")
+        ],
+        start: Annotated[int, Query(
+            alias="from", description="The unix timestamp from which to get the history (included).")] = 0,
+        end: Annotated[int | None, Query(
+            alias="to", description="The unix timestamp until which to get the history (excluded), now by default.")
+        ] = None,
+        source: Annotated[Literal["probe", "user"], Query(
+            description="`probe` for the statuses checked by the application, `user` for the user reports.")
+        ] = "probe",
+        cursor: Annotated[str | None, Query(
+            description="The `next_cursor` of the previous page, to get the next one.")] = None,
+        limit: Annotated[int, Query(
+            ge=1, le=HISTORY_MAX_PAGE_SIZE, description="The maximal number of statuses in the page.")
+        ] = HISTORY_PAGE_SIZE
+):
+    """
+    Get the history of the statuses of a service between two dates, in chronological order, page by page. The
+    timestamps and the statuses are returned as two arrays of the same length.
+
+    To get the next page, repeat the request with the `next_cursor` of the response as `cursor`: every page is as fast
+    to get as the first one. The last page has a `null` `next_cursor`.
+    """
+    if service not in services:
+        return api_unkown_service_response
+
+    after = None
+    if cursor is not None:
+        try:
+            after = tuple(int(value) for value in cursor.split("."))
+        except ValueError:
+            return history_cursor_400_response
+        if len(after) != 3:
+            return history_cursor_400_response
+
+    if end is None:
+        end = int(time.time()) + 1
+    # One row more than asked tells whether there is a next page
+    rows = sql.get_history_page(service, HISTORY_SOURCES[source], start, end, after, limit + 1)
+    next_cursor = ".".join(str(value) for value in rows[limit - 1]) if len(rows) > limit else None
+    rows = rows[:limit]
+
+    return JSONResponse(content={
+        "service": service,
+        "source": source,
+        "ts": [ts for ts, _, _ in rows],
+        "status": [status for _, status, _ in rows],
+        "next_cursor": next_cursor,
+    })
+
+
+CHART_RANGE = 7 * 24 * 3600  # [s] Range of the chart endpoint by default
+CHART_POINTS = 500
+CHART_MAX_POINTS = 2_000
+
+
+@api.get(
+    "/api/services/{service:str}/chart",
+    response_model=ServiceChart,
+    responses={
+        "404": {"detail": "Service not tracked", "model": HTTPError}
+    }
+)
+def service_chart(
+        service: Annotated[
+            str,
+            Path(
+                description="The service for which to get the history. It must be in the list of tracked services"
+                            "that can be requested at [this endpoint](/api/docs#operation/services_overview).")
+        ],
+        start: Annotated[int | None, Query(
+            alias="from", description="The unix timestamp from which to get the history (included), a week before "
+                                      "`to` by default.")] = None,
+        end: Annotated[int | None, Query(
+            alias="to", description="The unix timestamp until which to get the history (excluded), now by default.")
+        ] = None,
+        points: Annotated[int, Query(
+            ge=1, le=CHART_MAX_POINTS, description="The maximal number of points.")] = CHART_POINTS
+):
+    """
+    Get the history of the statuses of a service between two dates, downsampled to at most `points` points, e.g. to
+    draw a chart: the probes themselves if there are few enough of them, else the probes aggregated per hour or per
+    day. Any range costs about the same to get.
+    """
     if service not in services:
         return api_unkown_service_response
 
-    return services.get_service(service)
+    if end is None:
+        end = int(time.time()) + 1
+    if start is None:
+        start = end - CHART_RANGE
+    resolution, rows = sql.get_history(service, start, end, points)
+    return JSONResponse(content={
+        "service": service,
+        "resolution": resolution,
+        "ts": [row[0] for row in rows],
+        "samples": [row[1] for row in rows],
+        "up": [row[2] for row in rows],
+        "first_status": [row[3] for row in rows],
+        "last_status": [row[4] for row in rows],
+    })
+
+
+@api.get(
+    "/api/services/{service:str}/uptime",
+    response_model=ServiceUptime,
+    responses={
+        "304": not_modified_response,
+        "404": {"detail": "Service not tracked", "model": HTTPError}
+    }
+)
+def service_uptime(
+        request_: Request,
+        service: Annotated[
+            str,
+            Path(
+                description="The service for which to get the uptime. It must be in the list of tracked services"
+                            "that can be requested at [this endpoint](/api/docs#operation/services_overview).")
+        ]
+):
+    """
+    Get the fraction of the probes that found a service up over the last day, week and 30 days, and since it is
+    tracked.
+    """
+    snapshot = api_snapshot
+    if service not in snapshot.service_details:
+        return api_unkown_service_response
+
+    last_modified = snapshot.last_modified
+    headers = http_cache.cache_headers(snapshot.generation, last_modified, time_until_refresh(service))
+    if http_cache.not_modified(request_.headers, snapshot.generation, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    return JSONResponse(content={"service": service, "uptime": sql.get_uptime(service)}, headers=headers)
+
+
+@api.get(
+    "/api/services/{service:str}/latency",
+    response_model=ServiceLatency,
+    responses={
+        "304": not_modified_response,
+        "404": {"detail": "Service not tracked", "model": HTTPError}
+    }
+)
+def service_latency(
+        request_: Request,
+        service: Annotated[
+            str,
+            Path(
+                description="The service for which to get the latency. It must be in the list of tracked services"
+                            "that can be requested at [this endpoint](/api/docs#operation/services_overview).")
+        ]
+):
+    """
+    Get how fast a service answers:
+      * The timings of its latest probe: the total latency and its phases (DNS resolution, TCP connection, TLS
+        handshake and time to the first byte of the answer), and the HTTP status code.
+      * The median, 95th and 99th percentiles of its latency over the last hour, day and week. Only the probes that got
+        an answer count.
+
+    All durations are in seconds.
+    """
+    snapshot = api_snapshot
+    if service not in snapshot.service_details:
+        return api_unkown_service_response
+
+    # The latency windows slide between two refreshes: the current time bucket is part of the version
+    version, last_modified, max_age = http_cache.live_validators(snapshot.generation, snapshot.last_modified,
+                                                                 time_until_refresh(service))
+    headers = http_cache.cache_headers(version, last_modified, max_age)
+    if http_cache.not_modified(request_.headers, version, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    latest, windows = sql.get_latency_stats(service)
+    return JSONResponse(content={"service": service, "latest": latest, "windows": windows}, headers=headers)
+
+
+def incidents_content(service: str, start: int | None = None, end: int | None = None,
+                      limit: int = sql.INCIDENTS_LIMIT) -> dict:
+    """The incidents of a service and its MTTR and MTBF, as described by `ServiceIncidents`."""
+    rows, stats = sql.get_incidents(service, start, end, limit)
+    now = int(time.time())
+    return {
+        "service": service,
+        "incidents": [{"start": start_ts, "end": end_ts, "duration": (now if end_ts is None else end_ts) - start_ts,
+                       "ongoing": end_ts is None, "probes": probes, "user_reports": user_reports}
+                      for start_ts, end_ts, probes, user_reports in rows],
+        "count": stats["incidents"],
+        "mttr": stats["mttr"],
+        "mtbf": stats["mtbf"],
+    }
+
+
+@api.get(
+    "/api/services/{service:str}/incidents",
+    response_model=ServiceIncidents,
+    responses={
+        "304": not_modified_response,
+        "404": {"detail": "Service not tracked", "model": HTTPError}
+    }
+)
+def service_incidents(
+        request_: Request,
+        service: Annotated[
+            str,
+            Path(
+                description="The service for which to get the incidents. It must be in the list of tracked services"
+                            "that can be requested at [this endpoint](/api/docs#operation/services_overview).")
+        ],
+        start: Annotated[int | None, Query(
+            alias="from", description="Only the incidents ongoing at or after this unix timestamp.")] = None,
+        end: Annotated[int | None, Query(
+            alias="to", description="Only the incidents that started before this unix timestamp.")] = None,
+        limit: Annotated[int, Query(
+            ge=1, le=sql.INCIDENTS_LIMIT, description="The maximal number of incidents.")] = sql.INCIDENTS_LIMIT
+):
+    """
+    Get the incidents of a service, newest first: the periods during which the application found it down, from the
+    first probe that found it down to the first one that found it up again. The number of probes and of user reports
+    that confirmed each incident is given.
+
+    Also get the mean time to recovery (MTTR) and the mean time between failures (MTBF) of the service, over all its
+    incidents. All durations are in seconds.
+    """
+    snapshot = api_snapshot
+    if service not in snapshot.service_details:
+        return api_unkown_service_response
+
+    # An ongoing incident lasts longer between two refreshes: the current time bucket is part of the version
+    version, last_modified, max_age = http_cache.live_validators(snapshot.generation, snapshot.last_modified,
+                                                                 time_until_refresh(service))
+    headers = http_cache.cache_headers(version, last_modified, max_age)
+    if http_cache.not_modified(request_.headers, version, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    return JSONResponse(content=incidents_content(service, start, end, limit), headers=headers)
 
 
 # Purely for the openapi documentation for the webhook callbacks: create an APIRouter
@@ -570,8 +1004,17 @@ def custom_exception_handler(request_: Request, exc: RequestValidationError):
     )
 
 
-# Couple the Flask app and the FastAPI app #############################################################################
-api.mount("/", WSGIMiddleware(app))
+@api.exception_handler(StarletteHTTPException)
+def website_exception_handler(request_: Request, exc: StarletteHTTPException):
+    """Unknown pages of the website get the 404 page of the website, the API errors are left as they are."""
+    if exc.status_code == 404 and not request_.url.path.startswith("/api"):
+        return page_not_found(request_)
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail}, headers=exc.headers)
+
+
+# Add the website to the FastAPI app ###################################################################################
+api.mount("/static", StaticFiles(directory="static"), name="static")
+api.include_router(website)
 
 
 # Modify the openapi docs a little #####################################################################################
@@ -0,0 +1,78 @@
+"""
+Consistent snapshots of the database, for the downloads of the whole dataset (`/extract?get=all`).
+
+Every `BACKUP_INTERVAL` seconds, the worker probing the services copies the database with the SQLite online backup API,
+from a read transaction: the copy is consistent, and in WAL mode it never blocks the writer. The copy is compressed and
+moved into `BACKUP_DIRECTORY` atomically, and only the last `BACKUPS_KEPT` snapshots are kept. The downloads are served
+from the newest one and never touch the live database.
+"""
+import glob
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from db import pool
+from logger_config import *
+
+BACKUP_DIRECTORY = "data/backups"
+BACKUP_INTERVAL = 3600  # [s] Time between two snapshots
+BACKUPS_KEPT = 3
+BACKUP_PREFIX = "outage-"
+BACKUP_SUFFIX = ".sqlite3.gz"
+
+
+def list_backups(directory: str = BACKUP_DIRECTORY) -> list[str]:
+    """The paths of the snapshots, from the oldest to the newest."""
+    # The names contain a fixed-width timestamp: sorting them sorts the snapshots by date
+    return sorted(glob.glob(os.path.join(directory, f"{BACKUP_PREFIX}*{BACKUP_SUFFIX}")))
+
+
+def latest_backup(directory: str = BACKUP_DIRECTORY) -> str | None:
+    """The path of the newest snapshot, `None` if there is none yet."""
+    backups = list_backups(directory)
+    return backups[-1] if backups else None
+
+
+def make_backup(directory: str = BACKUP_DIRECTORY, kept: int = BACKUPS_KEPT) -> str:
+    """
+    Take a compressed snapshot of the database and delete the oldest ones (blocking, run it in a thread).
+
+    :param directory: where to store the snapshots
+    :param kept: the number of snapshots to keep
+    :returns: the path of the new snapshot
+    """
+    os.makedirs(directory, exist_ok=True)
+    start = time.monotonic()
+    path = os.path.join(directory, f"{BACKUP_PREFIX}{int(time.time()):012d}{BACKUP_SUFFIX}")
+
+    copy_fd, copy_filename = tempfile.mkstemp(dir=directory, suffix=".sqlite3.tmp")
+    os.close(copy_fd)
+    gz_fd, gz_filename = tempfile.mkstemp(dir=directory, suffix=".gz.tmp")
+    os.close(gz_fd)
+    try:
+        copy = sqlite3.connect(copy_filename)
+        try:
+            with pool.snapshot_reader() as source:
+                source.backup(copy)  # All pages in one step: a single consistent read transaction
+        finally:
+            copy.close()
+
+        with open(copy_filename, "rb") as f_in, gzip.open(gz_filename, "wb") as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        with open(gz_filename, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(gz_filename, path)
+    finally:
+        for filename in (copy_filename, gz_filename):
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    for old in list_backups(directory)[:-kept]:
+        os.remove(old)
+
+    logger.info(f"[LOG]: Database snapshot {path} taken in {time.monotonic() - start:.2f}s "
+                f"({os.path.getsize(path)} bytes)")
+    return path
@@ -0,0 +1,73 @@
+"""
+Benchmark of the status API served by the ASGI application (`app.api`): the latency of sequential requests and the
+throughput under concurrent clients, for each endpoint. The application is called in-process (no network), so
+the numbers only measure the cost of the web stack and of the serialization. The refresh job is not started.
+
+Usage (from the root of the repository): `python benchmarks/api.py`
+"""
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import httpx
+
+from app import api
+
+logging.getLogger("httpx").setLevel(logging.WARNING)  # One log line per request otherwise
+
+ENDPOINTS = ["/api/services/overview", "/api/services/up/all", "/api/services/up/ADE", "/api/services/all",
+         "/api/services/ADE"]
+REQUESTS = 500  # Sequential requests per endpoint, for the latency
+CONCURRENCY = 32  # Concurrent clients, for the throughput
+DURATION = 3  # [s] Duration of the throughput measurement of each endpoint
+
+
+async def latency(client: httpx.AsyncClient, endpoint: str) -> tuple[float, float]:
+    """Median and 95th percentile of the duration of `REQUESTS` sequential requests to `endpoint`, in ms."""
+    durations = []
+    for _ in range(REQUESTS):
+        start = time.perf_counter()
+        response = await client.get(endpoint)
+        durations.append((time.perf_counter() - start) * 1e3)
+        assert response.status_code == 200, f"{endpoint}: HTTP {response.status_code}"
+    return statistics.median(durations), statistics.quantiles(durations, n=20)[-1]
+
+
+async def throughput(client: httpx.AsyncClient, endpoint: str) -> float:
+    """Requests to `endpoint` served per second by `CONCURRENCY` concurrent clients."""
+    done = 0
+    deadline = time.perf_counter() + DURATION
+
+    async def worker():
+        nonlocal done
+        while time.perf_counter() < deadline:
+            await client.get(endpoint)
+            done += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+    return done / (time.perf_counter() - start)
+
+
+async def main():
+    transport = httpx.ASGITransport(app=api)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        for endpoint in ENDPOINTS:  # Warm up: fill the caches
+            await client.get(endpoint)
+
+        print(f"{'endpoint':<24} {'p50':>8} {'p95':>8} {'req/s':>8}  (latency in ms, {CONCURRENCY} clients for req/s)")
+        for endpoint in ENDPOINTS:
+            p50, p95 = await latency(client, endpoint)
+            rate = await throughput(client, endpoint)
+            print(f"{endpoint:<24} {p50:>8.3f} {p95:>8.3f} {rate:>8.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+"""
+Benchmark of the ingestion of the user reports (`/process`, see `reports.py`): the throughput of the endpoint under
+concurrent clients, then the rate at which reports of distinct clients are buffered and written to the database by the
+group commits. The application is called in-process (no network). The refresh job is not started, and the reports are
+written to the database of the repository: run it on a copy.
+
+Usage (from the root of the repository): `python benchmarks/reports.py`
+"""
+import asyncio
+import logging
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import httpx
+
+from app import api, services, syncStatuses
+from reports import reports
+
+logging.getLogger("httpx").setLevel(logging.WARNING)  # One log line per request otherwise
+
+CONCURRENCY = 32  # Concurrent clients, for the throughput of the endpoint
+DURATION = 3  # [s] Duration of the throughput measurement of the endpoint
+REPORTS = 50_000  # Reports of distinct clients, for the ingestion rate
+
+
+async def endpoint_throughput(client: httpx.AsyncClient) -> float:
+    """Reports to `/process` served per second by `CONCURRENCY` concurrent clients."""
+    done = 0
+    deadline = time.perf_counter() + DURATION
+
+    async def worker():
+        nonlocal done
+        while time.perf_counter() < deadline:
+            response = await client.get("/process", params={"choice": "no", "service": "ADE"})
+            assert response.status_code == 200, f"HTTP {response.status_code}"
+            done += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+    return done / (time.perf_counter() - start)
+
+
+async def ingestion_rate() -> float:
+    """Reports of distinct clients buffered and written to the database per second."""
+    names = list(services.root)
+    start = time.perf_counter()
+    for i in range(REPORTS):
+        reports.submit(names[i % len(names)], f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}", i % 3 != 0)
+        if i % 1000 == 999:
+            await asyncio.sleep(0)  # Let the flushes run, as between two requests
+    await reports.stop()  # Writes what is left
+    return REPORTS / (time.perf_counter() - start)
+
+
+async def main():
+    await reports.start(syncStatuses)
+    transport = httpx.ASGITransport(app=api)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        print(f"/process: {await endpoint_throughput(client):.0f} req/s ({CONCURRENCY} clients)")
+    print(f"ingestion: {await ingestion_rate():.0f} reports/s ({REPORTS} reports of distinct clients), "
+          f"{reports.accepted} accepted, {reports.duplicates} duplicates, {reports.dropped} dropped")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,60 @@
+"""
+Benchmark of the webhook subscription registry (`subscriptions.SubscriptionIndex`): the cost of creating, patching
+and deleting a webhook and of finding the webhooks to call back on a status change, for a growing number of
+registered webhooks. All of them should stay flat.
+
+Usage (from the root of the repository): `python benchmarks/subscriptions.py`
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from subscriptions import SubscriptionIndex
+
+SERVICES = [f"service-{i}" for i in range(15)]
+SIZES = [1_000, 10_000, 100_000]
+OPERATIONS = 10_000
+
+
+def random_services():
+    return random.sample(SERVICES, random.randint(1, 3))
+
+
+def timed(operation, *args) -> float:
+    """Average duration of `operation(i, *args)` over `OPERATIONS` calls, in µs."""
+    start = time.perf_counter()
+    for i in range(OPERATIONS):
+        operation(i, *args)
+    return (time.perf_counter() - start) / OPERATIONS * 1e6
+
+
+def main():
+    random.seed(0)
+    print(f"{'webhooks':>10} {'create':>10} {'patch':>10} {'delete':>10} {'fan-out':>10}  (µs/op, fan-out per "
+          f"subscriber)")
+    for size in SIZES:
+        index = SubscriptionIndex()
+        for hook_id in range(size):
+            index.subscribe(hook_id, random_services())
+
+        services = [random_services() for _ in range(OPERATIONS)]
+        create = timed(lambda i: index.subscribe(size + i, services[i]))
+        patch = timed(lambda i: index.subscribe(random.randrange(size), services[i]))
+        delete = timed(lambda i: index.unsubscribe(size + i))
+
+        # A status change of each service, visiting all webhooks to call back
+        notified = 0
+        start = time.perf_counter()
+        for service in SERVICES:
+            for _ in index.subscribers(service):
+                notified += 1
+        fan_out = (time.perf_counter() - start) / notified * 1e6
+
+        print(f"{size:>10} {create:>10.2f} {patch:>10.2f} {delete:>10.2f} {fan_out:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable
+
+from logger_config import *
+
+RENDER_CACHE_SIZE = 256  # Maximum number of rendered pages kept in memory
+
+
+class RenderCache:
+    """
+    A bounded LRU cache of rendered HTML pages. Each page is cached under its key and the refresh generation it was
+    rendered in: `invalidate` (called when a refresh cycle completes) starts a new generation, so pages rendered from
+    older data are never served again.
+    """
+
+    def __init__(self, max_entries: int = RENDER_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+        self.__entries: OrderedDict = OrderedDict()
+        self.__lock = threading.Lock()  # The pages may also be rendered from the threads of the sync routes
+
+    def get_or_render(self, key: Hashable, render: Callable[[], str]) -> str:
+        """
+        Get the page cached under `key` for the current generation, or render it with `render` and cache it.
+
+        :param key: identifies the page, e.g. `(page, service, locale)`
+        :param render: renders the page when it is not cached yet
+        :returns: the rendered page
+        """
+        with self.__lock:
+            full_key = (key, self.generation)
+            page = self.__entries.get(full_key)
+            if page is not None:
+                self.__entries.move_to_end(full_key)
+                self.hits += 1
+                return page
+            self.misses += 1
+
+        # Rendered outside the lock: the other pages can still be served meanwhile
+        page = render()
+
+        with self.__lock:
+            if full_key[1] == self.generation:  # Else a refresh completed during the rendering: the page is outdated
+                self.__entries[full_key] = page
+                self.__entries.move_to_end(full_key)
+                while len(self.__entries) > self.max_entries:
+                    self.__entries.popitem(last=False)
+
+        return page
+
+    def invalidate(self):
+        """Start a new generation: drop all cached pages."""
+        with self.__lock:
+            self.generation += 1
+            self.__entries.clear()
+
+        logger.info(f"[LOG]: Render cache invalidated (generation {self.generation}), {self.stats()}")
+
+    def stats(self) -> Dict[str, int]:
+        """The hit/miss counters and size of the cache."""
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.__entries),
+                "generation": self.generation}
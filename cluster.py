@@ -0,0 +1,102 @@
+"""
+Running the application in several worker processes (`uvicorn app:api --workers N`).
+
+A single worker, the leader, probes the services and delivers the webhook callbacks: the one holding the lock on
+`LEADER_LOCK_FILE` (see `lock.py`). The system releases the lock when its process dies and the other workers (the
+standbys) keep trying to take it, so one of them takes over within `LEADER_RETRY_INTERVAL` seconds, well within one
+probe interval.
+
+The leader shares the statuses it finds through the database (`Services.save_snapshot`). Every worker polls the
+database every `SYNC_INTERVAL` seconds and loads the latest statuses and webhooks when they changed
+(`Services.load_snapshot`, `Webhooks.reload`).
+"""
+import asyncio
+import os
+from typing import Awaitable, Callable
+
+from lock import release, try_acquire
+from logger_config import *
+
+LEADER_LOCK_FILE = "myfile.lock"
+LEADER_RETRY_INTERVAL = 10  # [s] How often the standbys try to take the lock of the leader
+SYNC_INTERVAL = 5  # [s] How often each worker checks the database for changes made by the other workers
+
+
+class Leadership:
+    """The election of the worker probing the services, see the module documentation."""
+
+    def __init__(self, lock_file: str = LEADER_LOCK_FILE, retry_interval: float = LEADER_RETRY_INTERVAL):
+        self.lock_file = lock_file
+        self.retry_interval = retry_interval
+
+        self.__fd: int | None = None
+        self.__standby: asyncio.Task | None = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self.__fd is not None
+
+    async def start(self, on_elected: Callable[[], Awaitable[None]]):
+        """
+        Become the leader if no other worker is, else keep trying in the background until the leader dies.
+
+        :param on_elected: called once this worker becomes the leader
+        """
+        if self.__try_acquire():
+            await on_elected()
+        else:
+            logger.info("[LOG]: Another worker is the leader, standing by")
+            self.__standby = asyncio.create_task(self.__stand_by(on_elected))
+
+    async def stop(self, on_resign: Callable[[], Awaitable[None]] = None):
+        """
+        Stop standing by, or give up the leadership.
+
+        :param on_resign: called before giving up the leadership (while no other worker can take it yet)
+        """
+        if self.__standby is not None:
+            self.__standby.cancel()
+            await asyncio.gather(self.__standby, return_exceptions=True)
+            self.__standby = None
+        if self.__fd is not None:
+            if on_resign is not None:
+                await on_resign()
+            self.__fd = release(self.__fd)
+
+    def __try_acquire(self) -> bool:
+        self.__fd = try_acquire(self.lock_file)
+        if self.__fd is not None:
+            logger.info(f"[LOG]: Worker {os.getpid()} is now the leader")
+        return self.__fd is not None
+
+    async def __stand_by(self, on_elected: Callable[[], Awaitable[None]]):
+        while not self.__try_acquire():
+            await asyncio.sleep(self.retry_interval)
+        await on_elected()
+
+
+class SharedStateSync:
+    """Calls `sync` every `interval` seconds, in the background, to load the changes made by the other workers."""
+
+    def __init__(self, sync: Callable[[], None], interval: float = SYNC_INTERVAL):
+        self.sync = sync
+        self.interval = interval
+
+        self.__task: asyncio.Task | None = None
+
+    def start(self):
+        self.__task = asyncio.create_task(self.__run())
+
+    async def stop(self):
+        if self.__task is not None:
+            self.__task.cancel()
+            await asyncio.gather(self.__task, return_exceptions=True)
+            self.__task = None
+
+    async def __run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.sync()
+            except Exception as e:  # Never stop syncing: the next attempt may succeed
+                logger.error(f"[LOG]: Could not load the shared state: {e}")
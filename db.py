@@ -0,0 +1,123 @@
+"""
+Shared connections to the SQLite database (`data/outage.sqlite3`).
+
+The database runs in WAL mode, so the readers (the web routes) never block on the writer (the refresh job) and the
+other way around. Readers take a connection from a small pool, all writes go through a single dedicated connection.
+Each connection keeps a cache of prepared statements, so the queries of `sql.py` are only compiled once per connection.
+"""
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+DATABASE = "data/outage.sqlite3"
+READ_POOL_SIZE = 4  # Maximum number of reading connections
+BUSY_TIMEOUT = 5  # [s] How long to wait on a lock of another connection before failing
+STATEMENT_CACHE_SIZE = 256  # Prepared statements kept per connection
+
+
+class ConnectionPool:
+    """A pool of reading connections and a single writing connection to a SQLite database."""
+
+    def __init__(self, database: str = DATABASE, read_pool_size: int = READ_POOL_SIZE,
+                 busy_timeout: float = BUSY_TIMEOUT):
+        self.database = database
+        self.read_pool_size = read_pool_size
+        self.busy_timeout = busy_timeout
+
+        self.__readers: queue.LifoQueue = queue.LifoQueue()
+        self.__reader_count = 0
+        self.__reader_count_lock = threading.Lock()
+        self.__writer: sqlite3.Connection | None = None
+        self.__writer_lock = threading.RLock()
+
+    def __connect(self, read_only: bool) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.database, timeout=self.busy_timeout, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout * 1000)}")
+        if read_only:
+            conn.execute("PRAGMA query_only = ON")
+        else:
+            # The journal mode is persistent: setting it once from the writer is enough for every connection
+            conn.execute("PRAGMA journal_mode = WAL")
+            # Safe in WAL mode: a power loss can only lose the last commits, never corrupt the database
+            conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a reading connection from the pool (blocks if all `read_pool_size` connections are in use)."""
+        try:
+            conn = self.__readers.get_nowait()
+        except queue.Empty:
+            with self.__reader_count_lock:
+                create = self.__reader_count < self.read_pool_size
+                if create:
+                    self.__reader_count += 1
+            if create:
+                self.writer_connection()  # Makes sure the database is in WAL mode before it's read
+                conn = self.__connect(read_only=True)
+            else:
+                conn = self.__readers.get()
+
+        try:
+            yield conn
+        finally:
+            self.__readers.put(conn)
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        """
+        Get exclusive use of the writing connection. The transaction is committed when leaving the `with` block, or
+        rolled back if an exception was raised.
+        """
+        with self.__writer_lock:
+            conn = self.writer_connection()
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                conn.commit()
+
+    @contextmanager
+    def snapshot_reader(self) -> Iterator[sqlite3.Connection]:
+        """
+        Open a dedicated reading connection, outside the pool, for long reads (e.g. a download): it doesn't hold a
+        pooled connection for its whole duration, and all its reads see the same snapshot of the database, whatever is
+        written meanwhile. The connection is closed when leaving the `with` block.
+        """
+        self.writer_connection()  # Makes sure the database is in WAL mode before it's read
+        conn = self.__connect(read_only=True)
+        try:
+            conn.execute("BEGIN")
+            yield conn
+        finally:
+            conn.close()
+
+    def writer_connection(self) -> sqlite3.Connection:
+        """The writing connection itself, prefer `writer` which serializes its use."""
+        with self.__writer_lock:
+            if self.__writer is None:
+                self.__writer = self.__connect(read_only=False)
+            return self.__writer
+
+    def close(self):
+        """Close all connections of the pool. Connections are opened again if the pool is used afterwards."""
+        with self.__writer_lock:
+            if self.__writer is not None:
+                self.__writer.close()
+                self.__writer = None
+
+        with self.__reader_count_lock:
+            while True:
+                try:
+                    self.__readers.get_nowait().close()
+                except queue.Empty:
+                    break
+                self.__reader_count -= 1
+
+
+pool = ConnectionPool()
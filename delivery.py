@@ -0,0 +1,227 @@
+"""
+Asynchronous delivery of the webhook callbacks.
+
+Status changes only enqueue their callbacks (see `DeliveryQueue.enqueue`): the probes never wait on a subscriber. A
+pool of worker tasks drains the queue, with a timeout on each attempt, retries with exponential backoff, a cap on the
+number of simultaneous deliveries to the same host, and a dead-letter record of the callbacks that could not be
+delivered.
+
+The callbacks wait in one FIFO per host. A worker only takes the next callback of a host that is below its cap, so a
+slow or dead subscriber holds at most `DELIVERY_PER_HOST` workers: the callbacks to the other hosts keep flowing.
+"""
+import asyncio
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, Set
+from urllib.parse import urlsplit
+
+import requests
+
+from logger_config import *
+import sql
+
+DELIVERY_WORKERS = 8  # Number of callbacks delivered at the same time
+DELIVERY_PER_HOST = 2  # Maximum number of callbacks delivered at the same time to the same host
+DELIVERY_TIMEOUT = (5, 10)  # [s] (connect, read) timeouts of each attempt
+DELIVERY_MAX_ATTEMPTS = 5
+DELIVERY_BACKOFF = 2  # [s] Delay before the first retry, doubled after each attempt
+DELIVERY_QUEUE_SIZE = 10_000  # Callbacks waiting for delivery, the next ones go to the dead letters directly
+DEAD_LETTERS_KEPT = 1_000  # Dead letters kept in memory (all of them are stored in the database)
+
+
+@dataclass
+class Delivery:
+    """A callback to deliver."""
+    hook_id: int
+    url: str
+    payload: bytes
+    attempts: int = 0
+    error: str | None = None
+
+
+class DeliveryQueue:
+    """An in-process queue of webhook callbacks, drained by a pool of worker tasks. See the module documentation."""
+
+    def __init__(self, workers: int = DELIVERY_WORKERS, per_host: int = DELIVERY_PER_HOST,
+                 max_attempts: int = DELIVERY_MAX_ATTEMPTS, backoff: float = DELIVERY_BACKOFF,
+                 timeout: tuple[float, float] = DELIVERY_TIMEOUT, max_size: int = DELIVERY_QUEUE_SIZE):
+        self.workers = workers
+        self.per_host = per_host
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.timeout = timeout
+        self.max_size = max_size
+
+        self.delivered = 0
+        self.dead_letters: Deque[Delivery] = deque(maxlen=DEAD_LETTERS_KEPT)
+
+        self.__loop: asyncio.AbstractEventLoop | None = None
+        self.__pending: Dict[str, Deque[Delivery]] = {}  # Deliveries waiting for a worker, per host
+        self.__size = 0  # Deliveries in `__pending`
+        # Per host, the deliveries in flight plus its entries in `__ready`: at most `per_host`
+        self.__slots: Dict[str, int] = {}
+        self.__ready: asyncio.Queue | None = None  # One entry per delivery that a worker may start, its host
+        self.__tasks: list[asyncio.Task] = []
+        self.__retries: Dict[asyncio.TimerHandle, Delivery] = {}  # Deliveries waiting for their next attempt
+        self.__storing: Set[asyncio.Task] = set()  # Dead letters being written to the database
+        self.__pool: ThreadPoolExecutor | None = None
+        self.__session: requests.Session | None = None
+
+    @property
+    def running(self) -> bool:
+        return self.__loop is not None
+
+    async def start(self):
+        """Start the worker tasks on the running event loop."""
+        self.__loop = asyncio.get_running_loop()
+        self.__ready = asyncio.Queue()
+        self.__pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="webhook")
+        self.__session = requests.Session()
+        self.__tasks = [asyncio.create_task(self.__worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Stop the worker tasks. The callbacks not delivered yet are recorded as dead letters."""
+        if not self.running:
+            return
+
+        for task in self.__tasks:
+            task.cancel()
+        await asyncio.gather(*self.__tasks, return_exceptions=True)
+        for handle, delivery in self.__retries.items():
+            handle.cancel()
+            self.__dead_letter(delivery, "Not delivered before shutdown")
+        self.__retries.clear()
+
+        for pending in self.__pending.values():
+            for delivery in pending:
+                self.__dead_letter(delivery, "Not delivered before shutdown")
+        self.__pending.clear()
+        self.__slots.clear()
+        self.__size = 0
+        await asyncio.gather(*self.__storing, return_exceptions=True)
+
+        self.__pool.shutdown(wait=False, cancel_futures=True)
+        self.__session.close()
+        self.__loop = None
+
+    def enqueue(self, hook_id: int, url: str, payload: Any):
+        """
+        Queue a callback for delivery, without waiting on it. Can be called from any thread.
+
+        :param hook_id: the id of the webhook to which the callback belongs
+        :param url: the url to which to `POST` the callback
+        :param payload: the body of the callback, serialized to json right away
+        """
+        delivery = Delivery(hook_id=hook_id, url=str(url), payload=json.dumps(payload).encode())
+        if not self.running:
+            self.__dead_letter(delivery, "Delivery queue not running")
+            return
+
+        try:
+            in_loop = asyncio.get_running_loop() is self.__loop
+        except RuntimeError:
+            in_loop = False
+        if in_loop:
+            self.__put(delivery)
+        else:
+            self.__loop.call_soon_threadsafe(self.__put, delivery)
+
+    def __put(self, delivery: Delivery):
+        if self.__size >= self.max_size:
+            self.__dead_letter(delivery, "Delivery queue full")
+            return
+
+        host = urlsplit(delivery.url).netloc
+        self.__pending.setdefault(host, deque()).append(delivery)
+        self.__size += 1
+        if self.__slots.get(host, 0) < self.per_host:
+            self.__slots[host] = self.__slots.get(host, 0) + 1
+            self.__ready.put_nowait(host)
+
+    def __release(self, host: str):
+        """A delivery to `host` is over: let a worker start its next one, or free the slot."""
+        if self.__pending.get(host):
+            self.__ready.put_nowait(host)
+            return
+
+        self.__slots[host] -= 1
+        if not self.__slots[host]:
+            del self.__slots[host]
+            self.__pending.pop(host, None)
+
+    def __post(self, delivery: Delivery) -> tuple[bool, bool]:
+        """Make one delivery attempt (blocking). Returns whether it succeeded and whether it may be retried."""
+        try:
+            response = self.__session.post(delivery.url, data=delivery.payload, timeout=self.timeout,
+                                           headers={"Content-Type": "application/json"})
+        except requests.RequestException as e:
+            delivery.error = type(e).__name__
+            return False, True
+
+        if response.status_code < 400:
+            return True, False
+        delivery.error = f"HTTP {response.status_code}"
+        # Other client errors won't be solved by retrying
+        return False, response.status_code >= 500 or response.status_code in (408, 429)
+
+    async def __worker(self):
+        while True:
+            host = await self.__ready.get()
+            delivery = self.__pending[host].popleft()
+            self.__size -= 1
+            try:
+                delivery.attempts += 1
+                success, retry = await self.__loop.run_in_executor(self.__pool, self.__post, delivery)
+            except Exception as e:  # Never let a worker die
+                success, retry = False, False
+                delivery.error = type(e).__name__
+            finally:
+                self.__release(host)
+
+            if success:
+                self.delivered += 1
+            elif retry and delivery.attempts < self.max_attempts:
+                delay = self.backoff * 2 ** (delivery.attempts - 1)
+                logger.info(f"[LOG]: Callback of webhook {delivery.hook_id} failed ({delivery.error}), retrying in "
+                            f"{delay}s")
+                self.__schedule_retry(delivery, delay)
+            else:
+                self.__dead_letter(delivery, delivery.error)
+
+    def __schedule_retry(self, delivery: Delivery, delay: float):
+        def retry():
+            self.__retries.pop(handle, None)
+            self.__put(delivery)
+
+        handle = self.__loop.call_later(delay, retry)
+        self.__retries[handle] = delivery
+
+    def __dead_letter(self, delivery: Delivery, error: str | None):
+        delivery.error = error
+        self.dead_letters.append(delivery)
+        logger.warning(f"[LOG]: Callback of webhook {delivery.hook_id} to {delivery.url} dropped after "
+                       f"{delivery.attempts} attempts: {error}")
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:  # Outside of the event loop: the write may block
+            self.__store_dead_letter(delivery)
+            return
+        # On the event loop: the database is written from a thread (see `stop`, which waits for it)
+        task = loop.create_task(asyncio.to_thread(self.__store_dead_letter, delivery))
+        self.__storing.add(task)
+        task.add_done_callback(self.__storing.discard)
+
+    @staticmethod
+    def __store_dead_letter(delivery: Delivery):
+        try:
+            sql.insert_dead_letter(int(time.time()), delivery.hook_id, delivery.url, delivery.payload.decode(),
+                                   delivery.attempts, delivery.error)
+        except Exception as e:
+            logger.error(f"[LOG]: Could not store the dead letter: {e}")
+
+
+deliveries = DeliveryQueue()
@@ -0,0 +1,66 @@
+"""
+Encoding of the history exports of `/extract`: the batches of rows of `sql.export_probe_results` are encoded (and
+compressed) one at a time, as they are sent, so an export never holds more than one batch in memory.
+
+The batches are read from a snapshot of the database, which is released by `ExportResponse` when the response ends,
+also if the client disconnects in the middle of the download.
+"""
+import csv
+import io
+import json
+import zlib
+from typing import Generator, Iterable, Iterator, List, Tuple
+
+from starlette.responses import StreamingResponse
+
+SOURCE_NAMES = {0: "probe", 1: "user"}  # Values of `sql.SOURCE_PROBE` and `sql.SOURCE_USER`
+GZIP_LEVEL = 6
+
+Batch = List[Tuple[str, int, int, int]]  # (service name, timestamp, status, source) rows
+
+
+def csv_chunks(batches: Iterable[Batch]) -> Iterator[bytes]:
+    """Encode the rows as CSV, with a header line."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(["service", "timestamp", "status", "source"])
+    for batch in batches:
+        writer.writerows((name, ts, status, SOURCE_NAMES[source]) for name, ts, status, source in batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():  # The header, if there was no row
+        yield buffer.getvalue().encode()
+
+
+def ndjson_chunks(batches: Iterable[Batch]) -> Iterator[bytes]:
+    """Encode the rows as newline-delimited json, one object per row."""
+    for batch in batches:
+        yield "".join(json.dumps({"service": name, "ts": ts, "status": status, "source": SOURCE_NAMES[source]},
+                                 separators=(",", ":")) + "\n"
+                      for name, ts, status, source in batch).encode()
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = GZIP_LEVEL) -> Iterator[bytes]:
+    """Compress a stream of chunks into a gzip stream, on the fly."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # 16+: gzip header and trailer
+    for chunk in chunks:
+        if compressed := compressor.compress(chunk):
+            yield compressed
+    yield compressor.flush()
+
+
+class ExportResponse(StreamingResponse):
+    """Streams the encoded `chunks` of the `batches` of an export, and closes `batches` when the response ends."""
+
+    def __init__(self, batches: Generator[Batch, None, None], chunks: Iterable[bytes], **kwargs):
+        super().__init__(chunks, **kwargs)
+        self.batches = batches
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # The batches are read in the thread pool, whose reads aren't abandoned when the response is cancelled:
+            # they aren't being read anymore, so they can be closed (and their snapshot of the database released)
+            self.batches.close()
@@ -0,0 +1,92 @@
+"""
+HTTP caching of the status API: the data only changes once per refresh of the services, so every response carries
+validators of the refresh generation it was built from (`ETag`, `Last-Modified`) and may be cached until the next
+refresh (`Cache-Control`). Clients that already have the current generation get a `304 Not Modified`.
+
+Some responses also change with time, e.g. the sliding windows of the latency or the duration of an ongoing incident:
+their validators also depend on the current bucket of `LIVE_BUCKET` seconds (see `live_validators`).
+"""
+import datetime as dt
+import time
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Tuple
+
+CACHE_STALE_WHILE_REVALIDATE = 60  # [s] How long caches may serve a response after it expired, while refetching it
+LIVE_BUCKET = 60  # [s] How long a response that changes with time stays valid
+
+
+def live_validators(generation: int, last_modified: dt.datetime, max_age: float, bucket: int = LIVE_BUCKET,
+                    now: float | None = None) -> Tuple[str, dt.datetime, float]:
+    """
+    The validators of a response that changes with the refresh generation and with time.
+
+    :param generation: the refresh generation the response was built from
+    :param last_modified: when the refresh generation started (naive UTC)
+    :param max_age: the time left until the next refresh [s]
+    :param bucket: how long the response stays valid [s]
+    :param now: the current unix timestamp
+    :returns: the version of the response (the generation and the current time bucket, for `etag`), when it was last
+      modified (the later of `last_modified` and the start of the bucket) and how long it stays fresh [s]
+    """
+    now = time.time() if now is None else now
+    start = int(now // bucket * bucket)
+    start_date = dt.datetime.fromtimestamp(start, dt.timezone.utc).replace(tzinfo=None)
+    return f"{generation}.{start // bucket}", max(last_modified, start_date), min(max_age, start + bucket - now)
+
+
+def etag(generation: int | str) -> str:
+    """The (strong) entity tag of the responses built from the refresh `generation`."""
+    return f'"{generation}"'
+
+
+def http_date(date: dt.datetime) -> str:
+    """Format a (naive UTC, or aware) datetime as an HTTP date."""
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=dt.timezone.utc)
+    return format_datetime(date.astimezone(dt.timezone.utc), usegmt=True)
+
+
+def cache_headers(generation: int | str, last_modified: dt.datetime, max_age: float) -> Dict[str, str]:
+    """
+    The caching headers of a response.
+
+    :param generation: the refresh generation the response was built from
+    :param last_modified: when the data of the response last changed, i.e. when the refresh generation started
+    :param max_age: how long the response stays fresh, i.e. the time left until the next refresh [s]
+    """
+    return {
+        "ETag": etag(generation),
+        "Last-Modified": http_date(last_modified),
+        "Cache-Control": f"public, max-age={max(int(max_age), 0)}, "
+                         f"stale-while-revalidate={CACHE_STALE_WHILE_REVALIDATE}",
+    }
+
+
+def not_modified(headers, generation: int | str, last_modified: dt.datetime) -> bool:
+    """
+    Whether the client already has the response (RFC 9110, section 13.2.2): its `If-None-Match` header lists the
+    current entity tag or, if it sent none, its `If-Modified-Since` is not older than `last_modified`.
+
+    :param headers: the headers of the request
+    """
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        # Weak comparison: a `W/` prefix added by a proxy doesn't matter
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return etag(generation) in tags
+
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=dt.timezone.utc)
+        if last_modified.tzinfo is None:
+            last_modified = last_modified.replace(tzinfo=dt.timezone.utc)
+        return last_modified.replace(microsecond=0) <= since
+
+    return False
@@ -37,6 +37,21 @@ def acquire(lock_file):
     return lock_file_fd
 
 
+def try_acquire(lock_file):
+    """
+    Take the lock without waiting.
+
+    :returns: the file descriptor holding the lock, or `None` if another process holds it
+    """
+    fd = os.open(lock_file, os.O_RDWR | os.O_CREAT)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError):
+        os.close(fd)
+        return None
+    return fd
+
+
 def release(lock_file_fd):
     # Do not remove the lockfile:
     #
@@ -0,0 +1,43 @@
+"""
+One-shot migration of `data/outage.sqlite3` from the legacy per-service tables, or from the unpartitioned
+`probe_results` table, to the monthly partitions of the history, and import of the webhooks of `webhooks.json` into the
+database. With `--runs`, the probes stored one row per probe are then converted to runs (see `runs.py`): the samples
+are first copied to `SAMPLES_ARCHIVE_DIRECTORY`, one file per month, to check the conversion with
+`python runs.py <copy>`. Set `sql.PROBE_STORAGE` to "runs" to store the new probes as runs too.
+
+Usage: `python migrate.py [--runs]` (stop the application first).
+"""
+import json
+import os
+import sys
+
+import sql
+from models import Webhooks
+
+SAMPLES_ARCHIVE_DIRECTORY = "data/archive/samples"  # Copies of the probes stored as samples, before `--runs`
+
+
+if __name__ == "__main__":
+    with open("services.json") as f:
+        service_names = json.load(f).keys()
+
+    moved = sql.migrate_legacy_tables(service_names)
+    for service_name, rows in moved.items():
+        print(f"{service_name}: {rows} rows migrated")
+    print(f"Migrated {len(moved)} tables ({sum(moved.values())} rows).")
+
+    for table, rows in sql.partition_history().items():
+        print(f"{table}: {rows} rows moved to monthly partitions")
+
+    # The counters derived from the history must include the migrated rows
+    sql.rebuild_uptime_counters()
+    sql.rebuild_rollups()
+    print(f"Rebuilt {sql.rebuild_incidents()} incidents.")
+
+    # After the rollups and the incidents: they are computed from the exact timestamps of the samples
+    if "--runs" in sys.argv[1:]:
+        probes, runs = sql.convert_to_runs(SAMPLES_ARCHIVE_DIRECTORY)
+        print(f"Converted {probes} probes to {runs} runs.")
+
+    if os.path.exists("webhooks.json"):
+        print(f"Imported {Webhooks.load_from_db().import_json_file('webhooks.json')} webhooks from webhooks.json.")
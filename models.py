@@ -1,3 +1,4 @@
+import asyncio
 import datetime as dt
 
 from fastapi import Body
@@ -6,14 +7,21 @@ import requests
 from typing import List, Dict, Annotated, Set, Any, Iterable
 from logger_config import *
 
-from utilities import hash_password
+from utilities import atomic_write, hash_password
+from probe import ProbeResult
+from delivery import deliveries
+from stream import status_stream
+import sql
+from subscriptions import SubscriptionIndex
 
 import os
+import time
 
 # Basic constant
 filepath = "data/"
 cols = "date,UP\n"
 RECHECK_AFTER = 300  # [s]
+FLUSH_DEBOUNCE = 30  # [s] Minimal delay between two debounced writes of services.json
 # Follow ISO guidelines
 # DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
 
@@ -36,18 +44,6 @@ class Webhook(BaseModel):
         HttpUrl,
         webhook_callback_url]
 
-    def send_callback(self, service) -> bool:
-        """
-        Check that this webhook tracks `service` and if so send a callback to the callback_url.
-
-        :returns: `True if a callback was sent, `False` if not.
-        """
-        if service.name in self.tracked_services:
-            requests.post(self.callback_url, json=service.model_dump(mode="json", exclude=["last_checked"]))
-            return True
-
-        return False
-
 
 # Response-only models #################################################################################################
 class HTTPError(BaseModel):
@@ -78,6 +74,19 @@ class WebhookComplete(WebhookResponse):
     def __eq__(self, other):
         return isinstance(other, WebhookComplete) and self.hook_id == other.hook_id
 
+    def send_callback(self, service) -> bool:
+        """
+        Check that this webhook tracks `service` and if so queue a callback to the callback_url (see `delivery.py`).
+
+        :returns: `True if a callback was queued, `False` if not.
+        """
+        if service.name in self.tracked_services:
+            deliveries.enqueue(self.hook_id, self.callback_url,
+                               service.model_dump(mode="json", exclude=["last_checked"]))
+            return True
+
+        return False
+
 
 # TODO check if needs to inherit from Service ?
 class ServiceStatusChange(BaseModel):
@@ -94,6 +103,151 @@ class ServiceStatusChange(BaseModel):
         examples=[True, False])]
 
 
+class ServiceHistory(BaseModel):
+    # Model for the history endpoint: one array per column rather than one object per status
+    service: Annotated[str, Field(
+        description="The name of the service.",
+        examples=["Inginious"])]
+    source: Annotated[str, Field(
+        description="Where the statuses come from: `probe` (checked by the application) or `user` (user reports).",
+        examples=["probe"])]
+    ts: Annotated[List[int], Field(
+        description="The unix timestamps of the statuses, in chronological order.",
+        examples=[[1718802193, 1718802493]])]
+    status: Annotated[List[int], Field(
+        description="The statuses, in the same order as `ts`: `1` if the service was up, `0` if it was down.",
+        examples=[[1, 0]])]
+    next_cursor: Annotated[str | None, Field(
+        description="Pass it as `cursor` to get the next page, `null` if this is the last page.",
+        examples=["1718802493.0.2", None])]
+
+
+class ServiceChart(BaseModel):
+    # Model for the chart endpoint: one array per column, like `ServiceHistory`
+    service: Annotated[str, Field(
+        description="The name of the service.",
+        examples=["Inginious"])]
+    resolution: Annotated[int, Field(
+        description="The duration covered by each point [s], `0` if the points are the probes themselves.",
+        examples=[3600, 0])]
+    ts: Annotated[List[int], Field(
+        description="The unix timestamps of the points (the start of the period they cover), in chronological order.",
+        examples=[[1718798400, 1718802000]])]
+    samples: Annotated[List[int], Field(
+        description="The number of probes of each point.",
+        examples=[[12, 12]])]
+    up: Annotated[List[int], Field(
+        description="The number of probes of each point that found the service up.",
+        examples=[[12, 9]])]
+    first_status: Annotated[List[int], Field(
+        description="The status found by the first probe of each point: `1` if the service was up, `0` if it was "
+                    "down.",
+        examples=[[1, 1]])]
+    last_status: Annotated[List[int], Field(
+        description="The status found by the last probe of each point.",
+        examples=[[1, 0]])]
+
+
+class ServiceUptime(BaseModel):
+    service: Annotated[str, Field(
+        description="The name of the service.",
+        examples=["Inginious"])]
+    uptime: Annotated[Dict[str, float | None], Field(
+        description="The fraction of the probes that found the service up over the last day (`24h`), week (`7d`), 30 "
+                    "days (`30d`) and since it is tracked (`all`), `null` if it wasn't probed during that window.",
+        examples=[{"all": 0.987, "24h": 1.0, "7d": 0.995, "30d": 0.991}])]
+
+
+class ProbeTimings(BaseModel):
+    ts: Annotated[int, Field(
+        description="The unix timestamp of the probe.",
+        examples=[1718802493])]
+    status_code: Annotated[int | None, Field(
+        description="The HTTP status code of the answer, `null` if the service didn't answer.",
+        examples=[200, None])]
+    latency: Annotated[float, Field(
+        description="The total duration of the probe [s].",
+        examples=[0.183])]
+    dns: Annotated[float | None, Field(
+        description="The duration of the DNS resolution [s], `0` if an open connection was reused.",
+        examples=[0.004, 0])]
+    connect: Annotated[float | None, Field(
+        description="The duration of the TCP connection [s], `0` if an open connection was reused.",
+        examples=[0.011, 0])]
+    tls: Annotated[float | None, Field(
+        description="The duration of the TLS handshake [s], `0` if an open connection was reused or for `http` urls.",
+        examples=[0.032, 0])]
+    ttfb: Annotated[float | None, Field(
+        description="The time from the request being sent to the first byte of the answer [s], `null` if the service "
+                    "didn't answer.",
+        examples=[0.136, None])]
+
+
+class LatencyPercentiles(BaseModel):
+    samples: Annotated[int, Field(
+        description="The number of probes in the window that got an answer.",
+        examples=[60])]
+    p50: Annotated[float | None, Field(
+        description="The median latency [s], `null` without samples.",
+        examples=[0.183])]
+    p95: Annotated[float | None, Field(
+        description="The 95th percentile of the latency [s], `null` without samples.",
+        examples=[0.412])]
+    p99: Annotated[float | None, Field(
+        description="The 99th percentile of the latency [s], `null` without samples.",
+        examples=[1.95])]
+
+
+class ServiceLatency(BaseModel):
+    service: Annotated[str, Field(
+        description="The name of the service.",
+        examples=["Inginious"])]
+    latest: Annotated[ProbeTimings | None, Field(
+        description="The timings of the latest probe, `null` if the service was never probed.")]
+    windows: Annotated[Dict[str, LatencyPercentiles], Field(
+        description="The percentiles of the latency over the last hour (`1h`), day (`24h`) and week (`7d`).")]
+
+
+class Incident(BaseModel):
+    start: Annotated[int, Field(
+        description="The unix timestamp of the first probe that found the service down.",
+        examples=[1718802493])]
+    end: Annotated[int | None, Field(
+        description="The unix timestamp of the first probe that found the service up again, `null` if it is ongoing.",
+        examples=[1718803093, None])]
+    duration: Annotated[int, Field(
+        description="The duration of the incident [s], until now if it is ongoing.",
+        examples=[600])]
+    ongoing: Annotated[bool, Field(
+        description="Whether the service is still down.",
+        examples=[False])]
+    probes: Annotated[int, Field(
+        description="The number of probes that found the service down during the incident.",
+        examples=[7])]
+    user_reports: Annotated[int, Field(
+        description="The number of users that reported the service down during the incident, or shortly before.",
+        examples=[2])]
+
+
+class ServiceIncidents(BaseModel):
+    service: Annotated[str, Field(
+        description="The name of the service.",
+        examples=["Inginious"])]
+    incidents: Annotated[List[Incident], Field(
+        description="The incidents in the requested range, newest first.")]
+    count: Annotated[int, Field(
+        description="The number of incidents of the service since it is tracked.",
+        examples=[12])]
+    mttr: Annotated[float | None, Field(
+        description="The mean time to recovery: the mean duration of the closed incidents [s], `null` if there is "
+                    "none.",
+        examples=[840.5, None])]
+    mtbf: Annotated[float | None, Field(
+        description="The mean time between failures: the mean time from the end of an incident to the start of the "
+                    "next one [s], `null` with fewer than two incidents.",
+        examples=[1209600.0, None])]
+
+
 # Models used for backend ##############################################################################################
 
 
@@ -101,12 +255,46 @@ class Webhooks(RootModel):
     root: List[WebhookComplete]
 
     __webhook_dict: Dict[int, WebhookComplete] = {}
+    __subscriptions: SubscriptionIndex = None
     __filename: str = None
-    __max_id: int = 0
     __services = None
+    __version: int = 0  # The `sql.VERSION_WEBHOOKS` version the webhooks were loaded at
+
+    @classmethod
+    def load_from_db(cls):
+        """
+        Load the webhooks stored in the database. Every change made to the object afterwards is written to the
+        database right away, one row at a time.
+        """
+        version = sql.get_version(sql.VERSION_WEBHOOKS)  # Read first: the rows can only be more recent
+        root = [WebhookComplete(hook_id=hook_id, callback_url=callback_url, password_hash=password_hash,
+                                tracked_services=tracked_services)
+                for hook_id, callback_url, password_hash, tracked_services in sql.load_webhooks()]
+        webhooks = cls(root=root).__post_init(None)
+        webhooks.__version = version
+        return webhooks
+
+    def reload(self) -> bool:
+        """
+        Load the webhooks from the database again if they were changed since they were loaded (by another worker, see
+        `cluster.py`).
+
+        :returns: `True` if the webhooks were reloaded, `False` if they were up to date.
+        """
+        if sql.get_version(sql.VERSION_WEBHOOKS) == self.__version:
+            return False
+
+        fresh = Webhooks.load_from_db()
+        self.__webhook_dict, self.__subscriptions, self.__version = (fresh.__webhook_dict, fresh.__subscriptions,
+                                                                     fresh.__version)
+        return True
 
     @classmethod
     def load_from_json_file(cls, filename: str):
+        """
+        Load webhooks from a json file (the format in which they were stored before being moved to the database, see
+        `import_json_file`). Changes to this object are written to the database, not to the file.
+        """
         try:
             with open(filename, "r") as f:
                 return cls.model_validate_json(f.read()).__post_init(filename)
@@ -115,13 +303,30 @@ class Webhooks(RootModel):
         except (ValueError, ValidationError):
             raise Exception("[LOG]: Error when parsing webhooks.json")
 
+    def import_json_file(self, filename: str) -> int:
+        """
+        Add the webhooks of a json file to this object and to the database, keeping their ids. Webhooks whose id
+        already exists are skipped.
+
+        :returns: the number of webhooks imported
+        """
+        imported = 0
+        for webhook in Webhooks.load_from_json_file(filename):
+            if self.hook_id_exists(webhook.hook_id):
+                continue
+            self.add_webhook(webhook, password_hash=webhook.password_hash, hook_id=webhook.hook_id)
+            imported += 1
+        return imported
+
     def dump_json(self, filename: str = None):
+        """Export the webhooks to a json file (by default, the file from which they were loaded)."""
         if not filename:
             filename = self.__filename
 
+        # The webhooks are only kept up to date in the dict, the root list is only used for the serialization
+        self.root = list(self.__webhook_dict.values())
         try:
-            with open(filename, "w") as f:
-                f.write(self.model_dump_json(indent=2))
+            atomic_write(filename, self.model_dump_json(indent=2))
         except (OSError, IOError):
             raise Exception("[LOG]: Error when writing webhooks.json")
 
@@ -134,66 +339,67 @@ class Webhooks(RootModel):
 
     def add_webhook(self, webhook: Webhook, password: str = None, password_hash: str = None,
                     hook_id: int = None) -> WebhookResponse:
-        if not hook_id:
-            self.__max_id += 1
-            hook_id = self.__max_id
-        webhook_response = WebhookResponse(**webhook.model_dump(), hook_id=hook_id)
         if password:
-            hook = WebhookComplete(**webhook_response.model_dump(), password_hash=hash_password(password))
-        elif password_hash:
-            hook = WebhookComplete(**webhook_response.model_dump(), password_hash=password_hash)
-        else:
+            password_hash = hash_password(password)
+        elif not password_hash:
             raise AttributeError("Either password or password_hash must be given.")
 
-        self.root.append(hook)
-        self.__webhook_dict[hook.hook_id] = hook
+        # The database chooses the id if not given
+        hook_id = sql.insert_webhook(str(webhook.callback_url), password_hash, webhook.tracked_services, hook_id)
+        webhook_response = WebhookResponse(tracked_services=webhook.tracked_services,
+                                           callback_url=webhook.callback_url, hook_id=hook_id)
+        hook = WebhookComplete(**webhook_response.model_dump(), password_hash=password_hash)
 
-        if services:
-            for service in services:
-                service.modify_webhooks([hook])
+        self.__webhook_dict[hook.hook_id] = hook
+        self.__subscriptions.subscribe(hook.hook_id, hook.tracked_services)
 
-        self.dump_json()
         return webhook_response
 
     def update_webhook(self, hook_id: int, updates: WebhookPatches):
         """Supposes hook_id exists"""
-        self.__webhook_dict[hook_id].callback_url = updates.callback_url or self.__webhook_dict[hook_id].callback_url
+        hook = self.__webhook_dict[hook_id]
+        tracked_services = set(updates.tracked_services) if updates.tracked_services else None  # Else not updated
+        sql.update_webhook(hook_id, updates.callback_url, tracked_services)
 
-        if updates.tracked_services:  # is not None
-            # Not the most efficient but works
-            old_webhook = self.__webhook_dict[hook_id]
-            self.delete_webhook(hook_id)
-            return self.add_webhook(
-                WebhookComplete(callback_url=old_webhook.callback_url, tracked_services=updates.tracked_services,
-                password_hash=old_webhook.password_hash, hook_id=hook_id))
+        hook.callback_url = updates.callback_url or hook.callback_url
+        if tracked_services is not None:
+            hook.tracked_services = tracked_services
+            self.__subscriptions.subscribe(hook_id, hook.tracked_services)
 
-        self.dump_json()
-        return WebhookResponse(**self.__webhook_dict[hook_id].model_dump(exclude={"password_hash"}))
+        return WebhookResponse(**hook.model_dump(exclude={"password_hash"}))
 
     def delete_webhook(self, hook_id: int):
         """Supposes hook_id exists"""
-        webhook = self.__webhook_dict.pop(hook_id)
-        self.root.remove(webhook)
-        webhook.tracked_services = set()
-        if services:
-            for service in services:
-                service.modify_webhooks([webhook])
-        self.dump_json()
+        sql.delete_webhook(hook_id)
+        self.__webhook_dict.pop(hook_id)
+        self.__subscriptions.unsubscribe(hook_id)
+
+    def subscribers(self, service_name: str) -> Iterable[WebhookComplete]:
+        """The webhooks tracking the service `service_name`."""
+        return [self.__webhook_dict[hook_id] for hook_id in self.__subscriptions.subscribers(service_name)]
+
+    def send_callbacks(self, service) -> int:
+        """
+        Queue a callback to all webhooks tracking `service` (see `WebhookComplete.send_callback`).
+
+        :returns: the number of callbacks queued
+        """
+        return sum(webhook.send_callback(service) for webhook in self.subscribers(service.name))
 
     def _set_services(self, services): # Services
         self.__services = services
 
     def __post_init(self, filename: str):
+        self.__subscriptions = SubscriptionIndex()
         for webhook in self.root:
             self.__webhook_dict[webhook.hook_id] = webhook
-            if webhook.hook_id > self.__max_id:
-                self.__max_id = webhook.hook_id
+            self.__subscriptions.subscribe(webhook.hook_id, webhook.tracked_services)
 
         self.__filename = filename
         return self
 
     def __iter__(self) -> Iterable[WebhookComplete]:
-        return iter(self.root)
+        return iter(self.__webhook_dict.values())
 
 
 class Service(BaseModel):
@@ -218,40 +424,25 @@ class Service(BaseModel):
                     "formatting (`yyyy-MM-dd'T'HH:mm:ss.SSSXXX`).", examples=["2024-01-22T17:46:55.480345"]
     )]
 
-    __webhooks: Dict[int, Webhook] = {}
     __parent: None  # Services instance
 
-    def status_changed(self, session=None):
+    def record_probe(self, result: ProbeResult) -> bool:
         """
-        Refresh the status for this service if not updated recently. Makes an HTTP request to do so. This method
-        can trigger a callback to all associated webhooks if the status did change.
-        
-        :param session: a https session to speed up checks (because it can use batch requests)
-        """
-        now = dt.datetime.utcnow()
-        headers = {"User-Agent": "Mozilla/5.0 (X11; CrOS x86_64 12871.102.0) AppleWebKit/537.36 (KHTML, like Gecko) "
-                                 "Chrome/81.0.4044.141 Safari/537.36"}
+        Update the status of this service with the outcome of a probe. This method can trigger a callback to all
+        associated webhooks if the status did change.
 
-        logger.info(f"[LOG]: Checking status of {self.name}")
-        try:
-            if session is None:
-                new_is_up = requests.head(self.url, headers=headers).status_code < 400
-            else:
-                new_is_up = session.head(self.url, headers=headers).status_code < 400
-        except: 
-            logger.warning(f"[LOG]: {self.name} is down")
-            new_is_up = False
-            
-        self.last_checked = now
+        :param result: the result of a probe of this service (see `probe.probe`)
+        :returns: `True` if the status of the service changed, `False` if not.
+        """
+        self.last_checked = result.checked_at
 
-        if self.status is None:
-            self.status = new_is_up
-        elif self.status != new_is_up:
-            for webhook in self.__webhooks.values():
-                webhook.send_callback(self)
-        self.status = new_is_up
+        changed = self.status is not None and self.status != result.is_up
+        self.status = result.is_up
+        self.__parent.mark_dirty()
+        if changed:
+            self.__parent.status_changed_callbacks(self)
 
-        self.__parent.dump_json()
+        return changed
 
     @property
     def is_up(self) -> bool:
@@ -262,7 +453,6 @@ class Service(BaseModel):
         :return: `true` if the service is up, `false if not` (this value isn't 100% accurate: status checks don't
           happen every second).
         """
-        # self.status_changed() Because the update of the status should only be done periodically
         return self.status
     
     def up_time(self) -> tuple[bool, dt.datetime]:
@@ -271,19 +461,6 @@ class Service(BaseModel):
         """
         return (self.is_up, self.last_checked)
 
-    def modify_webhooks(self, webhooks: List[WebhookComplete]):
-        """
-        Add the webhooks given in `webhooks` if those requested the tracking of this service, or delete them if they
-        were tracking this service before but now not anymore.
-        """
-        for webhook in webhooks:
-            # Check if the webhook should be deleted
-            if webhook.hook_id in self.__webhooks and self.name not in webhook.tracked_services:
-                self.__webhooks.pop(webhook.hook_id, None)
-            # Or add the webhook
-            elif self.name in webhook.tracked_services:
-                self.__webhooks[webhook.hook_id] = webhook
-
     def _set_parent(self, parent):
         self.__parent = parent
 
@@ -293,6 +470,11 @@ class Services(RootModel):
 
     __tracked_services: Set[str] = None  # Keyset from the root dict (going from KeyView to Set is O(n))
     __filename: str = None
+    __dirty: bool = False  # Whether some changes have not been written to the json file yet
+    __webhooks: Webhooks = None
+    __last_flush: float = 0  # time.monotonic() of the last write to the json file
+    __generation: int = 0  # Refresh generation of the statuses (`sql.VERSION_STATUS`), 0 if never shared
+    __modified: dt.datetime | None = None  # When the refresh generation started (UTC), `None` if unknown
 
     @classmethod
     def load_from_json_file(cls, filename: str, webhooks: Webhooks = None):
@@ -332,26 +514,92 @@ class Services(RootModel):
             filename = self.__filename
 
         try:
-            with open(filename, "w") as f:
-                f.write(self.model_dump_json(indent=2, by_alias=True))
+            atomic_write(filename, self.model_dump_json(indent=2, by_alias=True))
         except (OSError, IOError):
             raise Exception("[LOG]: Error when writing services.json")
 
-    def status_changed(self, service: str | Service = None):
-        """Refresh the status for all monitored services (if not updated recently).
-        If there are differences, update the json file."""
-        if not service:
-            [self.status_changed(service) for service in self.root.values()]
-        else:
-            if isinstance(service, str):
-                service = self.root[service]
-            service.status_changed()
+        if filename == self.__filename:
+            self.__dirty = False
+            self.__last_flush = time.monotonic()
+
+    def mark_dirty(self):
+        """Mark the object as changed: it will be written to its json file by the next call to `flush`."""
+        self.__dirty = True
+
+    def flush(self, debounce: float = 0) -> bool:
+        """
+        Write the object to its json file if it changed since the last write (see `mark_dirty`).
+
+        :param debounce: do not write if the last write happened less than `debounce` seconds ago. The changes stay
+          pending for a later call instead.
+        :returns: `True` if the file was written, `False` if not.
+        """
+        if not self.__dirty or time.monotonic() - self.__last_flush < debounce:
+            return False
 
         self.dump_json()
-    
-    def update_status(self, session=None):
-        for service in self:
-            service.status_changed(session)
+        return True
+
+    @property
+    def last_checked(self) -> dt.datetime:
+        """The last time the status of a service was checked."""
+        return max(service.last_checked for service in self)
+
+    @property
+    def generation(self) -> int:
+        """The refresh generation of the statuses: changes each time they are shared (see `save_snapshot`)."""
+        return self.__generation
+
+    @property
+    def last_modified(self) -> dt.datetime:
+        """When the statuses last changed: the start of their refresh generation, else the last check of a service."""
+        return self.__modified or self.last_checked
+
+    async def save_snapshot(self):
+        """
+        Share the current statuses with the other workers, through the database (see `cluster.py`). The user statuses
+        are shared by the workers receiving the reports (see `reports.py`): they are updated with the shared ones.
+        The database is written from a thread, the event loop keeps serving the requests meanwhile.
+        """
+        statuses = [(service.name, service.status, service.last_checked, service.is_up_user, service.last_user_report)
+                    for service in self]
+        self.__apply_snapshot(*await asyncio.get_running_loop().run_in_executor(
+            None, sql.save_status_snapshot, statuses))
+
+    def load_snapshot(self) -> bool:
+        """
+        Update the statuses with those shared by the other workers (probes and user reports), if they changed since the
+        last call. Doesn't trigger any webhook callback and doesn't write the json file: that is the job of that worker.
+
+        :returns: `True` if the statuses were updated, `False` if they were up to date.
+        """
+        if sql.get_version(sql.VERSION_STATUS) == self.__generation:
+            return False
+
+        self.__apply_snapshot(*sql.load_status_snapshot())
+        return True
+
+    def __apply_snapshot(self, generation: int, modified: dt.datetime | None, statuses):
+        for name, is_up, last_checked, is_up_user, last_user_report in statuses:
+            service = self.root.get(name)
+            if service is not None:
+                changed = service.status != is_up
+                service.status, service.last_checked = is_up, last_checked
+                service.is_up_user, service.last_user_report = is_up_user, last_user_report
+                if changed:
+                    self.publish_change(service)
+        self.__generation, self.__modified = generation, modified
+
+    def status_changed_callbacks(self, service: Service):
+        """Notify the webhooks tracking `service` and the clients of the status stream that its status changed."""
+        if self.__webhooks is not None:
+            self.__webhooks.send_callbacks(service)
+        self.publish_change(service)
+
+    @staticmethod
+    def publish_change(service: Service):
+        """Send the new status of `service` to the clients of the status stream (see `stream.py`)."""
+        status_stream.publish("status", service.model_dump(mode="json", by_alias=True))
 
     def get_service(self, service_name: str) -> Service | None:
         """Get a service from the list, or None if it isn't monitored."""
@@ -407,9 +655,7 @@ class Services(RootModel):
         self.__filename = filename
         for service in self:
             service._set_parent(self)
-        if webhooks:
-            for service in self.root.values():
-                service.modify_webhooks(webhooks.root)
+        self.__webhooks = webhooks
 
         return self
 
@@ -424,8 +670,7 @@ class Services(RootModel):
 
 
 if __name__ == "__main__":
-    JSON_FILE_WEBHOOKS = "webhooks.json"
-    webhooks = Webhooks.load_from_json_file(JSON_FILE_WEBHOOKS)
+    webhooks = Webhooks.load_from_db()
 
     JSON_FILE_SERVICES = "services.json"
     services = Services.load_from_json_file(JSON_FILE_SERVICES, webhooks=webhooks)
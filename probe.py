@@ -0,0 +1,335 @@
+"""
+Concurrent status probes for the tracked services.
+
+The probes themselves are plain (blocking) `requests` calls, but they are run on a bounded thread pool and awaited from
+the asyncio event loop, so that a refresh cycle never blocks the loop that also serves the FastAPI routes and so that
+a cycle takes roughly as long as its slowest probe instead of the sum of all probes.
+
+Each probe is timed: its total latency, and the duration of its phases (DNS resolution, TCP connection, TLS handshake and
+time to the first byte of the response). The phases of the connection are timed by the connection classes of the
+sessions created by `new_session`, which report them to the probe running in their thread.
+
+The application probes through a single long-lived `ProbeClient`, opened and closed with the application: its session
+keeps one connection pool per host, so connections kept alive by the servers are reused from one probe to the next, and
+the addresses of the hosts are cached (`dns_cache`). The services of a same host are probed one after the other, on the
+same connection, instead of opening one connection per service.
+"""
+import asyncio
+import datetime as dt
+import socket
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from urllib3.util.connection import allowed_gai_family
+
+from logger_config import *
+
+PROBE_CONCURRENCY = 32  # Maximum number of probes in flight at the same time
+PROBE_POOLED_HOSTS = 64  # Hosts whose connection pool is kept by a session
+PROBE_CONNECTIONS_PER_HOST = 4  # Connections kept alive per host
+DNS_CACHE_TTL = 300  # [s] Maximal time during which the addresses of a host are reused
+PROBE_CONNECT_TIMEOUT = 5  # [s]
+PROBE_READ_TIMEOUT = 10  # [s]
+PROBE_CYCLE_DEADLINE = 60  # [s] Probes still running after this are considered failed
+
+PROBE_HEADERS = {"User-Agent": "Mozilla/5.0 (X11; CrOS x86_64 12871.102.0) AppleWebKit/537.36 (KHTML, like Gecko) "
+                               "Chrome/81.0.4044.141 Safari/537.36"}
+
+
+@dataclass(frozen=True)
+class ProbeResult:
+    """The outcome of a single probe of a service. The durations are in seconds, those of the phases of the connection
+    (`dns`, `connect`, `tls`) are 0 if an open connection was reused."""
+    name: str
+    is_up: bool
+    checked_at: dt.datetime
+    status_code: int | None = None
+    error: str | None = None
+    latency: float | None = None  # Total duration of the probe, until the response or the failure
+    dns: float | None = None
+    connect: float | None = None
+    tls: float | None = None
+    ttfb: float | None = None  # From the request being sent to the first byte of the response, `None` if no response
+    reused_connection: bool | None = None  # Whether an open connection was reused, `None` if no response
+
+
+@dataclass
+class PhaseTimings:
+    """The durations of the phases of the connection of a probe [s], filled in by the connections."""
+    dns: float = 0
+    connect: float = 0
+    tls: float = 0
+    new_connection: bool = False
+
+
+class DnsCache:
+    """
+    The addresses of the hosts, resolved by `socket.getaddrinfo` and reused for `ttl` seconds. The system resolver
+    doesn't tell the TTL of the records, so `ttl` is an upper bound: the addresses of a host are also forgotten as soon
+    as no connection to them can be opened, in case they changed. Thread-safe.
+    """
+
+    def __init__(self, ttl: float = DNS_CACHE_TTL):
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+
+        self.__entries: Dict[Tuple[str, int], Tuple[float, list]] = {}  # (host, port): (expiry, addresses)
+        self.__lock = threading.Lock()
+
+    def resolve(self, host: str, port: int) -> list:
+        """The addresses of `host`, as returned by `socket.getaddrinfo` for a TCP connection to `port`."""
+        key = (host, port)
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        addresses = socket.getaddrinfo(host, port, allowed_gai_family(), socket.SOCK_STREAM)
+        with self.__lock:
+            self.__entries[key] = (time.monotonic() + self.ttl, addresses)
+        return addresses
+
+    def forget(self, host: str, port: int):
+        """Resolve `host` again next time."""
+        with self.__lock:
+            self.__entries.pop((host, port), None)
+
+
+dns_cache = DnsCache()
+_phase_timings = threading.local()  # `current`: the `PhaseTimings` of the probe running in the thread, if any
+
+
+class _TimedConnectionMixin:
+    """
+    Times the DNS resolution and the TCP connection of the new connections of the probes (see `PhaseTimings`), and
+    resolves their host through `dns_cache`.
+    """
+
+    def _new_conn(self):
+        timings = getattr(_phase_timings, "current", None)
+        if timings is None:
+            return super()._new_conn()
+
+        timings.new_connection = True
+        start = time.perf_counter()
+        try:
+            addresses = dns_cache.resolve(self._dns_host, self.port)
+        except socket.gaierror as e:
+            timings.dns = time.perf_counter() - start
+            raise NewConnectionError(self, f"Failed to resolve '{self.host}' ({e})") from e
+        resolved = time.perf_counter()
+        timings.dns = resolved - start
+
+        # Connect to the resolved addresses, in order, as `urllib3.util.connection.create_connection` would
+        host, error = self._dns_host, None
+        try:
+            for *_, address in addresses:
+                self._dns_host = address[0]
+                try:
+                    sock = super()._new_conn()
+                    break
+                except (ConnectTimeoutError, NewConnectionError) as e:
+                    error = e
+            else:
+                dns_cache.forget(host, self.port)
+                raise error
+        finally:
+            self._dns_host = host
+        timings.connect = time.perf_counter() - resolved
+        return sock
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    """Also times the TLS handshake."""
+
+    def connect(self):
+        timings = getattr(_phase_timings, "current", None)
+        start = time.perf_counter()
+        super().connect()
+        if timings is not None:
+            timings.tls = max(time.perf_counter() - start - timings.dns - timings.connect, 0)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """An `HTTPAdapter` whose connections time their phases (see `PhaseTimings`)."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _TimedHTTPConnectionPool,
+                                                   "https": _TimedHTTPSConnectionPool}
+
+
+def new_session(hosts: int = PROBE_POOLED_HOSTS, per_host: int = PROBE_CONNECTIONS_PER_HOST) -> requests.Session:
+    """
+    Create a `requests.Session` to be shared by all probe threads, whose connections time their phases.
+
+    :param hosts: the number of hosts whose connection pool is kept (the least recently used ones are closed)
+    :param per_host: the number of connections kept alive per host
+    """
+    session = requests.Session()
+    adapter = TimedHTTPAdapter(pool_connections=hosts, pool_maxsize=per_host)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def probe(service, session: requests.Session = None,
+          timeout: tuple[float, float] = (PROBE_CONNECT_TIMEOUT, PROBE_READ_TIMEOUT)) -> ProbeResult:
+    """
+    Probe `service` with a `HEAD` request. Blocking: use `probe_services` to probe several services concurrently.
+
+    :param service: the service to probe (anything with a `name` and a `url`)
+    :param session: an optional session to reuse connections with
+    :param timeout: the (connect, read) timeouts of the request, in seconds
+    :returns: the result of the probe, a service is considered up if it answered with a status code below 400. The
+      phases are only timed with a session created by `new_session`.
+    """
+    now = dt.datetime.utcnow()
+    logger.info(f"[LOG]: Checking status of {service.name}")
+    timings = _phase_timings.current = PhaseTimings()
+    start = time.perf_counter()
+    try:
+        response = (session or requests).head(service.url, headers=PROBE_HEADERS, timeout=timeout)
+    except Exception as e:  # Any failure to get an answer means the service is down
+        logger.warning(f"[LOG]: {service.name} is down ({type(e).__name__})")
+        return ProbeResult(name=service.name, is_up=False, checked_at=now, error=type(e).__name__,
+                           latency=time.perf_counter() - start, dns=timings.dns, connect=timings.connect,
+                           tls=timings.tls)
+    finally:
+        _phase_timings.current = None
+    latency = time.perf_counter() - start
+
+    # `elapsed` spans from the start of the request to the headers of the response, the connection included
+    ttfb = max(response.elapsed.total_seconds() - timings.dns - timings.connect - timings.tls, 0)
+    return ProbeResult(name=service.name, is_up=response.status_code < 400, checked_at=now,
+                       status_code=response.status_code, latency=latency, dns=timings.dns, connect=timings.connect,
+                       tls=timings.tls, ttfb=ttfb, reused_connection=not timings.new_connection)
+
+
+def _probe_host(services: List, session: requests.Session, timeout: tuple[float, float]) -> List[ProbeResult]:
+    """Probe services of the same host one after the other, so that they share a connection."""
+    return [probe(service, session, timeout) for service in services]
+
+
+async def probe_services(services: Iterable, session: requests.Session = None,
+                         concurrency: int = PROBE_CONCURRENCY,
+                         timeout: tuple[float, float] = (PROBE_CONNECT_TIMEOUT, PROBE_READ_TIMEOUT),
+                         deadline: float = PROBE_CYCLE_DEADLINE,
+                         executor: ThreadPoolExecutor = None) -> Dict[str, ProbeResult]:
+    """
+    Probe all `services` concurrently, with at most `concurrency` hosts probed at the same time. The services of a same
+    host are probed one after the other.
+
+    :param services: the services to probe
+    :param session: an optional session shared by all probes (see `new_session`)
+    :param concurrency: the maximum number of hosts probed simultaneously, if no `executor` is given
+    :param timeout: the (connect, read) timeouts of each probe, in seconds
+    :param deadline: the maximum duration of the whole cycle, in seconds. Services whose probe did not finish in time
+      are reported as down.
+    :param executor: the thread pool running the probes, a temporary one by default
+    :returns: a dict mapping the name of each service to the result of its probe
+    """
+    hosts = defaultdict(list)
+    for service in services:
+        hosts[urlsplit(service.url)[:2]].append(service)  # (scheme, host:port): the key of a connection pool
+    if not hosts:
+        return {}
+
+    loop = asyncio.get_running_loop()
+    pool = executor or ThreadPoolExecutor(max_workers=min(concurrency, len(hosts)), thread_name_prefix="probe")
+    try:
+        futures = {loop.run_in_executor(pool, _probe_host, host_services, session, timeout): host_services
+                   for host_services in hosts.values()}
+        done, pending = await asyncio.wait(futures, timeout=deadline)
+    finally:
+        # Never wait on the pool here: that would block the event loop. Running probes end with their own timeouts.
+        if executor is None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    results = {}
+    for future in done:
+        for result in future.result():
+            results[result.name] = result
+
+    now = dt.datetime.utcnow()
+    for future in pending:
+        future.cancel()
+        for service in futures[future]:
+            logger.warning(f"[LOG]: {service.name} is down (probe exceeded the {deadline}s cycle deadline)")
+            results[service.name] = ProbeResult(name=service.name, is_up=False, checked_at=now,
+                                                error="DeadlineExceeded")
+
+    return results
+
+
+class ProbeClient:
+    """The long-lived client of the probes of the application, see the module documentation."""
+
+    def __init__(self, concurrency: int = PROBE_CONCURRENCY, hosts: int = PROBE_POOLED_HOSTS,
+                 per_host: int = PROBE_CONNECTIONS_PER_HOST):
+        self.concurrency = concurrency
+        self.hosts = hosts
+        self.per_host = per_host
+
+        self.probes = 0  # Probes that got an answer
+        self.reused = 0  # Probes that got an answer on a connection opened before
+
+        self.__session: requests.Session | None = None
+        self.__pool: ThreadPoolExecutor | None = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.__session is not None
+
+    def open(self):
+        """Create the session and the thread pool of the probes."""
+        self.__session = new_session(self.hosts, self.per_host)
+        self.__pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="probe")
+
+    def close(self):
+        """Close the connections kept alive. Running probes end with their own timeouts."""
+        if not self.is_open:
+            return
+
+        self.__pool.shutdown(wait=False, cancel_futures=True)
+        self.__session.close()
+        self.__session = self.__pool = None
+
+    async def probe_services(self, services: Iterable, **kwargs) -> Dict[str, ProbeResult]:
+        """`probe_services` with the session and the thread pool of the client, which must be open."""
+        results = await probe_services(services, self.__session, executor=self.__pool, **kwargs)
+
+        answered = [result for result in results.values() if result.reused_connection is not None]
+        self.probes += len(answered)
+        self.reused += sum(result.reused_connection for result in answered)
+        logger.info(f"[LOG]: {sum(result.reused_connection for result in answered)}/{len(answered)} probes reused a "
+                    f"connection ({self.reused}/{self.probes} in total), DNS cache: {dns_cache.hits} hits, "
+                    f"{dns_cache.misses} misses")
+        return results
+
@@ -0,0 +1,215 @@
+"""
+Adaptive scheduling of the probes: each service is probed on its own schedule instead of all of them on one global
+interval.
+
+The next due time of every service is kept in a priority queue (a heap): the scheduler sleeps until the earliest one,
+then probes all the services due (within `PROBE_BATCH_WINDOW`) together, with a `probe.ProbeClient`.
+
+- A service is probed every `PROBE_INTERVAL` seconds. While it stays up, the interval grows by `PROBE_BACKOFF` after
+  each probe, up to `PROBE_MAX_INTERVAL`: long-stable services are probed less often. A service that is down stays at
+  `PROBE_INTERVAL`, so that its recovery is noticed quickly. The intervals are counted from the time the previous probe
+  was due, not from its end: the duration of the probes doesn't add up, and the probes of a stable service stay evenly
+  spaced (which the run-length storage of the history relies on, see `runs.py`).
+- A probe that disagrees with the recorded status is not recorded right away: the service is probed again
+  `PROBE_CONFIRMATIONS` times, `PROBE_CONFIRM_INTERVAL` seconds apart. The change is only recorded (and the webhooks
+  notified) if all of them agree, so a single failed request never causes a false alert. Otherwise, it is ignored.
+"""
+import asyncio
+import heapq
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Iterable, List, Tuple
+
+from logger_config import *
+from models import RECHECK_AFTER
+from probe import ProbeClient, ProbeResult
+
+PROBE_INTERVAL = 60  # [s] Base time between two probes of a service
+PROBE_MAX_INTERVAL = RECHECK_AFTER  # [s] Time between two probes of a service that has been up for long
+PROBE_BACKOFF = 1.5  # Growth of the interval after each probe that found a service still up
+PROBE_CONFIRMATIONS = 3  # Probes confirming a change of status (after the first one) before it is recorded
+PROBE_CONFIRM_INTERVAL = 10  # [s] Time between two confirmation probes
+PROBE_BATCH_WINDOW = 1  # [s] Services due within this window of each other are probed together
+
+
+@dataclass
+class ProbeSchedule:
+    """The schedule of the probes of a service."""
+    interval: float  # [s] Time until the next regular probe
+    due: float  # time.monotonic() of the next probe
+    last_due: float = 0  # time.monotonic() at which the probe in flight, or the last one, was due
+    suspect: int = 0  # Consecutive probes that disagreed with the recorded status, not confirmed yet
+
+
+class ProbeScheduler:
+    """Probes each service when it is due and records the results, see the module documentation."""
+
+    def __init__(self, services, client: ProbeClient, on_recorded: Callable[[List[ProbeResult]], Awaitable[None]],
+                 interval: float = PROBE_INTERVAL, max_interval: float = PROBE_MAX_INTERVAL,
+                 backoff: float = PROBE_BACKOFF, confirmations: int = PROBE_CONFIRMATIONS,
+                 confirm_interval: float = PROBE_CONFIRM_INTERVAL, batch_window: float = PROBE_BATCH_WINDOW):
+        """
+        :param services: the services to probe (a `models.Services`). Services added later are picked up within
+          `interval` seconds.
+        :param client: the client probing the services, it must be open while the scheduler runs
+        :param on_recorded: called with the results recorded by each batch of probes (after `Service.record_probe`),
+          e.g. to store them
+        """
+        self.services = services
+        self.client = client
+        self.on_recorded = on_recorded
+        self.interval = interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.confirmations = confirmations
+        self.confirm_interval = confirm_interval
+        self.batch_window = batch_window
+
+        self.probes = 0
+        self.ignored = 0  # Changes of status that were not confirmed
+
+        self.__schedules: Dict[str, ProbeSchedule] = {}
+        self.__queue: List[Tuple[float, str]] = []  # (due, service name) heap, may contain outdated entries
+        self.__wake: asyncio.Event | None = None  # Set when a probe is scheduled, to wake the loop up
+        self.__task: asyncio.Task | None = None
+        self.__batches: set[asyncio.Task] = set()
+
+    @property
+    def running(self) -> bool:
+        return self.__task is not None
+
+    def time_until_next(self, names: Iterable[str] | None = None) -> float | None:
+        """
+        The time left until the next probe of some services [s], i.e. until the responses built from their statuses
+        may change. The probes of the other services don't matter.
+
+        :param names: the services, all of them if `None`
+        :returns: the time left, 0 if one of them is being probed (its result may come in at any time), `None` if the
+          scheduler isn't running or doesn't probe any of them yet
+        """
+        if not self.running:
+            return None
+        schedules = self.__schedules.values() if names is None \
+            else [self.__schedules[name] for name in names if name in self.__schedules]
+        if not schedules:
+            return None
+        due = min(schedule.due if schedule.due != float("inf") else 0 for schedule in schedules)
+        return max(due - time.monotonic(), 0)
+
+    def start(self):
+        """Start probing, on the running event loop. All services are probed right away."""
+        self.__schedules.clear()
+        self.__queue.clear()
+        self.__wake = asyncio.Event()
+        self.__task = asyncio.create_task(self.__run())
+
+    async def stop(self):
+        """Stop probing. The probes in flight are abandoned, their results are not recorded."""
+        if not self.running:
+            return
+
+        tasks = [self.__task, *self.__batches]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.__task = None
+        self.__batches.clear()
+
+    def __schedule(self, name: str, delay: float, regular: bool = False):
+        """Schedule the next probe of a service in `delay` seconds, after the due time of the last one if `regular`."""
+        schedule = self.__schedules[name]
+        now = time.monotonic()
+        # A regular probe late by more than its interval (e.g. a slow cycle) is due right away, without catching up
+        schedule.due = max(schedule.last_due + delay, now) if regular else now + delay
+        heapq.heappush(self.__queue, (schedule.due, name))
+        self.__wake.set()
+
+    def __add_new_services(self):
+        now = time.monotonic()
+        for name in self.services.root:
+            if name not in self.__schedules:
+                self.__schedules[name] = ProbeSchedule(interval=self.interval, due=now)
+                heapq.heappush(self.__queue, (now, name))
+
+    def __pop_due(self) -> List[str]:
+        """The services due now (or within the batch window), removed from the queue."""
+        due = []
+        horizon = time.monotonic() + self.batch_window
+        while self.__queue and self.__queue[0][0] <= horizon:
+            when, name = heapq.heappop(self.__queue)
+            schedule = self.__schedules.get(name)
+            # Skip the entries of removed services, and those replaced by a later `__schedule`
+            if schedule is not None and schedule.due == when and name in self.services.root:
+                schedule.last_due = when
+                schedule.due = float("inf")  # In flight
+                due.append(name)
+        return due
+
+    async def __run(self):
+        while True:
+            self.__add_new_services()
+            if due := self.__pop_due():
+                task = asyncio.create_task(self.__probe(due))
+                self.__batches.add(task)
+                task.add_done_callback(self.__batches.discard)
+
+            delay = self.interval  # Look for new services at least every base interval
+            if self.__queue:
+                delay = min(delay, self.__queue[0][0] - time.monotonic())
+            self.__wake.clear()
+            try:
+                await asyncio.wait_for(self.__wake.wait(), timeout=max(delay, 0))
+            except asyncio.TimeoutError:
+                pass
+
+    async def __probe(self, names: List[str]):
+        try:
+            results = await self.client.probe_services([self.services.root[name] for name in names])
+        except Exception as e:
+            logger.error(f"[LOG]: Error while probing {', '.join(names)}: {e}")
+            for name in names:
+                self.__schedule(name, self.interval)
+            return
+        self.probes += len(results)
+
+        recorded = []
+        for name, result in results.items():
+            service = self.services.root.get(name)
+            if service is None:
+                continue
+            if self.__handle(service, result):
+                service.record_probe(result)
+                recorded.append(result)
+
+        if recorded:
+            try:
+                await self.on_recorded(recorded)
+            except Exception as e:
+                logger.error(f"[LOG]: Error while recording the probes of {', '.join(names)}: {e}")
+
+    def __handle(self, service, result: ProbeResult) -> bool:
+        """Schedule the next probe of `service` after `result`, and tell whether the result should be recorded."""
+        schedule = self.__schedules[service.name]
+
+        if service.status is None or result.is_up == service.status:
+            if schedule.suspect:
+                logger.info(f"[LOG]: Change of status of {service.name} not confirmed, ignored")
+                self.ignored += 1
+            schedule.suspect = 0
+            schedule.interval = min(schedule.interval * self.backoff, self.max_interval) if result.is_up \
+                else self.interval
+            self.__schedule(service.name, schedule.interval, regular=True)
+            return True
+
+        schedule.suspect += 1
+        if schedule.suspect <= self.confirmations:
+            logger.info(f"[LOG]: {service.name} seems {'up' if result.is_up else 'down'}, confirming "
+                        f"({schedule.suspect}/{self.confirmations})")
+            self.__schedule(service.name, self.confirm_interval)
+            return False
+
+        # Confirmed: the first probe and all the confirmations agree
+        schedule.suspect = 0
+        schedule.interval = self.interval
+        self.__schedule(service.name, schedule.interval)
+        return True
@@ -0,0 +1,13 @@
+"""
+Recompute the tables derived from the raw history (the `probe_results` and `probe_runs` partitions) of `data/outage.sqlite3`.
+
+Usage: `python rebuild.py` (stop the application first).
+"""
+import sql
+
+
+if __name__ == "__main__":
+    print(f"Rebuilt the uptime counters of {sql.rebuild_uptime_counters()} services.")
+    sql.rebuild_rollups()
+    print(f"Rebuilt the rollup tables ({', '.join(sql.ROLLUP_TABLES.values())}).")
+    print(f"Rebuilt {sql.rebuild_incidents()} incidents.")
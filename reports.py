@@ -0,0 +1,140 @@
+"""
+Ingestion of the user reports of `/process` ("is the service down for you too?").
+
+During an outage, many users report at the same time, so a report never waits on the database: it is appended to an
+in-memory buffer and the request returns. Every `REPORT_FLUSH_INTERVAL`, the buffered reports are written with a single
+`executemany` in one transaction (a group commit), which also updates the shared user status of the services
+(`Service.is_up_user`, `Service.last_user_report`) for all workers. Only a batch that changes the user status of a
+service starts a new refresh generation: the reports of a storm confirming an outage don't invalidate the caches. Each
+batch bumps `sql.VERSION_REPORTS` though: the pages of the services, which chart the reports, are rendered again.
+
+A client counts once per service and per `REPORT_DEDUP_WINDOW`: reloading the page or clicking again doesn't add
+reports. If its report could not be written, the client can report again right away. The buffer is bounded by
+`REPORT_BUFFER_SIZE`: if the database stalls, the new reports are dropped instead of filling the memory.
+"""
+import asyncio
+import datetime as dt
+import time
+from collections import OrderedDict
+from typing import Callable, List, Tuple
+
+import sql
+from logger_config import *
+
+REPORT_FLUSH_INTERVAL = 0.25  # [s] Time between two group commits
+REPORT_DEDUP_WINDOW = 60  # [s] Time during which the reports of a client for a service count once
+REPORT_BUFFER_SIZE = 100_000  # Reports buffered before the new ones are dropped
+
+
+class ReportBuffer:
+    """Buffers the user reports and writes them to the database in batches, see the module documentation."""
+
+    def __init__(self, flush_interval: float = REPORT_FLUSH_INTERVAL, dedup_window: float = REPORT_DEDUP_WINDOW,
+                 max_size: int = REPORT_BUFFER_SIZE):
+        self.flush_interval = flush_interval
+        self.dedup_window = dedup_window
+        self.max_size = max_size
+
+        self.accepted = 0
+        self.duplicates = 0  # Reports ignored because the client already reported the service recently
+        self.dropped = 0  # Reports lost because the buffer was full or could not be written
+
+        # ((client, service), time.monotonic() of the report, date and time (UTC) of the report, status)
+        self.__pending: List[Tuple[Tuple[str, str], float, dt.datetime, bool]] = []
+        # Last accepted report of each (client, service), oldest first, to expire them in order
+        self.__seen: OrderedDict[Tuple[str, str], float] = OrderedDict()
+        self.__on_flush: Callable[[], None] | None = None
+        self.__task: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self.__task is not None
+
+    def __len__(self) -> int:
+        return len(self.__pending)
+
+    async def start(self, on_flush: Callable[[], None] = None):
+        """
+        Start the periodic flushes on the running event loop.
+
+        :param on_flush: called (in the event loop) after each batch is written, e.g. to reload the shared statuses
+        """
+        self.__on_flush = on_flush
+        self.__task = asyncio.create_task(self.__flush_periodically())
+
+    async def stop(self):
+        """Stop the periodic flushes and write the reports still buffered."""
+        if not self.running:
+            return
+
+        self.__task.cancel()
+        await asyncio.gather(self.__task, return_exceptions=True)
+        self.__task = None
+        await self.flush()
+
+    def submit(self, service: str, client: str, is_up: bool) -> bool:
+        """
+        Buffer a report, without waiting on the database. Must be called from the event loop.
+
+        :param service: the name of the service
+        :param client: identifies the user reporting (e.g. its IP address)
+        :param is_up: `True` if the service works for the user
+        :returns: `True` if the report was accepted, `False` if it was ignored (duplicate, or buffer full)
+        """
+        now = time.monotonic()
+        self.__expire(now)
+
+        key = (client, service)
+        if key in self.__seen:
+            self.duplicates += 1
+            return False
+        if len(self.__pending) >= self.max_size:
+            self.dropped += 1
+            return False
+
+        self.__seen[key] = now
+        self.__pending.append((key, now, dt.datetime.utcnow(), is_up))
+        self.accepted += 1
+        return True
+
+    async def flush(self):
+        """Write the buffered reports in one transaction."""
+        if not self.__pending:
+            return
+
+        batch, self.__pending = self.__pending, []
+        start = time.monotonic()
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, sql.insert_user_reports, [
+                (service, reported_at, is_up) for (_, service), _, reported_at, is_up in batch])
+        except Exception as e:
+            self.dropped += len(batch)
+            # The reports are lost: their clients may report again (unless they already did, after an expiry)
+            for key, seen_at, _, _ in batch:
+                if self.__seen.get(key) == seen_at:
+                    del self.__seen[key]
+            logger.error(f"[LOG]: Could not write {len(batch)} user reports: {e}")
+            return
+        logger.debug(f"[LOG]: Wrote {len(batch)} user reports in {time.monotonic() - start:.3f}s")
+
+        if self.__on_flush is not None:
+            self.__on_flush()
+
+    def __expire(self, now: float):
+        """Forget the reports older than the deduplication window. Amortized O(1): each report is forgotten once."""
+        while self.__seen:
+            key, reported_at = next(iter(self.__seen.items()))
+            if now - reported_at < self.dedup_window:
+                break
+            del self.__seen[key]
+
+    async def __flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"[LOG]: Error while flushing the user reports: {e}")
+
+
+reports = ReportBuffer()
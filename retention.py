@@ -0,0 +1,79 @@
+"""
+Retention of the history.
+
+The raw history (`probe_results`, `probe_runs`, `probe_timings`) is partitioned per month (see
+`sql.PARTITIONED_TABLES`). Once a day, the worker probing the services applies the retention policy:
+
+- The partitions that ended more than `RAW_RETENTION_MONTHS` months ago are expired. Their probes are first compacted
+  into the rollup tables (which the charts of long ranges read anyway), then, if `ARCHIVE_EXPIRED`, copied into a
+  SQLite file of `ARCHIVE_DIRECTORY`, and finally dropped. Dropping a table is cheap in SQLite, and its pages are reused
+  by the new rows rather than given back to the file system.
+- The buckets of the rollup tables older than their `ROLLUP_RETENTION` are deleted (`None`: kept forever).
+
+Usage: `python retention.py` applies the policy once (e.g. from a cron job if the application doesn't run).
+"""
+import datetime as dt
+import os
+import time
+from typing import Dict, List
+
+import sql
+from logger_config import *
+
+RAW_RETENTION_MONTHS = 13  # Complete months of raw history kept, besides the current one
+ROLLUP_RETENTION = {"rollup_hourly": 2 * 365 * 24 * 3600, "rollup_daily": None}  # [s] Age of the buckets kept
+ARCHIVE_EXPIRED = True  # Copy the expired partitions to `ARCHIVE_DIRECTORY` before dropping them
+ARCHIVE_DIRECTORY = "data/archive"
+RETENTION_INTERVAL = 24 * 3600  # [s] Time between two applications of the policy
+
+
+def raw_retention_start(now: int, months: int = RAW_RETENTION_MONTHS) -> int:
+    """The unix timestamp from which the raw history is kept: the start of the month `months` months before `now`."""
+    date = dt.datetime.fromtimestamp(now, dt.timezone.utc)
+    month = date.year * 12 + date.month - 1 - months
+    return int(dt.datetime(month // 12, month % 12 + 1, 1, tzinfo=dt.timezone.utc).timestamp())
+
+
+def apply_retention(now: int | None = None, months: int = RAW_RETENTION_MONTHS, archive: bool = ARCHIVE_EXPIRED,
+                    directory: str = ARCHIVE_DIRECTORY) -> List[str]:
+    """
+    Compact, archive and drop the expired partitions, and delete the expired rollups (blocking, run it in a thread).
+
+    :param now: the current unix timestamp
+    :param months: the number of complete months of raw history to keep
+    :param archive: whether to copy the expired partitions to `directory` before dropping them
+    :param directory: where to store the archives, one file per partition
+    :returns: the names of the partitions dropped
+    """
+    now = int(time.time()) if now is None else now
+    keep_from = raw_retention_start(now, months)
+
+    expired = [partition for partition in sql.list_partitions() if partition[3] <= keep_from]
+    # All the partitions of the probes of a month (samples and runs) are compacted together, before any is dropped
+    for start in sorted({start for _, table, start, _ in expired if table in sql.PROBE_TABLES}):
+        sql.compact_month(start)
+
+    dropped = []
+    for name, _, _, _ in expired:
+        if archive:
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"{name}.sqlite3")
+            rows = sql.archive_partition(name, path)
+            logger.info(f"[LOG]: Archived {rows} rows of {name} to {path}")
+        sql.drop_partition(name)
+        dropped.append(name)
+        logger.info(f"[LOG]: Dropped the partition {name}")
+
+    deleted: Dict[str, int] = {}
+    for table, retention in ROLLUP_RETENTION.items():
+        if retention is not None:
+            deleted[table] = sql.delete_rollups(table, now - retention)
+    if any(deleted.values()):
+        logger.info(f"[LOG]: Deleted the expired rollups ({', '.join(f'{n} of {t}' for t, n in deleted.items())})")
+
+    return dropped
+
+
+if __name__ == "__main__":
+    dropped = apply_retention()
+    print(f"Dropped {len(dropped)} partitions{': ' + ', '.join(dropped) if dropped else ''}.")
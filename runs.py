@@ -0,0 +1,156 @@
+"""
+Run-length encoding of the probes.
+
+Almost every probe of a service repeats the status of the previous one. In the "runs" storage (`sql.PROBE_STORAGE`),
+the probes are stored as runs, (start_ts, end_ts, status, samples) rows: `samples` probes with the same status, the
+first at `start_ts` and the last at `end_ts`, evenly spaced in between. A new probe extends the last run of its service
+if it has the same status and if, with it as the new end, every probe of the run stays within `RUN_TOLERANCE` seconds
+of its evenly spaced place; else it closes that run and starts a new one. The probes of a run are stored as samples
+until it is closed, so the run written is never changed afterwards. The spacing changes when the scheduler backs off,
+so a service that stays up is stored as a few short runs followed by a single long one (the scheduler probes at a fixed
+rate, see `probe_scheduler.py`).
+
+The probes are reconstructed from the runs by `decode`: the statuses, their number and the first and last timestamp of
+every run are exact, the timestamps in between are off by at most `RUN_TOLERANCE` seconds.
+
+Usage: `python runs.py <database>` checks that the runs of `data/outage.sqlite3` reconstruct the probes stored as
+samples in `<database>`, e.g. a copy made by `migrate.py --runs` (see `verify`).
+"""
+import math
+import sqlite3
+import sys
+from dataclasses import dataclass
+from itertools import zip_longest
+from typing import Iterable, List, Tuple
+
+RUN_TOLERANCE = 5  # [s] Maximal distance between a probe and its place in the run it extends
+
+
+@dataclass
+class Run:
+    """A run of probes of a service with the same status, see the module documentation."""
+    start_ts: int
+    end_ts: int
+    status: int
+    samples: int = 1
+    # The spacings that keep every probe of the run but the last within the tolerance of its place. They are only
+    # known to the writer that built the run: a run loaded from the database can't be extended.
+    min_spacing: float = -math.inf
+    max_spacing: float = math.inf
+
+    def extend(self, ts: int, status: int, tolerance: float = RUN_TOLERANCE) -> bool:
+        """Add the probe to the run if it continues it, and tell whether it did."""
+        if status != self.status or ts <= self.end_ts:
+            return False
+        # The end of the run becomes an inner probe: the spacing must keep it within the tolerance
+        min_spacing, max_spacing = self.min_spacing, self.max_spacing
+        if self.samples > 1:
+            min_spacing = max(min_spacing, (self.end_ts - tolerance - self.start_ts) / (self.samples - 1))
+            max_spacing = min(max_spacing, (self.end_ts + tolerance - self.start_ts) / (self.samples - 1))
+        if not min_spacing <= (ts - self.start_ts) / self.samples <= max_spacing:
+            return False
+        self.end_ts = ts
+        self.samples += 1
+        self.min_spacing, self.max_spacing = min_spacing, max_spacing
+        return True
+
+
+def decode(start_ts: int, end_ts: int, samples: int) -> List[int]:
+    """The timestamps of the probes of a run, in chronological order."""
+    if samples == 1:
+        return [start_ts]
+    spacing = (end_ts - start_ts) / (samples - 1)
+    return [start_ts + round(i * spacing) for i in range(samples - 1)] + [end_ts]
+
+
+def count(start_ts: int, end_ts: int, samples: int, after: int, until: int) -> int:
+    """The number of probes of a run with after < timestamp <= until (as decoded by `decode`), in O(1)."""
+    return _rank(start_ts, end_ts, samples, until) - _rank(start_ts, end_ts, samples, after)
+
+
+def _rank(start_ts: int, end_ts: int, samples: int, ts: int) -> int:
+    """The number of probes of a run with a timestamp <= ts."""
+    if ts < start_ts:
+        return 0
+    if ts >= end_ts:
+        return samples
+    # start_ts <= ts < end_ts, so there are inner probes: estimate the rank from the spacing, then correct the rounding
+    # of `decode` (at most a step each way)
+    spacing = (end_ts - start_ts) / (samples - 1)
+    rank = min(int((ts - start_ts) / spacing) + 1, samples - 1)
+    while rank > 0 and start_ts + round((rank - 1) * spacing) > ts:
+        rank -= 1
+    while rank < samples - 1 and start_ts + round(rank * spacing) <= ts:
+        rank += 1
+    return rank
+
+
+def encode(probes: Iterable[Tuple[int, int]], tolerance: float = RUN_TOLERANCE) -> List[Run]:
+    """Encode the (timestamp, status) probes of a service, in chronological order, as runs."""
+    runs: List[Run] = []
+    for ts, status in probes:
+        if not runs or not runs[-1].extend(ts, status, tolerance):
+            runs.append(Run(ts, ts, status))
+    return runs
+
+
+def compare(probes: Iterable[Tuple[int, int]], reconstructed: Iterable[Tuple[int, int]]) -> Tuple[int, int]:
+    """
+    Check that the (timestamp, status) probes of a service match their reconstruction, both in chronological order.
+
+    :returns: the number of probes and the largest distance between a probe and its reconstruction [s]
+    :raises ValueError: if the statuses or the number of probes differ, or a timestamp is off by more than
+      `RUN_TOLERANCE`
+    """
+    count, deviation = 0, 0
+    for original, copy in zip_longest(probes, reconstructed):
+        count += 1
+        if original is None or copy is None:
+            raise ValueError(f"{'fewer' if original is None else 'more'} probes than reconstructed")
+        if copy[1] != original[1]:
+            raise ValueError(f"probe {count} (at {original[0]}) has status {original[1]}, reconstructed as {copy[1]}")
+        deviation = max(deviation, abs(copy[0] - original[0]))
+        if deviation > RUN_TOLERANCE:
+            raise ValueError(f"probe {count} at {original[0]} is reconstructed at {copy[0]}")
+    return count, deviation
+
+
+def verify(samples_database: str) -> bool:
+    """
+    Compare the probes stored as samples in a database (partitioned or not) with the probes read from the live
+    database, service by service, and print the result. Only the range of dates of the samples is compared.
+
+    :returns: whether every service matches
+    """
+    import sql
+
+    samples = sqlite3.connect(samples_database)
+    tables = [name for name, in samples.execute("""
+        SELECT name FROM sqlite_master WHERE type = 'table' AND (name = 'probe_results' OR name LIKE 'probe_results_%')
+    """)]
+    service_ids = dict(samples.execute('SELECT name, service_id FROM services'))
+
+    ok = True
+    for name, service_id in sorted(service_ids.items()):
+        probes = sorted(row for table in tables for row in samples.execute(
+            f'SELECT ts, status FROM {table} WHERE service_id = ? AND source = ?', (service_id, sql.SOURCE_PROBE)))
+        if not probes:
+            continue
+        # A reconstructed probe may be up to RUN_TOLERANCE seconds away from the original one
+        reconstructed = [(ts, status) for batch in sql.export_probe_results(
+            [name], probes[0][0] - RUN_TOLERANCE, probes[-1][0] + RUN_TOLERANCE + 1, (sql.SOURCE_PROBE,))
+                         for _, ts, status, _ in batch]
+        try:
+            count, deviation = compare(probes, reconstructed)
+            print(f"{name}: {count} probes match, timestamps off by at most {deviation}s")
+        except ValueError as e:
+            print(f"{name}: MISMATCH, {e}")
+            ok = False
+    samples.close()
+    return ok
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit(f"Usage: python {sys.argv[0]} <database with the probes as samples>")
+    sys.exit(0 if verify(sys.argv[1]) else 1)
@@ -0,0 +1,41 @@
+"""
+Pre-serialized responses of the status API.
+
+The statuses only change once per refresh generation (see `Services.generation`), so the json body of each status
+endpoint is encoded once per generation into an immutable `ApiSnapshot` and served as is: a request only looks up bytes,
+without validating or serializing any model.
+"""
+import datetime as dt
+import json
+from dataclasses import dataclass
+from typing import Mapping
+
+
+def encode(data) -> bytes:
+    """Encode `data` as compact json, as FastAPI does."""
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+@dataclass(frozen=True)
+class ApiSnapshot:
+    """The bodies of the status endpoints for one refresh generation, see the module documentation."""
+    generation: int
+    last_modified: dt.datetime  # When the generation started: the `Last-Modified` of all the responses
+    overview: bytes  # /api/services/overview
+    statuses: bytes  # /api/services/up/all
+    details: bytes  # /api/services/all
+    service_statuses: Mapping[str, bytes]  # /api/services/up/{service}
+    service_details: Mapping[str, bytes]  # /api/services/{service}
+
+    @classmethod
+    def build(cls, services) -> "ApiSnapshot":
+        """Encode the responses for the current state of `services` (a `models.Services`)."""
+        return cls(
+            generation=services.generation,
+            last_modified=services.last_modified,
+            overview=encode([service.name for service in services]),
+            statuses=encode({service.name: service.is_up for service in services}),
+            details=services.model_dump_json(by_alias=True).encode(),
+            service_statuses={service.name: encode(service.is_up) for service in services},
+            service_details={service.name: service.model_dump_json(by_alias=True).encode() for service in services},
+        )
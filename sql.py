@@ -1,67 +1,1301 @@
 import sqlite3
 import datetime as dt
+import heapq
+import math
+import os
+import time as _time
+from collections import defaultdict
+from contextlib import contextmanager
+from itertools import groupby, islice
+from operator import itemgetter
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+
+import runs
+from db import DATABASE, pool
+
+# Values of the `source` column of the `probe_results` table
+SOURCE_PROBE = 0  # Status checked by the application itself
+SOURCE_USER = 1  # Status reported by a user
+
+# Windows over which the uptime of each service is kept up to date in the `uptime_counters` table ([s], 0 is all-time)
+UPTIME_WINDOWS = {"all": 0, "24h": 24 * 3600, "7d": 7 * 24 * 3600, "30d": 30 * 24 * 3600}
+
+# Tables of the probes aggregated per bucket of `resolution` seconds, from the finest to the coarsest
+ROLLUP_TABLES = {3600: "rollup_hourly", 24 * 3600: "rollup_daily"}
+RAW_RESOLUTION = 300  # [s] Maximal time between two probes of a service (`probe_scheduler.PROBE_MAX_INTERVAL`)
+EXPORT_BATCH_SIZE = 1_000  # Rows read at a time by `export_probe_results`
+
+# How the new probes are stored: "samples", one row of `probe_results` per probe, or "runs", one row of `probe_runs` per
+# run of probes with the same status (see `runs.py`). The runs are much smaller, but the timestamps inside a run are
+# only kept within `runs.RUN_TOLERANCE` seconds: they must be chosen explicitly. Even then, the probes of the last run
+# of each service stay samples until the run is closed (see `_record_runs`). Both are always read, so the history may
+# mix them.
+PROBE_STORAGE = "samples"
+
+# Sliding windows over which the latency percentiles of each service are computed ([s], see `get_latency_stats`)
+LATENCY_WINDOWS = {"1h": 3600, "24h": 24 * 3600, "7d": 7 * 24 * 3600}
+LATENCY_PERCENTILES = {"p50": 0.50, "p95": 0.95, "p99": 0.99}
+
+INCIDENT_REPORT_LEAD = 15 * 60  # [s] User reports up to this long before an incident count as confirming it
+INCIDENTS_LIMIT = 100  # Incidents returned by `get_incidents` by default
+
+# Rows of the `versions` table: bumped on every change of the state shared by the workers (see `cluster.py`)
+VERSION_STATUS = "status"  # The status snapshot in `service_status`, i.e. the refresh generation
+VERSION_WEBHOOKS = "webhooks"  # The `webhooks` and `webhook_services` tables
+VERSION_REPORTS = "reports"  # The user reports in the history: bumped by each batch, whether a status changed or not
+
+# The tables of the history are partitioned per month (UTC): the rows of `table` with a timestamp in month yyyy-mm are
+# in the table `{table}_{yyyymm}`, listed in `history_partitions`. The queries on a range of dates only read the
+# partitions overlapping it, and old months can be archived or dropped at once (see `retention.py`).
+PARTITIONED_TABLES = {
+    "probe_results": ['''
+        CREATE TABLE IF NOT EXISTS {name} (
+            service_id INTEGER NOT NULL REFERENCES services (service_id),
+            ts INTEGER NOT NULL,
+            status INTEGER NOT NULL,
+            source INTEGER NOT NULL
+        )
+    ''',
+        # Covers every query on the history: the table itself never has to be read
+        'CREATE INDEX IF NOT EXISTS {name}_service_source_ts ON {name} (service_id, source, ts, status)'],
+    # Timings of the probes [s] (see `probe.ProbeResult`), one row per row of `probe_results` with source = 0. The
+    # phases of the connection (dns, connect, tls) are 0 if it was reused, status_code is NULL if there was no answer.
+    "probe_timings": ['''
+        CREATE TABLE IF NOT EXISTS {name} (
+            service_id INTEGER NOT NULL REFERENCES services (service_id),
+            ts INTEGER NOT NULL,
+            status_code INTEGER,
+            latency REAL NOT NULL,
+            dns REAL,
+            connect REAL,
+            tls REAL,
+            ttfb REAL
+        )
+    ''',
+        'CREATE INDEX IF NOT EXISTS {name}_service_ts ON {name} (service_id, ts)'],
+    # The probes (source = 0) stored as runs, see `runs.py`. Partitioned by start_ts: a run never spans two months.
+    "probe_runs": ['''
+        CREATE TABLE IF NOT EXISTS {name} (
+            service_id INTEGER NOT NULL REFERENCES services (service_id),
+            start_ts INTEGER NOT NULL,
+            end_ts INTEGER NOT NULL,
+            status INTEGER NOT NULL,
+            samples INTEGER NOT NULL
+        )
+    ''',
+        # The runs of a service don't overlap: seeking the first one that ends in a range gives all of them, in order
+        'CREATE INDEX IF NOT EXISTS {name}_service_end ON {name} (service_id, end_ts)'],
+}
+PROBE_TABLES = ("probe_results", "probe_runs")  # The partitioned tables holding the probes
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS services (
+        service_id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE
+    );
+    -- The partitions of the tables of `PARTITIONED_TABLES`: `name` holds the rows of `partitioned_table` with
+    -- start_ts <= ts < end_ts
+    CREATE TABLE IF NOT EXISTS history_partitions (
+        name TEXT PRIMARY KEY,
+        partitioned_table TEXT NOT NULL,
+        start_ts INTEGER NOT NULL,
+        end_ts INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS history_partitions_table_start ON history_partitions (partitioned_table, start_ts);
+    -- Number of probes (total) and of probes that found the service up (up) over the last `span` seconds, only the
+    -- probes with since < ts are counted. Kept up to date by `insert_probe_results`.
+    CREATE TABLE IF NOT EXISTS uptime_counters (
+        service_id INTEGER NOT NULL REFERENCES services (service_id),
+        span INTEGER NOT NULL,
+        up INTEGER NOT NULL,
+        total INTEGER NOT NULL,
+        since INTEGER NOT NULL,
+        PRIMARY KEY (service_id, span)
+    ) WITHOUT ROWID;
+    -- The webhooks and the services each of them tracks
+    CREATE TABLE IF NOT EXISTS webhooks (
+        hook_id INTEGER PRIMARY KEY,
+        callback_url TEXT NOT NULL,
+        password_hash TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS webhook_services (
+        hook_id INTEGER NOT NULL REFERENCES webhooks (hook_id),
+        service_id INTEGER NOT NULL REFERENCES services (service_id),
+        PRIMARY KEY (hook_id, service_id)
+    ) WITHOUT ROWID;
+    -- Webhook callbacks that could not be delivered (see `delivery.py`)
+    CREATE TABLE IF NOT EXISTS webhook_dead_letters (
+        ts INTEGER NOT NULL,
+        hook_id INTEGER NOT NULL,
+        url TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        attempts INTEGER NOT NULL,
+        error TEXT
+    );
+    -- The latest status of each service, written by the worker that probes them for the other workers
+    CREATE TABLE IF NOT EXISTS service_status (
+        service_id INTEGER PRIMARY KEY REFERENCES services (service_id),
+        is_up INTEGER NOT NULL,
+        last_checked TEXT NOT NULL,
+        is_up_user INTEGER NOT NULL,
+        last_user_report TEXT NOT NULL
+    );
+    -- modified_at: date and time (UTC) of the last bump of the version
+    CREATE TABLE IF NOT EXISTS versions (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL,
+        modified_at TEXT
+    ) WITHOUT ROWID;
+    -- Outages of the services: opened by the first probe that finds a service down, closed by the first one that finds
+    -- it up again (end_ts is NULL while it is ongoing). probes counts the probes that found it down, user_reports the
+    -- reports of users that it is down, from `INCIDENT_REPORT_LEAD` seconds before its start. Kept up to date by
+    -- `insert_probe_results` and `insert_user_reports`.
+    CREATE TABLE IF NOT EXISTS incidents (
+        incident_id INTEGER PRIMARY KEY,
+        service_id INTEGER NOT NULL REFERENCES services (service_id),
+        start_ts INTEGER NOT NULL,
+        end_ts INTEGER,
+        probes INTEGER NOT NULL,
+        user_reports INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS incidents_service_start ON incidents (service_id, start_ts);
+    CREATE UNIQUE INDEX IF NOT EXISTS incidents_ongoing ON incidents (service_id) WHERE end_ts IS NULL;
+    -- Totals over the incidents of each service, for its MTTR (downtime / closed) and MTBF (uptime / intervals):
+    -- the closed incidents and their duration [s], the periods between two incidents and their duration [s]
+    CREATE TABLE IF NOT EXISTS incident_stats (
+        service_id INTEGER PRIMARY KEY REFERENCES services (service_id),
+        closed INTEGER NOT NULL DEFAULT 0,
+        downtime INTEGER NOT NULL DEFAULT 0,
+        intervals INTEGER NOT NULL DEFAULT 0,
+        uptime INTEGER NOT NULL DEFAULT 0,
+        last_end INTEGER
+    );
+''' + "".join(f'''
+    -- Probes of each service aggregated per bucket of {resolution} seconds (bucket is the timestamp at which it starts)
+    CREATE TABLE IF NOT EXISTS {table} (
+        service_id INTEGER NOT NULL REFERENCES services (service_id),
+        bucket INTEGER NOT NULL,
+        samples INTEGER NOT NULL,
+        up INTEGER NOT NULL,
+        first_ts INTEGER NOT NULL,
+        first_status INTEGER NOT NULL,
+        last_ts INTEGER NOT NULL,
+        last_status INTEGER NOT NULL,
+        PRIMARY KEY (service_id, bucket)
+    ) WITHOUT ROWID;
+''' for resolution, table in ROLLUP_TABLES.items())
+
+_service_ids: Dict[str, int] = {}  # Cache of the `services` table
+_counted_services: Set[int] = set()  # Services known to have their rows in the `uptime_counters` table
+_partitions: Dict[Tuple[str, int], str] = {}  # Cache of `history_partitions`: (partitioned table, start_ts): name
+_open_runs: Dict[int, Tuple[str, runs.Run]] = {}  # Run recorded per service id: (partition of its samples, run)
+
+
+@contextmanager
+def _writer() -> Iterator[sqlite3.Connection]:
+    """
+    `pool.writer`, that forgets the cached ids if the transaction is rolled back (they may refer to its rows). The caches
+    of the writer are only changed while holding its lock: the other writers, in other threads, never see them half
+    updated.
+    """
+    with pool.writer() as conn:
+        try:
+            yield conn
+        except BaseException:
+            _service_ids.clear()
+            _counted_services.clear()
+            _partitions.clear()
+            _open_runs.clear()
+            raise
+
 
 def convert_to_table_name(service_name):
+    """Name of the (legacy) per-service table of `service_name`."""
     table_name = service_name.replace('.', '_')
     table_name = table_name.replace('-', '_')
     return table_name
 
-def get_latest_status(service_name, amount=12*12):
-    conn = sqlite3.connect('data/outage.sqlite3')
-    cursor = conn.cursor()
-    table_name = convert_to_table_name(service_name)
 
+def init_db():
+    """Create the tables and indexes of the database if they don't exist yet."""
+    with _writer() as conn:
+        conn.executescript(SCHEMA)
+        # The databases created before `versions.modified_at` existed get it too
+        if "modified_at" not in {row[1] for row in conn.execute('PRAGMA table_info(versions)')}:
+            conn.execute('ALTER TABLE versions ADD COLUMN modified_at TEXT')
+
+
+def month_bounds(ts: int) -> Tuple[int, int]:
+    """The unix timestamps of the start of the month (UTC) of `ts` and of the start of the next month."""
+    date = dt.datetime.fromtimestamp(ts, dt.timezone.utc)
+    start = dt.datetime(date.year, date.month, 1, tzinfo=dt.timezone.utc)
+    end = dt.datetime(date.year + date.month // 12, date.month % 12 + 1, 1, tzinfo=dt.timezone.utc)
+    return int(start.timestamp()), int(end.timestamp())
+
+
+def _partition(cursor, table: str, ts: int) -> Tuple[str, int, int]:
+    """The partition of `table` for the timestamp `ts` (created if needed), as a (name, start_ts, end_ts) tuple."""
+    start, end = month_bounds(ts)
+    name = _partitions.get((table, start))
+    if name is None:
+        name = f"{table}_{dt.datetime.fromtimestamp(start, dt.timezone.utc):%Y%m}"
+        for statement in PARTITIONED_TABLES[table]:
+            cursor.execute(statement.format(name=name))
+        cursor.execute('''
+            INSERT INTO history_partitions (name, partitioned_table, start_ts, end_ts) VALUES (?, ?, ?, ?)
+            ON CONFLICT (name) DO NOTHING
+        ''', (name, table, start, end))
+        _partitions[(table, start)] = name
+    return name, start, end
+
+
+def _insert_partitioned(cursor, table: str, columns: Tuple[str, ...], rows: Iterable[tuple], ts_index: int = 1):
+    """Insert rows in the partitions of `table`, `ts_index` is the index of the timestamp in the rows."""
+    by_partition = defaultdict(list)
+    name, start, end = None, 0, 0
+    for row in rows:
+        ts = row[ts_index]
+        if not start <= ts < end:  # Consecutive rows are usually in the same partition
+            name, start, end = _partition(cursor, table, ts)
+        by_partition[name].append(row)
+
+    for name, partition_rows in by_partition.items():
+        cursor.executemany(f'''
+            INSERT INTO {name} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})
+        ''', partition_rows)
+
+
+def _overlapping_partitions(cursor, table: str, start: int = None, end: int = None,
+                            newest_first: bool = False) -> List[Tuple[str, int, int]]:
+    """
+    The partitions of `table` that may hold rows with `start` <= ts < `end` (no bound if `None`), as (name, start_ts,
+    end_ts) tuples, in chronological order (or the reverse).
+    """
+    return cursor.execute(f'''
+        SELECT name, start_ts, end_ts FROM history_partitions
+        WHERE partitioned_table = ? AND end_ts > ? AND start_ts < ? ORDER BY start_ts {"DESC" if newest_first else ""}
+    ''', (table, start if start is not None else -2 ** 63, end if end is not None else 2 ** 63 - 1)).fetchall()
+
+
+def list_partitions(table: str = None) -> List[Tuple[str, str, int, int]]:
+    """
+    The partitions of the history, from the oldest to the newest.
+
+    :param table: only list the partitions of this table of `PARTITIONED_TABLES`
+    :returns: (name, partitioned table, start_ts, end_ts) tuples
+    """
+    with pool.reader() as conn:
+        return conn.execute('''
+            SELECT name, partitioned_table, start_ts, end_ts FROM history_partitions
+            WHERE partitioned_table = COALESCE(?, partitioned_table) ORDER BY start_ts, partitioned_table
+        ''', (table,)).fetchall()
+
+
+def _probe_months(cursor, start: int = None, end: int = None, newest_first: bool = False) \
+        -> List[Tuple[int, int, Dict[str, str]]]:
+    """
+    The months of the probes overlapping the range (see `_overlapping_partitions`), as (start_ts, end_ts, partitions)
+    tuples where partitions maps the `PROBE_TABLES` that have a partition for the month to its name.
+    """
+    months = {}
+    for table in PROBE_TABLES:
+        for name, month_start, month_end in _overlapping_partitions(cursor, table, start, end):
+            months.setdefault((month_start, month_end), {})[table] = name
+    return [(month_start, month_end, partitions)
+            for (month_start, month_end), partitions in sorted(months.items(), reverse=newest_first)]
+
+
+def _sorted_by_ts(rows: Iterable[Tuple[int, int, int]], reverse: bool) -> Iterator[Tuple[int, int, int]]:
+    """Sort rows already in the order of their timestamps by (timestamp, status, position)."""
+    for _, same_ts in groupby(rows, key=lambda row: row[0]):
+        yield from sorted(same_ts, reverse=reverse)
+
+
+def _decoded_runs(cursor, partition: str, service_id: int, start: int, end: int,
+                  newest_first: bool) -> Iterator[Tuple[int, int, int]]:
+    """The probes of the runs of a partition of `probe_runs` with start <= timestamp < end, see `_history_rows`."""
+    order = "DESC" if newest_first else ""
+    for rowid, run_start, run_end, status, samples in cursor.connection.execute(f'''
+        SELECT rowid, start_ts, end_ts, status, samples FROM {partition}
+        WHERE service_id = ? AND end_ts >= ? AND start_ts < ? ORDER BY end_ts {order}
+    ''', (service_id, start, end)):
+        timestamps = runs.decode(run_start, run_end, samples)
+        for ts in reversed(timestamps) if newest_first else timestamps:
+            if start <= ts < end:
+                # Negative positions: they can't collide with the rowids of `probe_results`
+                yield ts, status, rowid - 2 ** 62
+
+
+def _history_rows(cursor, service_id: int, source: int, start: int = None, end: int = None,
+                  after: Tuple[int, int, int] | None = None,
+                  newest_first: bool = False) -> Iterator[Tuple[int, int, int]]:
+    """
+    The history of a service with start <= timestamp < end (no bound if `None`), whether stored as samples or as runs,
+    lazily: stop iterating to stop reading.
+
+    :param after: only the rows after this position (only in chronological order)
+    :returns: (timestamp, status, position) tuples, ordered by (timestamp, status, position) or the reverse. The
+      position is unique: it is the rowid of the sample, or derived from the rowid of the run.
+    """
+    start = start if start is not None else -2 ** 62
+    end = end if end is not None else 2 ** 63 - 1
+    if after is not None:
+        start = max(start, after[0])
+    order = "DESC" if newest_first else ""
+
+    for _, _, partitions in _probe_months(cursor, start, end, newest_first):
+        month = []
+        if "probe_results" in partitions:
+            month.append(cursor.connection.execute(f'''
+                SELECT ts, status, rowid FROM {partitions["probe_results"]}
+                WHERE service_id = ? AND source = ? AND ts >= ? AND ts < ? AND (ts, status, rowid) > (?, ?, ?)
+                ORDER BY ts {order}, status {order}, rowid {order}
+            ''', (service_id, source, start, end, *(after or (start - 1, 0, 0)))))
+        if "probe_runs" in partitions and source == SOURCE_PROBE:
+            decoded = _decoded_runs(cursor, partitions["probe_runs"], service_id, start, end, newest_first)
+            if after is not None:
+                decoded = (row for row in decoded if row > after)
+            month.append(_sorted_by_ts(decoded, newest_first))
+        yield from heapq.merge(*month, reverse=newest_first)
+
+
+def get_service_id(cursor, service_name: str, create: bool = False) -> int | None:
+    """
+    Get the id of `service_name` in the `services` table.
+
+    :param cursor: the cursor with which to query the database
+    :param service_name: the name of the service
+    :param create: if `True`, the service is added to the table if it isn't in there yet
+    :returns: the id of the service, or `None` if it isn't in the table (and `create` is `False`)
+    """
+    if service_name in _service_ids:
+        return _service_ids[service_name]
+
+    row = cursor.execute('SELECT service_id FROM services WHERE name = ?', (service_name,)).fetchone()
+    if row is None:
+        if not create:
+            return None
+        # Another worker may have added it since the SELECT (see `cluster.py`)
+        cursor.execute('INSERT INTO services (name) VALUES (?) ON CONFLICT (name) DO NOTHING', (service_name,))
+        row = cursor.execute('SELECT service_id FROM services WHERE name = ?', (service_name,)).fetchone()
+
+    _service_ids[service_name] = row[0]
+    return row[0]
+
+
+def insert_probe_results(results: Iterable[Tuple[str, int, bool]], source: int = SOURCE_PROBE,
+                         timings: Iterable[Tuple[str, int, int | None, float, float, float, float, float | None]] = ()):
+    """
+    Add statuses to the history.
+
+    :param results: (service name, unix timestamp, status) tuples
+    :param source: where the statuses come from: `SOURCE_PROBE` or `SOURCE_USER`
+    :param timings: (service name, unix timestamp, status code, latency, dns, connect, tls, ttfb) tuples of the probes,
+      added in the same transaction
+    """
+    with _writer() as conn:
+        cursor = conn.cursor()
+        rows = [(get_service_id(cursor, name, create=True), ts, status, source) for name, ts, status in results]
+        if source == SOURCE_PROBE:
+            for service_id, ts, status, _ in rows:
+                _update_uptime_counters(cursor, service_id, ts, status)
+        _insert_partitioned(cursor, "probe_results", ("service_id", "ts", "status", "source"), rows)
+        if source == SOURCE_PROBE and PROBE_STORAGE == "runs":
+            _record_runs(cursor, rows)
+        if source == SOURCE_PROBE:
+            _update_rollups(cursor, rows)
+            for service_id, ts, status, _ in rows:
+                _update_incidents(cursor, service_id, ts, status)
+        _insert_partitioned(cursor, "probe_timings",
+                            ("service_id", "ts", "status_code", "latency", "dns", "connect", "tls", "ttfb"),
+                            [(get_service_id(cursor, name, create=True), *timing) for name, *timing in timings])
+
+
+def _record_runs(cursor, rows: List[Tuple[int, int, bool, int]]):
+    """
+    Add probes (rows of `probe_results`, in chronological order per service, already inserted as samples) to the runs of
+    their services. A run is only written once closed, by the first probe that doesn't extend it: until then, its probes
+    stay samples, whose timestamps and positions don't change while the run grows. A run never spans two months.
+    """
+    for service_id, ts, status, _ in rows:
+        partition, _, _ = _partition(cursor, "probe_results", ts)
+        if service_id in _open_runs:
+            run_partition, run = _open_runs[service_id]
+            if run_partition == partition and run.extend(ts, int(status)):
+                continue
+            _close_run(cursor, service_id, run_partition, run)
+        _open_runs[service_id] = (partition, runs.Run(ts, ts, int(status)))
+
+
+def _close_run(cursor, service_id: int, partition: str, run: runs.Run):
+    """
+    Replace the samples of a closed run, in the `probe_results` partition `partition`, by the run. They stay samples if
+    the run has a single probe, or if they changed since they were inserted (another worker probed the service
+    meanwhile, see `cluster.py`).
+    """
+    where = 'service_id = ? AND source = ? AND ts >= ? AND ts <= ?'
+    params = (service_id, SOURCE_PROBE, run.start_ts, run.end_ts)
+    samples = cursor.execute(f'SELECT ts, status FROM {partition} WHERE {where} ORDER BY ts', params).fetchall()
+    if run.samples == 1 or len(samples) != run.samples or any(status != run.status for _, status in samples):
+        return
+
+    runs_partition, _, _ = _partition(cursor, "probe_runs", run.start_ts)
+    cursor.execute(f'DELETE FROM {partition} WHERE {where}', params)
     cursor.execute(f'''
-        SELECT * FROM {table_name} WHERE user = 0 ORDER BY timestamp DESC LIMIT {amount}
-    ''')
-    rows = cursor.fetchall()
-    conn.close()
-    
+        INSERT INTO {runs_partition} (service_id, start_ts, end_ts, status, samples) VALUES (?, ?, ?, ?, ?)
+    ''', (service_id, run.start_ts, run.end_ts, run.status, run.samples))
+
+    # The probes inside the run moved by up to `runs.RUN_TOLERANCE` seconds: those that crossed the start of a window of
+    # the uptime counters are moved in (or out of) its count, as `_count_probes` will expire them from their new place
+    for span, since in cursor.execute('''
+        SELECT span, since FROM uptime_counters WHERE service_id = ? AND span > 0
+    ''', (service_id,)).fetchall():
+        moved = runs.count(run.start_ts, run.end_ts, run.samples, since, run.end_ts) - \
+                sum(ts > since for ts, _ in samples)
+        if moved:
+            cursor.execute('''
+                UPDATE uptime_counters SET up = up + ?, total = total + ? WHERE service_id = ? AND span = ?
+            ''', (moved * run.status, moved, service_id, span))
+
+
+def _count_down_reports(cursor, service_id: int, start: int, end: int | None) -> int:
+    """Number of user reports that the service is down with start <= timestamp < end (no bound if `None`)."""
+    return sum(not status for _, status, _ in _history_rows(cursor, service_id, SOURCE_USER, start, end))
+
+
+def _open_incident(cursor, service_id: int, ts: int, probes: int = 1) -> int:
+    """
+    Open an incident of a service, the user reports of the last `INCIDENT_REPORT_LEAD` seconds confirm it.
+
+    :returns: the id of the incident
+    """
+    user_reports = _count_down_reports(cursor, service_id, ts - INCIDENT_REPORT_LEAD, ts + 1)
+    cursor.execute('''
+        INSERT INTO incidents (service_id, start_ts, end_ts, probes, user_reports) VALUES (?, ?, NULL, ?, ?)
+    ''', (service_id, ts, probes, user_reports))
+    incident_id = cursor.lastrowid
+    cursor.execute('INSERT INTO incident_stats (service_id) VALUES (?) ON CONFLICT DO NOTHING', (service_id,))
+    cursor.execute('''
+        UPDATE incident_stats SET intervals = intervals + 1, uptime = uptime + ? - last_end
+        WHERE service_id = ? AND last_end IS NOT NULL
+    ''', (ts, service_id))
+    return incident_id
+
+
+def _close_incident(cursor, incident_id: int, service_id: int, start_ts: int, ts: int):
+    """Close an ongoing incident of a service, at `ts`."""
+    cursor.execute('UPDATE incidents SET end_ts = ? WHERE incident_id = ?', (ts, incident_id))
+    cursor.execute('''
+        UPDATE incident_stats SET closed = closed + 1, downtime = downtime + ?, last_end = ? WHERE service_id = ?
+    ''', (ts - start_ts, ts, service_id))
+
+
+def _update_incidents(cursor, service_id: int, ts: int, status: bool):
+    """Open, extend or close the incident of a service after a new probe (in chronological order per service)."""
+    ongoing = cursor.execute(
+        'SELECT incident_id, start_ts FROM incidents WHERE service_id = ? AND end_ts IS NULL', (service_id,)).fetchone()
+    if ongoing is None:
+        if not status:
+            _open_incident(cursor, service_id, ts)
+    elif status:
+        _close_incident(cursor, ongoing[0], service_id, ongoing[1], ts)
+    else:
+        cursor.execute('UPDATE incidents SET probes = probes + 1 WHERE incident_id = ?', (ongoing[0],))
+
+
+def rebuild_incidents() -> int:
+    """
+    Recompute the incidents and their totals from the raw history, e.g. after a migration.
+
+    :returns: the number of incidents
+    """
+    with _writer() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM incidents')
+        cursor.execute('DELETE FROM incident_stats')
+        for service_id, in cursor.execute('SELECT service_id FROM services').fetchall():
+            ongoing = None  # (incident id, start_ts)
+            # Only the changes of status matter: the probes of a same status are counted at once
+            for status, probes in groupby(_history_rows(cursor, service_id, SOURCE_PROBE), key=lambda row: row[1]):
+                if status and ongoing is not None:
+                    _close_incident(cursor, ongoing[0], service_id, ongoing[1], next(probes)[0])
+                    ongoing = None
+                elif not status:
+                    probes = list(probes)
+                    if ongoing is None:
+                        ongoing = (_open_incident(cursor, service_id, probes[0][0], len(probes)), probes[0][0])
+                    else:
+                        cursor.execute('UPDATE incidents SET probes = probes + ? WHERE incident_id = ?',
+                                       (len(probes), ongoing[0]))
+            # The reports made during an incident confirm it as well (live, they are added as they come in)
+            incidents = cursor.execute(
+                'SELECT incident_id, start_ts, end_ts FROM incidents WHERE service_id = ?', (service_id,)).fetchall()
+            cursor.executemany('UPDATE incidents SET user_reports = ? WHERE incident_id = ?', [
+                (_count_down_reports(cursor, service_id, start_ts - INCIDENT_REPORT_LEAD, end_ts), incident_id)
+                for incident_id, start_ts, end_ts in incidents])
+        return cursor.execute('SELECT COUNT(*) FROM incidents').fetchone()[0]
+
+
+def get_incidents(service_name: str, start: int | None = None, end: int | None = None, limit: int = INCIDENTS_LIMIT) \
+        -> Tuple[List[Tuple[int, int | None, int, int]], Dict[str, int | float | None]]:
+    """
+    Get the incidents of a service, and its mean time to recovery and between failures.
+
+    :param service_name: the name of the service
+    :param start: only the incidents ongoing at or after this unix timestamp
+    :param end: only the incidents that started before this unix timestamp
+    :param limit: the maximal number of incidents
+    :returns: the incidents, newest first, as (start_ts, end_ts (`None` if ongoing), probes, user reports) tuples, and
+      the totals of the service: the number of incidents (`incidents`), the mean duration of the closed ones
+      (`mttr` [s]) and the mean time between the end of an incident and the start of the next one (`mtbf` [s]), `None`
+      without incidents to average
+    """
+    with pool.reader() as conn:
+        cursor = conn.cursor()
+        service_id = get_service_id(cursor, service_name)
+        # The incidents of a service don't overlap: those in the range started in it, but for the one ongoing at its
+        # start. The range of the index read is thus bounded on both sides.
+        incidents = cursor.execute('''
+            SELECT start_ts, end_ts, probes, user_reports FROM incidents
+            WHERE service_id = :service_id AND start_ts < :end AND (end_ts IS NULL OR end_ts >= :start)
+                AND start_ts >= COALESCE((SELECT MAX(start_ts) FROM incidents
+                                          WHERE service_id = :service_id AND start_ts <= :start), :start)
+            ORDER BY start_ts DESC LIMIT :limit
+        ''', {"service_id": service_id, "start": start if start is not None else -2 ** 63,
+              "end": end if end is not None else 2 ** 63 - 1, "limit": limit}).fetchall()
+        ongoing, = cursor.execute('''
+            SELECT COUNT(*) FROM incidents WHERE service_id = ? AND end_ts IS NULL
+        ''', (service_id,)).fetchone()
+        closed, downtime, intervals, uptime = cursor.execute('''
+            SELECT closed, downtime, intervals, uptime FROM incident_stats WHERE service_id = ?
+        ''', (service_id,)).fetchone() or (0, 0, 0, 0)
+
+    return incidents, {"incidents": closed + ongoing, "mttr": downtime / closed if closed else None,
+                       "mtbf": uptime / intervals if intervals else None}
+
+
+def _count_probes(cursor, service_id: int, after: int, until: int) -> Tuple[int, int]:
+    """Number of probes of the service that found it up and number of probes, with `after` < timestamp <= `until`."""
+    up, total = 0, 0
+    for _, _, partitions in _probe_months(cursor, after + 1, until + 1):
+        if "probe_results" in partitions:
+            partition_up, partition_total = cursor.execute(f'''
+                SELECT TOTAL(status), COUNT(*) FROM {partitions["probe_results"]}
+                WHERE service_id = ? AND source = ? AND ts > ? AND ts <= ?
+            ''', (service_id, SOURCE_PROBE, after, until)).fetchone()
+            up, total = up + int(partition_up), total + partition_total
+        if "probe_runs" in partitions:
+            for run_start, run_end, status, samples in cursor.execute(f'''
+                SELECT start_ts, end_ts, status, samples FROM {partitions["probe_runs"]}
+                WHERE service_id = ? AND end_ts > ? AND start_ts <= ?
+            ''', (service_id, after, until)).fetchall():
+                if not after < run_start <= run_end <= until:  # Only the runs crossing a bound are partly counted
+                    samples = runs.count(run_start, run_end, samples, after, until)
+                up, total = up + status * samples, total + samples
+    return up, total
+
+
+def _rebuild_uptime_counters(cursor, service_id: int, now: int):
+    """Recompute the uptime counters of a service from its whole history."""
+    for span in UPTIME_WINDOWS.values():
+        since = now - span if span else -1
+        up, total = _count_probes(cursor, service_id, since, now)
+        cursor.execute('''
+            INSERT OR REPLACE INTO uptime_counters (service_id, span, up, total, since) VALUES (?, ?, ?, ?, ?)
+        ''', (service_id, span, up, total, since))
+    _counted_services.add(service_id)
+
+
+def _update_uptime_counters(cursor, service_id: int, ts: int, status: bool):
+    """
+    Count a new probe in the uptime counters of its service, and stop counting the probes that left the windows.
+    Must be called before the probe is inserted in the `probe_results` partitions. Amortized O(1): every probe is added
+    once and removed once from each window.
+    """
+    if service_id not in _counted_services:
+        if cursor.execute('SELECT 1 FROM uptime_counters WHERE service_id = ?', (service_id,)).fetchone() is None:
+            # No counters yet (new service, or they were deleted): count the history already in the database
+            _rebuild_uptime_counters(cursor, service_id, ts - 1)
+        _counted_services.add(service_id)
+
+    for span in UPTIME_WINDOWS.values():
+        up, total = int(status), 1
+        since = None
+        if span:
+            old_since, = cursor.execute('''
+                SELECT since FROM uptime_counters WHERE service_id = ? AND span = ?
+            ''', (service_id, span)).fetchone()
+            since = ts - span
+            if since > old_since:
+                expired_up, expired_total = _count_probes(cursor, service_id, old_since, since)
+                up, total = up - expired_up, total - expired_total
+            else:
+                since = old_since
+
+        cursor.execute('''
+            UPDATE uptime_counters SET up = up + ?, total = total + ?, since = COALESCE(?, since)
+            WHERE service_id = ? AND span = ?
+        ''', (up, total, since, service_id, span))
+
+
+def rebuild_uptime_counters() -> int:
+    """
+    Recompute the uptime counters of all services from the raw history, e.g. after a migration or a manual edit of
+    the `probe_results` partitions.
+
+    :returns: the number of services for which the counters were rebuilt
+    """
+    now = int(_time.time())
+    with _writer() as conn:
+        cursor = conn.cursor()
+        _counted_services.clear()
+        cursor.execute('DELETE FROM uptime_counters')
+        service_ids = [row[0] for row in cursor.execute('SELECT service_id FROM services').fetchall()]
+        for service_id in service_ids:
+            _rebuild_uptime_counters(cursor, service_id, now)
+
+    return len(service_ids)
+
+
+def get_uptime(service_name) -> Dict[str, float | None]:
+    """
+    Get the uptime of a service over each of the `UPTIME_WINDOWS`: the fraction of the probes that found it up (or
+    `None` if it wasn't probed during that window). O(1): the counters are maintained as probes are inserted.
+    """
+    with pool.reader() as conn:
+        cursor = conn.cursor()
+        service_id = get_service_id(cursor, service_name)
+        counters = {span: (up, total) for span, up, total in cursor.execute('''
+            SELECT span, up, total FROM uptime_counters WHERE service_id = ?
+        ''', (service_id,))}
+
+    uptime = {}
+    for window, span in UPTIME_WINDOWS.items():
+        up, total = counters.get(span, (0, 0))
+        uptime[window] = up / total if total else None
+    return uptime
+
+
+def _update_rollups(cursor, rows: List[Tuple[int, int, bool, int]]):
+    """Add new probes (rows of `probe_results`) to the buckets of the rollup tables."""
+    for resolution, table in ROLLUP_TABLES.items():
+        cursor.executemany(f'''
+            INSERT INTO {table} (service_id, bucket, samples, up, first_ts, first_status, last_ts, last_status)
+            VALUES (?, ?, 1, ?, ?, ?, ?, ?)
+            ON CONFLICT (service_id, bucket) DO UPDATE SET
+                samples = samples + 1,
+                up = up + excluded.up,
+                first_status = CASE WHEN excluded.first_ts < first_ts THEN excluded.first_status ELSE first_status END,
+                first_ts = MIN(first_ts, excluded.first_ts),
+                last_status = CASE WHEN excluded.last_ts >= last_ts THEN excluded.last_status ELSE last_status END,
+                last_ts = MAX(last_ts, excluded.last_ts)
+        ''', [(service_id, ts - ts % resolution, status, ts, status, ts, status) for service_id, ts, status, _ in rows])
+
+
+def _rebuild_month_rollups(cursor, start: int, end: int, partitions: Dict[str, str]):
+    """
+    Recompute the buckets of the rollup tables of a month, [start, end), from its partitions (see `_probe_months`).
+    """
+    # The months start at midnight UTC: no hourly or daily bucket spans two months
+    for table in ROLLUP_TABLES.values():
+        cursor.execute(f'DELETE FROM {table} WHERE bucket >= ? AND bucket < ?', (start, end))
+
+    partition = partitions.get("probe_results")
+    for resolution, table in ROLLUP_TABLES.items() if partition is not None else ():
+        cursor.execute(f'''
+            INSERT INTO {table} (service_id, bucket, samples, up, first_ts, first_status, last_ts, last_status)
+            SELECT service_id, ts - ts % {resolution} AS bucket, COUNT(*), SUM(status), MIN(ts), 0, MAX(ts), 0
+            FROM {partition} WHERE source = ? GROUP BY service_id, bucket
+        ''', (SOURCE_PROBE,))
+        cursor.execute(f'''
+            UPDATE {table} SET
+                first_status = (SELECT status FROM {partition} AS p WHERE p.service_id = {table}.service_id
+                                AND p.source = ? AND p.ts = {table}.first_ts LIMIT 1),
+                last_status = (SELECT status FROM {partition} AS p WHERE p.service_id = {table}.service_id
+                               AND p.source = ? AND p.ts = {table}.last_ts LIMIT 1)
+            WHERE bucket >= ? AND bucket < ?
+        ''', (SOURCE_PROBE, SOURCE_PROBE, start, end))
+
+    # The runs are added on top, probe by probe
+    partition = partitions.get("probe_runs")
+    service_ids = [service_id for service_id, in cursor.execute(f'SELECT DISTINCT service_id FROM {partition}')] \
+        if partition is not None else []
+    for service_id in service_ids:
+        _update_rollups(cursor, [(service_id, ts, status, SOURCE_PROBE)
+                                 for ts, status, _ in _decoded_runs(cursor, partition, service_id, start, end, False)])
+
+
+def rebuild_rollups():
+    """Recompute the rollup tables from the raw history. The buckets of the months without raw history are kept."""
+    with _writer() as conn:
+        cursor = conn.cursor()
+        for start, end, partitions in _probe_months(cursor):
+            _rebuild_month_rollups(cursor, start, end, partitions)
+
+
+def compact_month(start: int):
+    """
+    Make sure that the probes of the month starting at `start` are summarized in the rollup tables, before its
+    partitions are archived or dropped.
+    """
+    with _writer() as conn:
+        cursor = conn.cursor()
+        for month_start, month_end, partitions in _probe_months(cursor, start, start + 1):
+            _rebuild_month_rollups(cursor, month_start, month_end, partitions)
+
+
+def archive_partition(name: str, path: str) -> int:
+    """
+    Copy a partition, and the `services` table to know which service each row is about, into the SQLite database at
+    `path` (created if needed). The partition is read from a consistent snapshot, and the copy replaces any previous
+    copy of the same partition.
+
+    :returns: the number of rows copied
+    """
+    archive = sqlite3.connect(path)
+    try:
+        with pool.snapshot_reader() as conn:
+            schema, = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                   (name,)).fetchone()
+            archive.execute('''
+                CREATE TABLE IF NOT EXISTS services (service_id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)
+            ''')
+            archive.executemany('INSERT OR REPLACE INTO services (service_id, name) VALUES (?, ?)',
+                                conn.execute('SELECT service_id, name FROM services'))
+            archive.execute(f'DROP TABLE IF EXISTS {name}')
+            archive.execute(schema)
+
+            copied = 0
+            cursor = conn.execute(f'SELECT * FROM {name}')
+            while rows := cursor.fetchmany(EXPORT_BATCH_SIZE):
+                archive.executemany(f'INSERT INTO {name} VALUES ({", ".join("?" * len(rows[0]))})', rows)
+                copied += len(rows)
+        archive.commit()
+    finally:
+        archive.close()
+    return copied
+
+
+def drop_partition(name: str):
+    """Delete a partition of the history, and all its rows."""
+    with _writer() as conn:
+        conn.execute(f'DROP TABLE IF EXISTS {name}')
+        conn.execute('DELETE FROM history_partitions WHERE name = ?', (name,))
+        # In the transaction (thus under the lock of the writer): the probes recorded meanwhile, from the event loop,
+        # never use a cached partition or run that is being dropped
+        for key, partition in list(_partitions.items()):
+            if partition == name:
+                del _partitions[key]
+        for service_id, (partition, _) in list(_open_runs.items()):
+            if partition == name:
+                del _open_runs[service_id]
+
+
+def delete_rollups(table: str, before: int) -> int:
+    """
+    Delete the buckets of a rollup table that start before a date.
+
+    :param table: one of the `ROLLUP_TABLES`
+    :param before: the unix timestamp before which the buckets are deleted
+    :returns: the number of buckets deleted
+    """
+    with _writer() as conn:
+        return conn.execute(f'DELETE FROM {table} WHERE bucket < ?', (before,)).rowcount
+
+
+def partition_history() -> Dict[str, int]:
+    """
+    Move the rows of the unpartitioned tables of `PARTITIONED_TABLES` (from before the partitioning) into their
+    partitions, then drop them. Everything happens in one transaction, so running it again after a failure is safe.
+
+    :returns: the number of rows moved per table
+    """
+    init_db()
+
+    moved = {}
+    with _writer() as conn:
+        cursor = conn.cursor()
+        for table in PARTITIONED_TABLES:
+            if cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                              (table,)).fetchone() is None:
+                continue
+
+            moved[table] = 0
+            columns = ", ".join(row[1] for row in cursor.execute(f'PRAGMA table_info({table})'))
+            # One timestamp of each month with rows: no empty partition is created
+            months = cursor.execute(f"SELECT MIN(ts) FROM {table} GROUP BY strftime('%Y%m', ts, 'unixepoch')")
+            for ts, in months.fetchall():
+                partition, start, end = _partition(cursor, table, ts)
+                cursor.execute(f'''
+                    INSERT INTO {partition} ({columns}) SELECT {columns} FROM {table} WHERE ts >= ? AND ts < ?
+                ''', (start, end))
+                moved[table] += cursor.rowcount
+            cursor.execute(f'DROP TABLE {table}')
+
+    return moved
+
+
+def convert_to_runs(directory: str | None = None) -> Tuple[int, int]:
+    """
+    Convert the probes stored as samples (rows of `probe_results`) to runs (see `runs.py`), one month per transaction.
+    The runs of each service are checked against its samples before these are deleted: a mismatch raises a
+    `ValueError` and leaves the month untouched. The uptime counters are then rebuilt from the runs.
+
+    :param directory: if given, each partition of samples is first copied there (see `archive_partition`), to check the
+      conversion (`python runs.py <copy>`) or to undo it: the timestamps inside the runs are only kept within
+      `runs.RUN_TOLERANCE` seconds
+    :returns: the number of probes converted (the runs of the months already partly converted included) and the
+      number of runs that replaced them
+    """
+    init_db()
+    with pool.reader() as conn:
+        partitions = _overlapping_partitions(conn.cursor(), "probe_results")
+
+    converted, written = 0, 0
+    for partition, start, end in partitions:
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            archive_partition(partition, os.path.join(directory, f"{partition}.sqlite3"))
+        with _writer() as conn:
+            cursor = conn.cursor()
+            runs_partition, _, _ = _partition(cursor, "probe_runs", start)
+            service_ids = [service_id for service_id, in cursor.execute(f'''
+                SELECT DISTINCT service_id FROM {partition} WHERE source = ?
+            ''', (SOURCE_PROBE,))]
+            for service_id in service_ids:
+                # The runs already written for the month (if the storage changed during it) are encoded again with the
+                # samples, so that the runs of the service never overlap
+                probes = sorted(cursor.execute(f'''
+                    SELECT ts, status FROM {partition} WHERE service_id = ? AND source = ?
+                ''', (service_id, SOURCE_PROBE)).fetchall() + [(ts, status) for ts, status, _ in _decoded_runs(
+                    cursor, runs_partition, service_id, start, end, False)])
+                encoded = runs.encode(probes)
+                runs.compare(probes, [(ts, run.status) for run in encoded
+                                      for ts in runs.decode(run.start_ts, run.end_ts, run.samples)])
+                cursor.execute(f'DELETE FROM {runs_partition} WHERE service_id = ?', (service_id,))
+                cursor.executemany(f'''
+                    INSERT INTO {runs_partition} (service_id, start_ts, end_ts, status, samples) VALUES (?, ?, ?, ?, ?)
+                ''', [(service_id, run.start_ts, run.end_ts, run.status, run.samples) for run in encoded])
+                converted += len(probes)
+                written += len(encoded)
+                _open_runs.pop(service_id, None)
+            cursor.execute(f'DELETE FROM {partition} WHERE source = ?', (SOURCE_PROBE,))
+
+    # The counters expire the probes from their timestamps in the runs
+    rebuild_uptime_counters()
+    return converted, written
+
+
+def get_history(service_name, start: int, end: int,
+                max_points: int = 500) -> Tuple[int, List[Tuple[int, int, int, int, int]]]:
+    """
+    Get the probe history of a service between two unix timestamps, at the finest resolution for which the range
+    fits in `max_points` points: raw probes, or the buckets of one of the `ROLLUP_TABLES`. The cost of the query thus
+    only depends on `max_points`, not on the length of the range.
+
+    :param service_name: the name of the service
+    :param start: the unix timestamp from which to get the history (included)
+    :param end: the unix timestamp until which to get the history (excluded)
+    :param max_points: the maximal number of points wanted
+    :returns: the resolution of the points in seconds (0 for raw probes) and the points, in chronological order, as
+      (timestamp, samples, up, first_status, last_status) tuples. For raw probes, samples is 1 and the other values
+      are the status of the probe.
+    """
+    span = max(end - start, 0)
+    with pool.reader() as conn:
+        cursor = conn.cursor()
+        service_id = get_service_id(cursor, service_name)
+
+        # The raw probes and the finer rollups past their retention are deleted (see `retention.py`): a range older
+        # than them is read from a coarser resolution
+        oldest, = cursor.execute(f'''
+            SELECT MIN(start_ts) FROM history_partitions WHERE partitioned_table IN {PROBE_TABLES}
+        ''').fetchone()
+        # RAW_RESOLUTION is the longest time between two probes: the services down, or new, are probed more often, so
+        # the probes of a range short enough are counted before reading them (cheap, see `_count_probes`)
+        if span <= RAW_RESOLUTION * max_points and (oldest is None or oldest <= start) \
+                and _count_probes(cursor, service_id, start - 1, end - 1)[1] <= max_points:
+            return 0, [(ts, 1, status, status, status)
+                       for ts, status, _ in _history_rows(cursor, service_id, SOURCE_PROBE, start, end)]
+
+        def covers(table: str, before: int) -> bool:
+            return cursor.execute(f'SELECT 1 FROM {table} WHERE service_id = ? AND bucket <= ? LIMIT 1',
+                                  (service_id, before)).fetchone() is not None
+
+        # A finer rollup is expired at `start` if it has nothing before it while the coarsest one has older buckets
+        *finer, (coarsest_resolution, coarsest) = ROLLUP_TABLES.items()
+        older_history = covers(coarsest, start - start % coarsest_resolution - 1)
+        resolution, table = next(((resolution, table) for resolution, table in finer
+                                  if span <= resolution * max_points and (not older_history or covers(table, start))),
+                                 (coarsest_resolution, coarsest))
+        rows = cursor.execute(f'''
+            SELECT bucket, samples, up, first_status, last_status FROM {table}
+            WHERE service_id = ? AND bucket >= ? AND bucket < ? ORDER BY bucket
+        ''', (service_id, start - start % resolution, end)).fetchall()
+        return resolution, rows
+
+
+def get_history_page(service_name, source: int, start: int, end: int, after: Tuple[int, int, int] | None = None,
+                     limit: int = 1000) -> List[Tuple[int, int, int]]:
+    """
+    Get a page of the raw history of a service, in chronological order. The pages are delimited by the position of
+    their last row (keyset pagination) rather than by an offset, so every page costs the same: a seek in the covering
+    index followed by `limit` rows, however deep the page.
+
+    :param service_name: the name of the service
+    :param source: the statuses to get: `SOURCE_PROBE` or `SOURCE_USER`
+    :param start: the unix timestamp from which to get the history (included)
+    :param end: the unix timestamp until which to get the history (excluded)
+    :param after: the position of the last row of the previous page, `None` for the first page
+    :param limit: the maximal number of rows of the page
+    :returns: the rows, as (timestamp, status, position) tuples. The position of the last row gives the next page.
+    """
+    with pool.reader() as conn:
+        cursor = conn.cursor()
+        service_id = get_service_id(cursor, service_name)
+        # In the order of the indexes: the seeks start at the timestamp of the last row, and only the rows sharing it
+        # are skipped by the comparison with its position
+        return list(islice(_history_rows(cursor, service_id, source, start, end, after), limit))
+
+
+def export_probe_results(service_names: Iterable[str], start: int = 0, end: int | None = None,
+                         sources: Iterable[int] = (SOURCE_PROBE, SOURCE_USER),
+                         batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[List[Tuple[str, int, int, int]]]:
+    """
+    Stream the raw history of services, batch by batch, from a consistent snapshot of the database (see
+    `db.ConnectionPool.snapshot_reader`). Only one batch is in memory at a time, whatever the size of the range.
+
+    :param service_names: the services for which to get the history, in the order in which to get them
+    :param start: the unix timestamp from which to get the history (included)
+    :param end: the unix timestamp until which to get the history (excluded), no limit if `None`
+    :param sources: the sources of the statuses to get (`SOURCE_PROBE` and/or `SOURCE_USER`), in the order in which to
+      get them
+    :returns: batches of (service name, timestamp, status, source) tuples: per service, per source, in chronological
+      order
+    """
+    end = end if end is not None else 2 ** 63 - 1
+    with pool.snapshot_reader() as conn:
+        cursor = conn.cursor()
+        for name in service_names:
+            service_id = get_service_id(cursor, name)
+            if service_id is None:
+                continue
+            for source in sources:
+                # In the order of the indexes: the rows are read as they are sent, nothing is sorted
+                rows = _history_rows(cursor, service_id, source, start, end)
+                try:
+                    while batch := list(islice(rows, batch_size)):
+                        yield [(name, ts, status, source) for ts, status, _ in batch]
+                finally:  # Before the connection, if the export is closed in the middle
+                    rows.close()
+
+
+def load_webhooks() -> List[Tuple[int, str, str, List[str]]]:
+    """Get all webhooks, as (hook_id, callback_url, password_hash, names of the tracked services) tuples."""
+    with pool.reader() as conn:
+        tracked = defaultdict(list)
+        for hook_id, name in conn.execute('''
+            SELECT webhook_services.hook_id, services.name FROM webhook_services
+            JOIN services ON services.service_id = webhook_services.service_id
+        '''):
+            tracked[hook_id].append(name)
+
+        return [(hook_id, callback_url, password_hash, tracked[hook_id]) for hook_id, callback_url, password_hash
+                in conn.execute('SELECT hook_id, callback_url, password_hash FROM webhooks')]
+
+
+def _set_webhook_services(cursor, hook_id: int, service_names: Iterable[str]):
+    cursor.execute('DELETE FROM webhook_services WHERE hook_id = ?', (hook_id,))
+    cursor.executemany('INSERT INTO webhook_services (hook_id, service_id) VALUES (?, ?)',
+                       [(hook_id, get_service_id(cursor, name, create=True)) for name in service_names])
+
+
+def insert_webhook(callback_url: str, password_hash: str, service_names: Iterable[str], hook_id: int = None) -> int:
+    """
+    Add a webhook.
+
+    :param hook_id: the id of the webhook, a new one is chosen if not given
+    :returns: the id of the webhook
+    """
+    with _writer() as conn:
+        cursor = conn.cursor()
+        cursor.execute('INSERT INTO webhooks (hook_id, callback_url, password_hash) VALUES (?, ?, ?)',
+                       (hook_id, callback_url, password_hash))
+        hook_id = cursor.lastrowid
+        _set_webhook_services(cursor, hook_id, service_names)
+        _bump_version(cursor, VERSION_WEBHOOKS)
+
+    return hook_id
+
+
+def update_webhook(hook_id: int, callback_url: str = None, service_names: Iterable[str] = None):
+    """Change the callback url and/or the tracked services of a webhook (the values that are `None` don't change)."""
+    with _writer() as conn:
+        cursor = conn.cursor()
+        if callback_url is not None:
+            cursor.execute('UPDATE webhooks SET callback_url = ? WHERE hook_id = ?', (callback_url, hook_id))
+        if service_names is not None:
+            _set_webhook_services(cursor, hook_id, service_names)
+        _bump_version(cursor, VERSION_WEBHOOKS)
+
+
+def delete_webhook(hook_id: int):
+    with _writer() as conn:
+        conn.execute('DELETE FROM webhook_services WHERE hook_id = ?', (hook_id,))
+        conn.execute('DELETE FROM webhooks WHERE hook_id = ?', (hook_id,))
+        _bump_version(conn, VERSION_WEBHOOKS)
+
+
+def insert_dead_letter(ts: int, hook_id: int, url: str, payload: str, attempts: int, error: str | None):
+    """Record a webhook callback that could not be delivered."""
+    with _writer() as conn:
+        conn.execute('''
+            INSERT INTO webhook_dead_letters (ts, hook_id, url, payload, attempts, error) VALUES (?, ?, ?, ?, ?, ?)
+        ''', (ts, hook_id, url, payload, attempts, error))
+
+
+def _bump_version(cursor, name: str) -> int:
+    """Increment the version `name` (one of the `VERSION_*` constants) and return its new value."""
+    return cursor.execute('''
+        INSERT INTO versions (name, version, modified_at) VALUES (?, 1, ?)
+        ON CONFLICT (name) DO UPDATE SET version = version + 1, modified_at = excluded.modified_at
+        RETURNING version
+    ''', (name, dt.datetime.utcnow().isoformat())).fetchone()[0]
+
+
+def get_version(name: str) -> int:
+    """The current value of the version `name`, 0 if it was never bumped."""
+    with pool.reader() as conn:
+        row = conn.execute('SELECT version FROM versions WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else 0
+
+
+def _read_version(cursor, name: str) -> Tuple[int, dt.datetime | None]:
+    """The current value of the version `name` and the date and time (UTC) it was bumped, `None` if unknown."""
+    row = cursor.execute('SELECT version, modified_at FROM versions WHERE name = ?', (name,)).fetchone()
+    if row is None:
+        return 0, None
+    return row[0], dt.datetime.fromisoformat(row[1]) if row[1] is not None else None
+
+
+def save_status_snapshot(statuses: Iterable[Tuple[str, bool, dt.datetime, bool, dt.datetime]]) \
+        -> Tuple[int, dt.datetime | None, List[Tuple[str, bool, dt.datetime, bool, dt.datetime]]]:
+    """
+    Replace the shared probe status of the services. The user status (`is_up_user`, `last_user_report`) is only set for
+    new services: it is maintained by `insert_user_reports`, from the reports received by all workers.
+
+    :param statuses: (service name, is_up, last_checked, is_up_user, last_user_report) tuples
+    :returns: the new refresh generation (the `VERSION_STATUS` version), the date it started and the shared status of
+      the services at that generation, as returned by `load_status_snapshot`
+    """
+    with _writer() as conn:
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT INTO service_status (service_id, is_up, last_checked, is_up_user, last_user_report)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (service_id) DO UPDATE SET is_up = excluded.is_up, last_checked = excluded.last_checked
+        ''', [(get_service_id(cursor, name, create=True), is_up, last_checked.isoformat(), is_up_user,
+               last_user_report.isoformat())
+              for name, is_up, last_checked, is_up_user, last_user_report in statuses])
+        _bump_version(cursor, VERSION_STATUS)
+        return *_read_version(cursor, VERSION_STATUS), _read_status_snapshot(cursor)
+
+
+def insert_user_reports(reports: Iterable[Tuple[str, dt.datetime, bool]]) -> int:
+    """
+    Add a batch of user reports to the history and update the shared user status of their services, in a single
+    transaction (a group commit).
+
+    :param reports: (service name, date and time (UTC) of the report, status) tuples, in the order they were received
+    :returns: the new refresh generation (the `VERSION_STATUS` version) if the user status of a service changed, else
+      `None`
+    """
+    with _writer() as conn:
+        cursor = conn.cursor()
+        rows = []
+        latest: Dict[int, Tuple[dt.datetime, bool]] = {}
+        for name, reported_at, status in reports:
+            service_id = get_service_id(cursor, name, create=True)
+            rows.append((service_id, int(reported_at.replace(tzinfo=dt.timezone.utc).timestamp()), status, SOURCE_USER))
+            latest[service_id] = (reported_at, status)
+        _insert_partitioned(cursor, "probe_results", ("service_id", "ts", "status", "source"), rows)
+        # The reports that a service is down confirm its ongoing incident (the earlier ones are counted when it opens)
+        down_reports = defaultdict(int)
+        for service_id, _, status, _ in rows:
+            down_reports[service_id] += not status
+        cursor.executemany('''
+            UPDATE incidents SET user_reports = user_reports + ? WHERE service_id = ? AND end_ts IS NULL
+        ''', [(count, service_id) for service_id, count in down_reports.items() if count])
+        # A worker may flush older reports after another one flushed newer reports: the newest report wins
+        changed = cursor.executemany('''
+            UPDATE service_status SET is_up_user = ?, last_user_report = ?
+            WHERE service_id = ? AND last_user_report < ? AND is_up_user != ?
+        ''', [(status, reported_at.isoformat(), service_id, reported_at.isoformat(), status)
+              for service_id, (reported_at, status) in latest.items()]).rowcount
+        cursor.executemany('''
+            UPDATE service_status SET last_user_report = ? WHERE service_id = ? AND last_user_report < ?
+        ''', [(reported_at.isoformat(), service_id, reported_at.isoformat())
+              for service_id, (reported_at, _) in latest.items()])
+        # Only a change of a user status starts a new generation: during an outage, the reports confirming it every
+        # flush don't drop the cached pages and API responses (the dates of the last reports are shared with it). Only
+        # the pages showing the reports depend on `VERSION_REPORTS`.
+        _bump_version(cursor, VERSION_REPORTS)
+        return _bump_version(cursor, VERSION_STATUS) if changed else None
+
+
+def load_status_snapshot() \
+        -> Tuple[int, dt.datetime | None, List[Tuple[str, bool, dt.datetime, bool, dt.datetime]]]:
+    """
+    Get the shared status of the services.
+
+    :returns: the refresh generation, the date and time (UTC) it started (`None` if unknown) and (service name, is_up,
+      last_checked, is_up_user, last_user_report) tuples. The rows may be more recent than the generation, never older.
+    """
+    with pool.reader() as conn:
+        generation, modified = _read_version(conn, VERSION_STATUS)
+        return generation, modified, _read_status_snapshot(conn)
+
+
+def _read_status_snapshot(cursor) -> List[Tuple[str, bool, dt.datetime, bool, dt.datetime]]:
+    rows = cursor.execute('''
+        SELECT services.name, is_up, last_checked, is_up_user, last_user_report FROM service_status
+        JOIN services ON services.service_id = service_status.service_id
+    ''').fetchall()
+    return [(name, bool(is_up), dt.datetime.fromisoformat(last_checked), bool(is_up_user),
+             dt.datetime.fromisoformat(last_user_report))
+            for name, is_up, last_checked, is_up_user, last_user_report in rows]
+
+
+def _latest_rows(cursor, service_id: int, source: int, amount: int, after: int = None) -> List[Tuple[int, int]]:
+    """The `amount` latest (timestamp, status) rows of a service (with a timestamp after `after`), newest first."""
+    rows = _history_rows(cursor, service_id, source, after + 1 if after is not None else None, newest_first=True)
+    return [(ts, status) for ts, status, _ in islice(rows, amount)]
+
+
+def get_latest_status(service_name, amount=12*12):
+    with pool.reader() as conn:
+        cursor = conn.cursor()
+        service_id = get_service_id(cursor, service_name)
+        rows = _latest_rows(cursor, service_id, SOURCE_PROBE, amount)
+
     # convert the unix timestamp to human-readable time
     time = [dt.datetime.fromtimestamp(row[0]).strftime('%H:%M:%S') for row in rows]
     status = [row[1] for row in rows]
-    
+
     return time[::-1],status[::-1]
 
 def get_latest_user_report(service_name, amount=100):
     # will only take the latest 100 reports that happened in less than 24 hours
-    conn = sqlite3.connect('data/outage.sqlite3')
-    cursor = conn.cursor()
-    table_name = convert_to_table_name(service_name)
-    
     limit_unix = int((dt.datetime.now() - dt.timedelta(days=1)).timestamp())
-    
-    cursor.execute(f'''
-        SELECT * FROM {table_name} WHERE user = 1 AND timestamp > {limit_unix} ORDER BY timestamp DESC LIMIT {amount}
-    ''')
-    rows = cursor.fetchall()
-    conn.close()
-    
+
+    with pool.reader() as conn:
+        cursor = conn.cursor()
+        service_id = get_service_id(cursor, service_name)
+        rows = _latest_rows(cursor, service_id, SOURCE_USER, amount, after=limit_unix)
+
     time = [dt.datetime.fromtimestamp(row[0]).strftime('%H:%M:%S') for row in rows]
     status = [row[1] for row in rows]
-    
+
     return time[::-1],status[::-1]
 
+def _percentile(ordered: List[float], fraction: float) -> float:
+    """The nearest-rank percentile of a sorted, non-empty, list."""
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+def get_latency_stats(service_name: str, now: int | None = None) \
+        -> Tuple[Dict[str, int | float | None] | None, Dict[str, Dict[str, int | float | None]]]:
+    """
+    Get the timings of the latest probe of a service, and the percentiles of the latency of its probes over the
+    `LATENCY_WINDOWS` ending now. Only the probes that got an answer count: a timeout isn't a latency.
+
+    :returns: the timings of the latest probe (a dict with the columns of `probe_timings`, `None` if there is none) and,
+      per window, the number of samples and the `LATENCY_PERCENTILES` (`None` without samples) [s]
+    """
+    if now is None:
+        now = int(_time.time())
+
+    with pool.reader() as conn:
+        cursor = conn.cursor()
+        service_id = get_service_id(cursor, service_name)
+        latest = None
+        for partition, _, _ in _overlapping_partitions(cursor, "probe_timings", newest_first=True):
+            latest = cursor.execute(f'''
+                SELECT ts, status_code, latency, dns, connect, tls, ttfb FROM {partition} WHERE service_id = ?
+                ORDER BY ts DESC LIMIT 1
+            ''', (service_id,)).fetchone()
+            if latest is not None:
+                break
+        # One query for the largest window, the others are suffixes of it
+        since = now - max(LATENCY_WINDOWS.values())
+        rows = []
+        for partition, _, _ in _overlapping_partitions(cursor, "probe_timings", since + 1):
+            rows += cursor.execute(f'''
+                SELECT ts, latency FROM {partition} WHERE service_id = ? AND ts > ? AND status_code IS NOT NULL
+            ''', (service_id, since)).fetchall()
+
+    # Sorted once: the latencies of each window, filtered from them, are sorted too
+    ordered = sorted(rows, key=itemgetter(1))
+    windows = {}
+    for window, span in LATENCY_WINDOWS.items():
+        latencies = [latency for ts, latency in ordered if ts > now - span]
+        windows[window] = {"samples": len(latencies)} | {
+            name: _percentile(latencies, fraction) if latencies else None
+            for name, fraction in LATENCY_PERCENTILES.items()}
+
+    if latest is not None:
+        latest = dict(zip(("ts", "status_code", "latency", "dns", "connect", "tls", "ttfb"), latest))
+    return latest, windows
+
+
 def get_percentage_uptime(service_name):
-    conn = sqlite3.connect('data/outage.sqlite3')
-    cursor = conn.cursor()
-    table_name = convert_to_table_name(service_name)
-    
-    cursor.execute(f'''
-        SELECT COUNT(*) FROM {table_name} WHERE status = 1 AND user = 0
-    ''')
-    up = cursor.fetchone()[0]
-    
-    cursor.execute(f'''
-        SELECT COUNT(*) FROM {table_name} WHERE user = 0
-    ''')
-    total = cursor.fetchone()[0]
-    
-    conn.close()
-    
-    return up/total
+    with pool.reader() as conn:
+        cursor = conn.cursor()
+        service_id = get_service_id(cursor, service_name)
+
+        row = cursor.execute('''
+            SELECT up, total FROM uptime_counters WHERE service_id = ? AND span = ?
+        ''', (service_id, UPTIME_WINDOWS["all"])).fetchone()
+
+    up, total = row or (0, 0)
+    return up/total if total else 1
+
+
+def migrate_legacy_tables(service_names: Iterable[str]) -> Dict[str, int]:
+    """
+    Move the history from the legacy per-service tables (`ADE`, `ADE_Scheduler`, ... with columns `timestamp`,
+    `status` and `user`) to the `probe_results` partitions, then drop the legacy tables. Everything happens in one
+    transaction, so running it again after a failure is safe.
+
+    :param service_names: the names of the tracked services, to map the legacy table names back to service names
+      (tables that don't match any service keep their table name as service name)
+    :returns: a dict with the number of rows moved for each service
+    """
+    init_db()
+
+    names = {convert_to_table_name(name): name for name in service_names}
+    moved = {}
+    with _writer() as conn:
+        cursor = conn.cursor()
+        tables = [row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        for table in tables:
+            columns = {row[1] for row in cursor.execute(f'PRAGMA table_info("{table}")')}
+            if columns != {"timestamp", "status", "user"}:
+                continue  # Not a legacy table
+
+            service_name = names.get(table, table)
+            service_id = get_service_id(cursor, service_name, create=True)
+            rows = cursor.execute(f'''
+                SELECT ?, timestamp, status, CASE WHEN user THEN ? ELSE ? END FROM "{table}"
+            ''', (service_id, SOURCE_USER, SOURCE_PROBE)).fetchall()
+            _insert_partitioned(cursor, "probe_results", ("service_id", "ts", "status", "source"), rows)
+            moved[service_name] = len(rows)
+            cursor.execute(f'DROP TABLE "{table}"')
+
+    return moved
+
 
 if __name__ == "__main__":
     print(get_latest_status("ADE"))
     print(get_latest_user_report("ADE"))
-    print(get_percentage_uptime("ADE"))
\ No newline at end of file
+    print(get_percentage_uptime("ADE"))
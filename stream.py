@@ -0,0 +1,135 @@
+"""
+Live stream of the status changes, as Server-Sent Events (`/api/services/stream`).
+
+Every change is encoded once and fanned out to all clients by a single `StatusBroadcaster`. Each client has a small
+bounded buffer: a client that doesn't read its events fast enough fills it and is dropped (it can reconnect), so a slow
+client never holds memory or delays the others. An idle client costs one suspended task, the keep-alive comments are
+fanned out like the events.
+"""
+import asyncio
+import json
+from typing import Any, AsyncIterator, Callable, Set
+
+from logger_config import *
+
+STREAM_BUFFER = 16  # Events buffered per client before it is dropped
+STREAM_HEARTBEAT = 15  # [s] Time between two keep-alive comments, so that proxies don't close idle connections
+STREAM_RETRY = 5_000  # [ms] Delay after which the clients reconnect if the connection is lost
+
+
+def encode_event(event: str, data: Any) -> bytes:
+    """Encode an event in the Server-Sent Events format, `data` is serialized to json."""
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+
+class Subscription:
+    """The buffer of events of a client of the stream. `None` marks the end of the stream."""
+
+    def __init__(self, buffer: int):
+        self.queue: asyncio.Queue[bytes | None] = asyncio.Queue(maxsize=buffer)
+
+    def close(self):
+        """End the stream of the client: its pending events are discarded."""
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class StatusBroadcaster:
+    """Fans out the status changes to the clients of the stream, see the module documentation."""
+
+    def __init__(self, buffer: int = STREAM_BUFFER, heartbeat: float = STREAM_HEARTBEAT):
+        self.buffer = buffer
+        self.heartbeat = heartbeat
+
+        self.dropped = 0  # Clients dropped because they were too slow
+
+        self.__loop: asyncio.AbstractEventLoop | None = None
+        self.__subscriptions: Set[Subscription] = set()
+        self.__heartbeat_task: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self.__loop is not None
+
+    def __len__(self) -> int:
+        return len(self.__subscriptions)
+
+    async def start(self):
+        """Start the keep-alive comments on the running event loop."""
+        self.__loop = asyncio.get_running_loop()
+        self.__heartbeat_task = asyncio.create_task(self.__send_heartbeats())
+
+    async def stop(self):
+        """End the streams of all clients."""
+        if not self.running:
+            return
+
+        self.__heartbeat_task.cancel()
+        await asyncio.gather(self.__heartbeat_task, return_exceptions=True)
+        for subscription in self.__subscriptions:
+            subscription.close()
+        self.__subscriptions.clear()
+        self.__loop = None
+
+    def publish(self, event: str, data: Any):
+        """
+        Send an event to all clients, without waiting on them. Can be called from any thread.
+
+        :param event: the type of the event
+        :param data: the content of the event, serialized to json right away
+        """
+        if not self.running:
+            return
+
+        message = encode_event(event, data)
+        try:
+            in_loop = asyncio.get_running_loop() is self.__loop
+        except RuntimeError:
+            in_loop = False
+        if in_loop:
+            self.__fan_out(message)
+        else:
+            self.__loop.call_soon_threadsafe(self.__fan_out, message)
+
+    async def subscribe(self, snapshot: Callable[[], bytes] = None) -> AsyncIterator[bytes]:
+        """
+        Stream the events to a new client, until it disconnects or is dropped.
+
+        :param snapshot: encodes the first event sent to the client, before the changes (e.g. the current state). It is
+          called once the client is subscribed, so no change is missed in between.
+        """
+        subscription = Subscription(self.buffer)
+        if self.running:
+            self.__subscriptions.add(subscription)
+        else:  # No event will ever be sent
+            subscription.close()
+        try:
+            yield f"retry: {STREAM_RETRY}\n\n".encode() + (snapshot() if snapshot is not None else b"")
+            while (message := await subscription.queue.get()) is not None:
+                yield message
+        finally:
+            self.__subscriptions.discard(subscription)
+
+    def __fan_out(self, message: bytes):
+        slow = []
+        for subscription in self.__subscriptions:
+            try:
+                subscription.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                slow.append(subscription)
+
+        for subscription in slow:
+            self.__subscriptions.discard(subscription)
+            subscription.close()
+        if slow:
+            self.dropped += len(slow)
+            logger.info(f"[LOG]: Dropped {len(slow)} slow clients of the status stream")
+
+    async def __send_heartbeats(self):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            self.__fan_out(b": keep-alive\n\n")
+
+
+status_stream = StatusBroadcaster()
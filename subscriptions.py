@@ -0,0 +1,48 @@
+from collections import defaultdict
+from typing import Dict, Iterable, Set
+
+
+class SubscriptionIndex:
+    """
+    Which webhooks track which services, indexed both ways: service -> hook ids (to find the webhooks to call back
+    when a service changes status) and hook id -> services (to update or remove a webhook). Every operation only
+    touches the services tracked by the webhooks concerned, whatever the number of registered webhooks.
+    """
+
+    def __init__(self):
+        self.__hooks_by_service: Dict[str, Set[int]] = defaultdict(set)
+        self.__services_by_hook: Dict[int, Set[str]] = {}
+
+    def subscribe(self, hook_id: int, services: Iterable[str]):
+        """Make the webhook `hook_id` track exactly `services` (replaces the services it tracked before, if any)."""
+        services = set(services)
+        old_services = self.__services_by_hook.get(hook_id, set())
+
+        for service in old_services - services:
+            self.__discard(service, hook_id)
+        for service in services - old_services:
+            self.__hooks_by_service[service].add(hook_id)
+
+        self.__services_by_hook[hook_id] = services
+
+    def unsubscribe(self, hook_id: int):
+        """Stop tracking any service with the webhook `hook_id`."""
+        for service in self.__services_by_hook.pop(hook_id, set()):
+            self.__discard(service, hook_id)
+
+    def subscribers(self, service: str) -> Set[int]:
+        """The ids of the webhooks tracking `service` (do not modify the returned set)."""
+        return self.__hooks_by_service.get(service, set())
+
+    def tracked_services(self, hook_id: int) -> Set[str]:
+        """The services tracked by the webhook `hook_id` (do not modify the returned set)."""
+        return self.__services_by_hook.get(hook_id, set())
+
+    def __discard(self, service: str, hook_id: int):
+        hooks = self.__hooks_by_service[service]
+        hooks.discard(hook_id)
+        if not hooks:
+            del self.__hooks_by_service[service]
+
+    def __len__(self) -> int:
+        return len(self.__services_by_hook)
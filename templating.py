@@ -0,0 +1,92 @@
+"""
+Jinja2 templates and Babel translations for the website, served natively by Starlette/FastAPI.
+
+The templates were written for Flask and flask-babel: they call `_("...", name=value)` to translate text and
+`url_for('static', filename=...)` to link static files. Both are provided here with the same behaviour, so the
+templates didn't need any change.
+"""
+from typing import Callable, Dict
+
+from babel.support import NullTranslations, Translations
+from fastapi.templating import Jinja2Templates
+from markupsafe import Markup
+from starlette.requests import Request
+
+LANGUAGES = ["en", "fr"]
+TRANSLATIONS_DIRECTORY = "translations"
+STATIC_URL = "/static"
+
+templates = Jinja2Templates(directory="templates")
+
+_translations: Dict[str, NullTranslations] = {}  # Cache of the loaded translations, per locale
+
+
+def best_match(accept_language: str, languages=LANGUAGES) -> str | None:
+    """
+    Choose the language of `languages` preferred by a client, from its `Accept-Language` header (as Flask's
+    `request.accept_languages.best_match` did).
+
+    :returns: the preferred language, or `None` if none of `languages` is accepted
+    """
+    preferences = []
+    for position, item in enumerate(accept_language.split(",")):
+        language, _, parameters = item.strip().partition(";")
+        quality = 1.0
+        if parameters.strip().startswith("q="):
+            try:
+                quality = float(parameters.strip()[2:])
+            except ValueError:
+                continue
+        if language and quality > 0:
+            preferences.append((-quality, position, language.lower()))
+
+    for _, _, language in sorted(preferences):
+        for supported in languages:
+            if language == "*" or language == supported or language.split("-")[0] == supported:
+                return supported
+    return None
+
+
+def get_translations(locale: str | None) -> NullTranslations:
+    """The (cached) translations of the website in `locale`."""
+    if locale not in _translations:
+        if locale:
+            _translations[locale] = Translations.load(TRANSLATIONS_DIRECTORY, [locale])
+        else:
+            _translations[locale] = NullTranslations()
+    return _translations[locale]
+
+
+def gettext_function(locale: str | None) -> Callable[..., str]:
+    """
+    A `_` function translating to `locale`, like the one of flask-babel: `_("Hello %(name)s", name=name)`. In the
+    templates, the variables are escaped but the translated text is not.
+    """
+    translations = get_translations(locale)
+
+    def gettext(string: str, **variables) -> str:
+        translated = Markup(translations.gettext(string))
+        return translated % variables if variables else translated
+
+    return gettext
+
+
+def url_for(endpoint: str, filename: str = "", **_) -> str:
+    """The Flask `url_for`, as used by the templates: only the static files are linked with it."""
+    if endpoint == "static":
+        return f"{STATIC_URL}/{filename}"
+    raise ValueError(f"Unknown endpoint '{endpoint}'")
+
+
+def render_template(request: Request, name: str, locale: str | None, **context) -> str:
+    """
+    Render the template `name` in `locale`.
+
+    :param request: the request for which the template is rendered
+    :param name: the name of the template, in the `templates/` directory
+    :param locale: the language in which to render the template
+    :param context: the variables to pass to the template
+    :returns: the rendered page
+    """
+    return templates.get_template(name).render(request=request, url_for=url_for, _=gettext_function(locale),
+                                               **context)
@@ -0,0 +1,46 @@
+"""
+Shared fixtures of the tests. The modules of the application are at the root of the repository.
+
+Usage (from the root of the repository): `python -m pytest`
+"""
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import sql
+from models import Services
+
+
+def clear_sql_caches():
+    for cache in (sql._service_ids, sql._counted_services, sql._partitions, sql._open_runs):
+        cache.clear()
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """`sql` working on a new, empty database instead of `data/outage.sqlite3`."""
+    pool = db.ConnectionPool(str(tmp_path / "outage.sqlite3"))
+    monkeypatch.setattr(sql, "pool", pool)
+    clear_sql_caches()
+    sql.init_db()
+    yield pool
+    pool.close()
+    clear_sql_caches()
+
+
+@pytest.fixture
+def services(database, tmp_path):
+    """Two services, A (up) and B (down), stored in a temporary json file."""
+    checked, reported = "2026-03-01T12:00:00", "2026-02-01T08:00:00"
+    path = tmp_path / "services.json"
+    path.write_text(json.dumps({
+        name: {"name": name, "url": f"https://{name.lower()}.example", "is_up": is_up, "last_checked": checked,
+               "is_up_user": True, "last_user_report": reported}
+        for name, is_up in (("A", True), ("B", False))
+    }))
+    return Services.load_from_json_file(str(path))
@@ -0,0 +1,65 @@
+import gzip
+import os
+import sqlite3
+import threading
+import time
+
+import backup
+import db
+import sql
+
+
+def test_backups_rotate(database, tmp_path, monkeypatch):
+    monkeypatch.setattr(backup, "pool", database)
+    directory = str(tmp_path / "backups")
+    assert backup.latest_backup(directory) is None
+
+    paths = []
+    for i in range(4):
+        sql.insert_probe_results([("A", 1_700_000_000 + 60 * i, True)])
+        monkeypatch.setattr(backup.time, "time", lambda: 1_800_000_000 + i)
+        paths.append(backup.make_backup(directory, kept=2))
+
+    # Only the last 2 snapshots are kept, without any temporary file
+    assert sorted(os.listdir(directory)) == [os.path.basename(path) for path in paths[2:]]
+    assert backup.list_backups(directory) == paths[2:]
+    assert backup.latest_backup(directory) == paths[-1]
+
+    # The newest one is a compressed copy of the database, with everything written before it
+    copy = tmp_path / "copy.sqlite3"
+    copy.write_bytes(gzip.decompress(open(paths[-1], "rb").read()))
+    conn = sqlite3.connect(copy)
+    assert conn.execute("PRAGMA integrity_check").fetchone() == ("ok",)
+    conn.close()
+    monkeypatch.setattr(sql, "pool", db.ConnectionPool(str(copy)))
+    assert [ts for ts, _, _ in sql.get_history_page("A", sql.SOURCE_PROBE, 0, 2 ** 40, limit=10)] == \
+           [1_700_000_000 + 60 * i for i in range(4)]
+    sql.pool.close()
+
+
+def test_backup_during_writes(database, tmp_path, monkeypatch):
+    monkeypatch.setattr(backup, "pool", database)
+    stop = threading.Event()
+
+    def write():
+        ts = 1_700_000_000
+        while not stop.is_set():
+            sql.insert_probe_results([(name, ts, ts % 7 != 0) for name in "ABC"])
+            ts += 60
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    time.sleep(0.05)
+    try:
+        path = backup.make_backup(str(tmp_path / "backups"))
+    finally:
+        stop.set()
+        writer.join()
+
+    # A consistent copy: the 3 services were always written together
+    copy = tmp_path / "copy.sqlite3"
+    copy.write_bytes(gzip.decompress(open(path, "rb").read()))
+    monkeypatch.setattr(sql, "pool", db.ConnectionPool(str(copy)))
+    counts = {len(sql.get_history_page(name, sql.SOURCE_PROBE, 0, 2 ** 40, limit=10 ** 6)) for name in "ABC"}
+    sql.pool.close()
+    assert len(counts) == 1 and counts.pop() > 0
@@ -0,0 +1,87 @@
+import asyncio
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import delivery
+import sql
+from delivery import DeliveryQueue
+
+lock = threading.Lock()
+
+
+class FakeResponse:
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+
+
+class FakeSession:
+    """Answers the callbacks of each host with its status code, after its delay [s]."""
+    hosts = {}  # host: (delay, status code)
+    posted = defaultdict(list)  # host: time.monotonic() of the end of each callback
+
+    def post(self, url, data=None, timeout=None, headers=None):
+        host = urlsplit(url).netloc
+        delay, status_code = self.hosts[host]
+        time.sleep(delay)
+        with lock:
+            self.posted[host].append(time.monotonic())
+        return FakeResponse(status_code)
+
+    def close(self):
+        pass
+
+
+def run_queue(monkeypatch, hosts, callbacks, duration: float, **parameters) -> DeliveryQueue:
+    """Enqueue the (hook id, url) `callbacks` at once, then stop the queue after `duration` seconds."""
+    monkeypatch.setattr(FakeSession, "hosts", hosts)
+    monkeypatch.setattr(FakeSession, "posted", defaultdict(list))
+    monkeypatch.setattr(delivery.requests, "Session", FakeSession)
+
+    async def main():
+        queue = DeliveryQueue(**parameters)
+        await queue.start()
+        for hook_id, url in callbacks:
+            queue.enqueue(hook_id, url, {"name": "A", "is_up": False})
+        await asyncio.sleep(duration)
+        await queue.stop()
+        return queue
+
+    return asyncio.run(main())
+
+
+def test_slow_host_does_not_block_the_others(database, monkeypatch):
+    started = time.monotonic()
+    callbacks = [(1, "http://slow/hook")] * 20 + [(2, "http://fast/hook")] * 10
+    queue = run_queue(monkeypatch, {"slow": (0.2, 200), "fast": (0, 200)}, callbacks, 0.5, workers=4, per_host=2)
+
+    # The callbacks to the fast host were all delivered while the slow one held its 2 workers
+    assert len(FakeSession.posted["fast"]) == 10
+    assert max(FakeSession.posted["fast"]) - started < 0.15
+    assert len(FakeSession.posted["slow"]) >= 4
+    assert queue.delivered >= 10 + 4
+
+
+def test_failed_callbacks_become_dead_letters(database, monkeypatch):
+    callbacks = [(1, "http://gone/hook"), (2, "http://broken/hook")]
+    queue = run_queue(monkeypatch, {"gone": (0, 404), "broken": (0, 503)}, callbacks, 0.3, max_attempts=3,
+                      backoff=0.01)
+
+    # A client error is not retried, a server error is, up to `max_attempts`
+    assert len(FakeSession.posted["gone"]) == 1
+    assert len(FakeSession.posted["broken"]) == 3
+    assert sorted((d.hook_id, d.attempts, d.error) for d in queue.dead_letters) == [(1, 1, "HTTP 404"),
+                                                                                    (2, 3, "HTTP 503")]
+    with sql.pool.reader() as conn:
+        assert sorted(conn.execute("SELECT hook_id, attempts, error FROM webhook_dead_letters")) == \
+               [(1, 1, "HTTP 404"), (2, 3, "HTTP 503")]
+
+
+def test_pending_callbacks_are_dead_letters_after_stop(database, monkeypatch):
+    queue = run_queue(monkeypatch, {"slow": (0.2, 200)}, [(1, "http://slow/hook")] * 5, 0.05, per_host=1)
+
+    assert queue.delivered == 0
+    assert [d.error for d in queue.dead_letters] == ["Not delivered before shutdown"] * 4
+    with sql.pool.reader() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM webhook_dead_letters").fetchone()[0] == 4
@@ -0,0 +1,73 @@
+import asyncio
+import gzip
+import inspect
+import json
+
+import pytest
+from starlette.requests import ClientDisconnect
+
+import export
+import sql
+
+ROWS = [(1_700_000_000 + 60 * i, i % 4 != 0) for i in range(10)]
+
+
+@pytest.fixture
+def history(database):
+    for name in ("A", "B"):
+        sql.insert_probe_results([(name, ts, status) for ts, status in ROWS])
+    sql.insert_probe_results([("A", ROWS[0][0] + 1, False)], source=sql.SOURCE_USER)
+
+
+def test_export_is_read_batch_by_batch(history):
+    batches = list(sql.export_probe_results(["B", "A"], start=ROWS[1][0], batch_size=4))
+
+    assert [len(batch) for batch in batches] == [4, 4, 1, 4, 4, 1]
+    assert [row for batch in batches for row in batch] == \
+           [("B", ts, int(status), sql.SOURCE_PROBE) for ts, status in ROWS[1:]] + \
+           [("A", ts, int(status), sql.SOURCE_PROBE) for ts, status in ROWS[1:]]
+
+
+def test_export_encodings(history):
+    batches = list(sql.export_probe_results(["A"], sources=[sql.SOURCE_USER]))
+    assert b"".join(export.csv_chunks(batches)).decode() == \
+           f"service,timestamp,status,source\nA,{ROWS[0][0] + 1},0,user\n"
+    assert [json.loads(line) for line in b"".join(export.ndjson_chunks(batches)).splitlines()] == \
+           [{"service": "A", "ts": ROWS[0][0] + 1, "status": 0, "source": "user"}]
+    assert b"".join(export.csv_chunks([])) == b"service,timestamp,status,source\n"
+
+    chunks = export.csv_chunks(sql.export_probe_results(["A", "B"], batch_size=3))
+    assert gzip.decompress(b"".join(export.gzip_chunks(chunks))).decode().count("\n") == 1 + 2 * len(ROWS) + 1
+
+
+def send_response(response: export.ExportResponse, disconnect_after: int | None = None) -> list:
+    """Send `response` to a client that disconnects after `disconnect_after` chunks, the chunks it received."""
+    received = []
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            if len(received) == disconnect_after:
+                raise OSError("Connection reset by peer")
+            received.append(message["body"])
+
+    async def receive():
+        await asyncio.sleep(3600)
+
+    scope = {"type": "http", "asgi": {"spec_version": "2.4"}}
+    asyncio.run(response(scope, receive, send))
+    return received
+
+
+def test_export_releases_its_snapshot(history):
+    batches = sql.export_probe_results(["A", "B"], batch_size=2)
+    response = export.ExportResponse(batches, export.csv_chunks(batches), media_type="text/csv")
+    with pytest.raises(ClientDisconnect):
+        send_response(response, disconnect_after=2)
+
+    # The client left in the middle of the download: the reading connection is closed all the same
+    assert inspect.getgeneratorstate(batches) == inspect.GEN_CLOSED
+
+    batches = sql.export_probe_results(["A", "B"], batch_size=2)
+    received = send_response(export.ExportResponse(batches, export.csv_chunks(batches), media_type="text/csv"))
+    assert b"".join(received).count(b"\n") == 1 + 2 * len(ROWS) + 1
+    assert inspect.getgeneratorstate(batches) == inspect.GEN_CLOSED
@@ -0,0 +1,163 @@
+import datetime as dt
+import os
+import random
+import sqlite3
+
+import retention
+import sql
+
+JANUARY, FEBRUARY, MARCH = (int(dt.datetime(2026, month, 1, tzinfo=dt.timezone.utc).timestamp()) for month in (1, 2, 3))
+
+
+def probes(start: int, end: int, spacing: int = 300, flip_every: int = 50):
+    """(timestamp, status) probes every `spacing` seconds, whose status flips every `flip_every` probes."""
+    return [(ts, (ts - start) // spacing // flip_every % 2 == 0) for ts in range(start, end, spacing)]
+
+
+def record(service: str, rows, source: int = sql.SOURCE_PROBE, batch: int = 1_000):
+    for i in range(0, len(rows), batch):
+        sql.insert_probe_results([(service, ts, status) for ts, status in rows[i:i + batch]], source=source)
+
+
+def test_retention_keeps_the_rollups_of_the_dropped_months(database, tmp_path, monkeypatch):
+    monkeypatch.setattr(sql, "PROBE_STORAGE", "runs")
+    history = probes(JANUARY, MARCH + 14 * 24 * 3600)
+    record("A", history)
+    record("A", [(ts + 7, status) for ts, status in history[::10]], source=sql.SOURCE_USER)
+    january = [(ts, status) for ts, status in history if ts < FEBRUARY]
+    archive = tmp_path / "archive"
+
+    dropped = retention.apply_retention(now=MARCH + 14 * 24 * 3600, months=1, archive=True, directory=str(archive))
+
+    assert sorted(dropped) == ["probe_results_202601", "probe_runs_202601"]
+    assert all(start >= FEBRUARY for _, _, start, _ in sql.list_partitions())
+    with sqlite3.connect(archive / "probe_runs_202601.sqlite3") as conn:
+        assert conn.execute("SELECT SUM(samples) FROM probe_runs_202601").fetchone()[0] == len(january)
+    assert os.path.exists(archive / "probe_results_202601.sqlite3")
+
+    # January is still summarized by the rollups...
+    resolution, rows = sql.get_history("A", JANUARY, FEBRUARY)
+    assert resolution > 0
+    assert sum(samples for _, samples, _, _, _ in rows) == len(january)
+    assert sum(up for _, _, up, _, _ in rows) == sum(status for _, status in january)
+    # ... and February is intact
+    page = sql.get_history_page("A", sql.SOURCE_PROBE, FEBRUARY, FEBRUARY + 24 * 3600, limit=1_000)
+    assert [(ts, bool(status)) for ts, status, _ in page] == \
+           [(ts, status) for ts, status in history if FEBRUARY <= ts < FEBRUARY + 24 * 3600]
+
+
+def test_retention_without_expired_partitions(database, tmp_path, monkeypatch):
+    monkeypatch.setattr(sql, "PROBE_STORAGE", "runs")
+    record("A", probes(FEBRUARY, MARCH))
+    assert retention.apply_retention(now=MARCH + 3600, months=1, archive=False) == []
+    assert len(sql.list_partitions("probe_runs")) == 1
+
+
+def pages(service: str, source: int, start: int, end: int, limit: int):
+    """All the pages of a range, each one after the last row of the previous one."""
+    after, result = None, []
+    while page := sql.get_history_page(service, source, start, end, after, limit):
+        result.append(page)
+        after = page[-1]
+    return result
+
+
+def test_keyset_pages_cover_the_range_once(database, monkeypatch):
+    # Probes stored as samples, then as runs, and user reports sharing their timestamps
+    monkeypatch.setattr(sql, "PROBE_STORAGE", "samples")
+    record("A", probes(FEBRUARY, FEBRUARY + 6 * 3600, spacing=60, flip_every=7))
+    monkeypatch.setattr(sql, "PROBE_STORAGE", "runs")
+    record("A", probes(FEBRUARY + 6 * 3600, FEBRUARY + 12 * 3600, spacing=60, flip_every=7))
+    record("A", [(FEBRUARY + 60 * i, i % 3 == 0) for i in range(200) for _ in range(2)], source=sql.SOURCE_USER)
+    end = FEBRUARY + 12 * 3600
+
+    for source in (sql.SOURCE_PROBE, sql.SOURCE_USER):
+        everything = sql.get_history_page("A", source, FEBRUARY, end, limit=10_000)
+        for limit in (1, 7, 100):
+            result = pages("A", source, FEBRUARY, end, limit)
+            assert all(len(page) == limit for page in result[:-1])
+            assert [row for page in result for row in page] == everything
+        assert len(set(everything)) == len(everything)
+
+    assert len(sql.get_history_page("A", sql.SOURCE_PROBE, FEBRUARY, end, limit=10_000)) == 12 * 60
+    assert len(sql.get_history_page("A", sql.SOURCE_USER, FEBRUARY, end, limit=10_000)) == 400
+
+
+def jittered(rows, jitter: int = 2, seed: int = 0):
+    """The (timestamp, status) rows, each moved by up to `jitter` seconds."""
+    rng = random.Random(seed)
+    return [(ts + rng.randint(-jitter, jitter), status) for ts, status in rows]
+
+
+def stored(service: str):
+    """The numbers of probes of a service stored as samples and as runs."""
+    with sql.pool.reader() as conn:
+        cursor = conn.cursor()
+        service_id = sql.get_service_id(cursor, service)
+        partitions = sql._probe_months(cursor)
+        samples = sum(conn.execute(f'SELECT COUNT(*) FROM {months["probe_results"]} WHERE service_id = ?',
+                                   (service_id,)).fetchone()[0] for _, _, months in partitions)
+        in_runs = sum(conn.execute(f'SELECT TOTAL(samples) FROM {months["probe_runs"]} WHERE service_id = ?',
+                                   (service_id,)).fetchone()[0]
+                      for _, _, months in partitions if "probe_runs" in months)
+    return samples, int(in_runs)
+
+
+def test_open_run_stays_samples(database, monkeypatch):
+    monkeypatch.setattr(sql, "PROBE_STORAGE", "runs")
+    record("A", probes(FEBRUARY, FEBRUARY + 60 * 300, flip_every=40), batch=1)
+    assert stored("A") == (20, 40)
+
+    # The first probe of the next run closes the open one
+    record("A", probes(FEBRUARY + 60 * 300, FEBRUARY + 61 * 300), batch=1)
+    assert stored("A") == (1, 60)
+
+
+def test_keyset_pages_over_an_open_run(database, monkeypatch):
+    monkeypatch.setattr(sql, "PROBE_STORAGE", "runs")
+    history = jittered(probes(FEBRUARY, FEBRUARY + 600 * 300, flip_every=1_000))
+    record("A", history[:300], batch=1)
+
+    # The open run grows between the pages: the rows already read keep their timestamps and positions
+    after, read = None, []
+    for i in range(300, 600, 50):
+        page = sql.get_history_page("A", sql.SOURCE_PROBE, FEBRUARY, FEBRUARY + 10 ** 6, after, limit=70)
+        read += page
+        after = page[-1]
+        record("A", history[i:i + 50], batch=1)
+    while page := sql.get_history_page("A", sql.SOURCE_PROBE, FEBRUARY, FEBRUARY + 10 ** 6, after, limit=70):
+        read += page
+        after = page[-1]
+
+    assert [(ts, bool(status)) for ts, status, _ in read] == history
+
+
+def test_uptime_counters_count_the_stored_probes(database, monkeypatch):
+    monkeypatch.setattr(sql, "PROBE_STORAGE", "runs")
+    # Runs longer than a day, whose jittered probes move when they are closed, across the start of the windows
+    history = jittered(probes(FEBRUARY, FEBRUARY + 20 * 24 * 3600, flip_every=300))
+    for i in range(0, len(history), 20):
+        record("A", history[i:i + 20], batch=1)
+        now = history[min(i + 20, len(history)) - 1][0]
+        with sql.pool.reader() as conn:
+            cursor = conn.cursor()
+            service_id = sql.get_service_id(cursor, "A")
+            for span, up, total in conn.execute('SELECT span, up, total FROM uptime_counters WHERE service_id = ?',
+                                                (service_id,)).fetchall():
+                since = now - span if span else -1
+                assert (up, total) == sql._count_probes(cursor, service_id, since, now), (now, span)
+
+
+def test_conversion_to_runs_keeps_a_copy_of_the_samples(database, tmp_path):
+    history = jittered(probes(FEBRUARY, MARCH + 24 * 3600))
+    record("A", history)
+    record("A", [(ts + 7, status) for ts, status in history[::10]], source=sql.SOURCE_USER)
+
+    converted, written = sql.convert_to_runs(str(tmp_path))
+
+    assert converted == len(history) and written < len(history) / 10
+    assert stored("A") == (len(history[::10]), len(history))  # The user reports stay samples
+    assert sql.get_uptime("A")["all"] == sum(status for _, status in history) / len(history)
+    with sqlite3.connect(tmp_path / "probe_results_202602.sqlite3") as conn:
+        assert conn.execute("SELECT COUNT(*) FROM probe_results_202602 WHERE source = ?",
+                            (sql.SOURCE_PROBE,)).fetchone()[0] == sum(ts < MARCH for ts, _ in history)
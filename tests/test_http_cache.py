@@ -0,0 +1,50 @@
+import datetime as dt
+
+import http_cache
+
+MODIFIED = dt.datetime(2026, 3, 1, 12, 30, 15, 250_000)  # Naive UTC, like `Services.last_modified`
+
+
+def test_cache_headers():
+    headers = http_cache.cache_headers(42, MODIFIED, 17.8)
+    assert headers == {
+        "ETag": '"42"',
+        "Last-Modified": "Sun, 01 Mar 2026 12:30:15 GMT",
+        "Cache-Control": f"public, max-age=17, stale-while-revalidate={http_cache.CACHE_STALE_WHILE_REVALIDATE}",
+    }
+    # A refresh that is late is not cached
+    assert http_cache.cache_headers(42, MODIFIED, -3)["Cache-Control"].startswith("public, max-age=0,")
+
+
+def test_not_modified_by_etag():
+    assert http_cache.not_modified({"if-none-match": '"42"'}, 42, MODIFIED)
+    assert http_cache.not_modified({"if-none-match": '"41", W/"42"'}, 42, MODIFIED)
+    assert http_cache.not_modified({"if-none-match": "*"}, 42, MODIFIED)
+    assert not http_cache.not_modified({"if-none-match": '"41"'}, 42, MODIFIED)
+    # `If-Modified-Since` is ignored when `If-None-Match` is sent
+    assert not http_cache.not_modified({"if-none-match": '"41"', "if-modified-since": "Sun, 01 Mar 2026 13:00:00 GMT"},
+                                       42, MODIFIED)
+
+
+def test_not_modified_by_date():
+    # The HTTP dates have no fraction of a second
+    assert http_cache.not_modified({"if-modified-since": "Sun, 01 Mar 2026 12:30:15 GMT"}, 42, MODIFIED)
+    assert http_cache.not_modified({"if-modified-since": "Sun, 01 Mar 2026 13:00:00 GMT"}, 42, MODIFIED)
+    assert not http_cache.not_modified({"if-modified-since": "Sun, 01 Mar 2026 12:30:14 GMT"}, 42, MODIFIED)
+    assert not http_cache.not_modified({"if-modified-since": "yesterday"}, 42, MODIFIED)
+    assert not http_cache.not_modified({}, 42, MODIFIED)
+
+
+def test_live_validators_change_with_the_time_bucket():
+    now = MODIFIED.replace(tzinfo=dt.timezone.utc).timestamp() + 100  # 12:31:55.25
+    version, last_modified, max_age = http_cache.live_validators(42, MODIFIED, 3600, bucket=60, now=now)
+    assert last_modified == dt.datetime(2026, 3, 1, 12, 31)
+    assert round(max_age, 2) == 4.75
+    assert version.startswith("42.")
+
+    # Same bucket, same version. The next one starts a new version, the next refresh ends the freshness
+    assert http_cache.live_validators(42, MODIFIED, 3600, bucket=60, now=now + 4)[0] == version
+    assert http_cache.live_validators(42, MODIFIED, 3600, bucket=60, now=now + 5)[0] != version
+    assert http_cache.live_validators(42, MODIFIED, 2, bucket=60, now=now)[2] == 2
+    # A generation that started within the bucket is the last modification
+    assert http_cache.live_validators(43, MODIFIED, 3600, bucket=600, now=now)[1] == MODIFIED
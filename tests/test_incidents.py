@@ -0,0 +1,59 @@
+import datetime as dt
+import random
+
+import sql
+
+NOW = 1_800_000_000
+OUTAGES = [(NOW - 40 * 3600, NOW - 39 * 3600), (NOW - 20 * 3600, NOW - 19 * 3600 + 120), (NOW - 3600, None)]
+
+
+def simulate(seed: int = 0):
+    """
+    Probe "A" every minute over the last 2 days with the `OUTAGES` ((start, end) of each, `None` if ongoing), and add
+    user reports in between, in chronological order like the probe threads and the report writer.
+
+    :returns: the timestamps of the probes that found the service down, and of the user reports that it is down
+    """
+    generator = random.Random(seed)
+    down_probes, down_reports = [], []
+    for ts in range(NOW - 48 * 3600, NOW, 60):
+        is_up = not any(start <= ts and (end is None or ts < end) for start, end in OUTAGES)
+        sql.insert_probe_results([("A", ts, is_up)])
+        if not is_up:
+            down_probes.append(ts)
+        # A report between two probes, more often during an outage and just before it
+        if generator.random() < (0.5 if not is_up or any(0 < start - ts <= 1200 for start, _ in OUTAGES) else 0.05):
+            report_ts = ts + generator.randrange(1, 60)
+            reported_at = dt.datetime.fromtimestamp(report_ts, dt.timezone.utc).replace(tzinfo=None)
+            sql.insert_user_reports([("A", reported_at, False)])
+            down_reports.append(report_ts)
+    return down_probes, down_reports
+
+
+def test_live_incidents_match_the_history(database):
+    down_probes, down_reports = simulate()
+
+    def count(timestamps, start, end):
+        return sum(start <= ts and (end is None or ts < end) for ts in timestamps)
+
+    incidents, totals = sql.get_incidents("A")
+    assert incidents == [(start, end, count(down_probes, start, end),
+                          count(down_reports, start - sql.INCIDENT_REPORT_LEAD, end))
+                         for start, end in reversed(OUTAGES)]
+    assert all(reports for *_, reports in incidents)
+    assert totals == {"incidents": 3, "mttr": (3600 + 3720) / 2, "mtbf": (19 * 3600 + 18 * 3600 - 120) / 2}
+
+    # The incidents rebuilt from the history are those kept up to date by the probes and the reports
+    assert sql.rebuild_incidents() == 3
+    assert sql.get_incidents("A") == (incidents, totals)
+
+
+def test_incidents_in_a_range(database):
+    simulate()
+
+    # The incident ongoing at the start of the range is included, the ongoing one has no end
+    assert [start for start, *_ in sql.get_incidents("A", start=NOW - 39.5 * 3600, end=NOW - 2 * 3600)[0]] == \
+           [NOW - 20 * 3600, NOW - 40 * 3600]
+    assert [end for _, end, *_ in sql.get_incidents("A", start=NOW - 2 * 3600)[0]] == [None]
+    assert sql.get_incidents("A", limit=1)[0][0][0] == NOW - 3600
+    assert sql.get_incidents("B") == ([], {"incidents": 0, "mttr": None, "mtbf": None})
@@ -0,0 +1,37 @@
+import math
+import random
+
+import sql
+
+NOW = 1_800_000_000
+
+
+def percentile(latencies, fraction):
+    ordered = sorted(latencies)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+def test_latency_percentiles_per_window(database):
+    generator = random.Random(4)
+    timings = []
+    for ts in range(NOW - 8 * 24 * 3600, NOW, 300):
+        status_code = None if generator.random() < 0.05 else 200  # Timeouts don't count
+        timings.append(("A", ts, status_code, generator.lognormvariate(-2, 0.5), 0.01, 0.02, 0.03, 0.04))
+    sql.insert_probe_results([(name, ts, code is not None) for name, ts, code, *_ in timings], timings=timings)
+
+    latest, windows = sql.get_latency_stats("A", now=NOW)
+
+    assert latest == dict(zip(("ts", "status_code", "latency", "dns", "connect", "tls", "ttfb"), timings[-1][1:]))
+    for window, span in sql.LATENCY_WINDOWS.items():
+        latencies = [latency for _, ts, code, latency, *_ in timings if code is not None and ts > NOW - span]
+        assert windows[window] == {"samples": len(latencies)} | {
+            name: percentile(latencies, fraction) for name, fraction in sql.LATENCY_PERCENTILES.items()}
+
+
+def test_latency_without_samples(database):
+    sql.insert_probe_results([("A", NOW - 100, False)], timings=[("A", NOW - 100, None, 10.0, 0.01, None, None, None)])
+
+    latest, windows = sql.get_latency_stats("A", now=NOW)
+    assert latest["status_code"] is None
+    assert all(stats == {"samples": 0, "p50": None, "p95": None, "p99": None} for stats in windows.values())
+    assert sql.get_latency_stats("B", now=NOW) == (None, windows)
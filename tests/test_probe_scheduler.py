@@ -0,0 +1,136 @@
+import asyncio
+import datetime as dt
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from probe import ProbeResult
+from probe_scheduler import ProbeScheduler
+
+
+class FakeService:
+    """The part of `models.Service` used by the scheduler."""
+
+    def __init__(self, name: str, status: bool | None):
+        self.name = name
+        self.status = status
+        self.recorded: List[bool] = []
+
+    def record_probe(self, result: ProbeResult):
+        self.status = result.is_up
+        self.recorded.append(result.is_up)
+
+
+class FakeServices:
+    def __init__(self, *services: FakeService):
+        self.root = {service.name: service for service in services}
+
+
+class ScriptedClient:
+    """Finds each service with the statuses of its script, one per probe, then with the last one forever."""
+
+    def __init__(self, scripts: Dict[str, List[bool]]):
+        self.scripts = {name: list(statuses) for name, statuses in scripts.items()}
+        self.probed_at: Dict[str, List[float]] = defaultdict(list)
+
+    async def probe_services(self, services) -> Dict[str, ProbeResult]:
+        results = {}
+        for service in services:
+            script = self.scripts[service.name]
+            is_up = script.pop(0) if len(script) > 1 else script[0]
+            self.probed_at[service.name].append(time.monotonic())
+            results[service.name] = ProbeResult(name=service.name, is_up=is_up, checked_at=dt.datetime.utcnow())
+        return results
+
+
+def run_scheduler(services: FakeServices, client: ScriptedClient, duration: float, **parameters) -> ProbeScheduler:
+    """Run a scheduler for `duration` seconds."""
+    recorded_batches = []
+
+    async def on_recorded(results):
+        recorded_batches.append(results)
+
+    async def main():
+        scheduler = ProbeScheduler(services, client, on_recorded, batch_window=0.001, **parameters)
+        scheduler.start()
+        await asyncio.sleep(duration)
+        await scheduler.stop()
+        return scheduler
+
+    return asyncio.run(main())
+
+
+def test_unconfirmed_change_is_ignored():
+    service = FakeService("A", True)
+    client = ScriptedClient({"A": [False, True]})
+    scheduler = run_scheduler(FakeServices(service), client, 0.2, interval=10, confirmations=3, confirm_interval=0.01)
+
+    assert scheduler.ignored == 1
+    assert service.recorded == [True]
+    assert service.status is True
+
+
+def test_confirmed_change_is_recorded():
+    service = FakeService("A", True)
+    client = ScriptedClient({"A": [False]})
+    scheduler = run_scheduler(FakeServices(service), client, 0.2, interval=0.05, confirmations=3,
+                              confirm_interval=0.01)
+
+    assert scheduler.ignored == 0
+    assert service.recorded[0] is False
+    # The first probe and the 3 confirmations, then the regular probes of a service down
+    assert len(client.probed_at["A"]) >= 4 + len(service.recorded) - 1
+    confirmations = client.probed_at["A"][:4]
+    assert all(b - a < 0.04 for a, b in zip(confirmations, confirmations[1:]))
+
+
+def test_interval_backs_off_while_up_only():
+    up, down = FakeService("up", True), FakeService("down", False)
+    client = ScriptedClient({"up": [True], "down": [False]})
+    run_scheduler(FakeServices(up, down), client, 0.75, interval=0.05, max_interval=0.2, backoff=2)
+
+    gaps_up = [b - a for a, b in zip(client.probed_at["up"], client.probed_at["up"][1:])]
+    gaps_down = [b - a for a, b in zip(client.probed_at["down"], client.probed_at["down"][1:])]
+    # 0.1, 0.2, then capped at 0.2
+    assert 0.09 <= gaps_up[0] < 0.15
+    assert all(0.19 <= gap < 0.25 for gap in gaps_up[1:])
+    assert len(gaps_up) >= 3
+    # A service down stays at the base interval
+    assert all(0.04 <= gap < 0.08 for gap in gaps_down)
+    assert len(gaps_down) >= 10
+
+
+def test_time_until_next_only_counts_the_given_services():
+    fast, slow = FakeService("fast", True), FakeService("slow", True)
+    services = FakeServices(fast)
+    client = ScriptedClient({"fast": [True], "slow": [True]})
+    probe_services = client.probe_services
+
+    async def hanging_probe_services(batch):
+        if any(service.name == "slow" for service in batch):
+            await asyncio.sleep(3600)  # In flight until the scheduler stops
+        return await probe_services(batch)
+
+    client.probe_services = hanging_probe_services
+
+    async def on_recorded(results):
+        pass
+
+    async def main():
+        scheduler = ProbeScheduler(services, client, on_recorded, interval=0.05, max_interval=5, backoff=100,
+                                   batch_window=0.001)
+        assert scheduler.time_until_next() is None
+        scheduler.start()
+        await asyncio.sleep(0.02)
+        services.root["slow"] = slow  # Picked up within the base interval, then probed forever
+        await asyncio.sleep(0.1)
+        times = (scheduler.time_until_next(["fast"]), scheduler.time_until_next(["slow"]),
+                 scheduler.time_until_next(), scheduler.time_until_next(["unknown"]))
+        await scheduler.stop()
+        return times
+
+    fast_next, slow_next, any_next, unknown_next = asyncio.run(main())
+    # The next probe of "fast" is 5 s after its first one, whatever the probe of "slow" in flight
+    assert 4.8 < fast_next <= 5
+    assert slow_next == any_next == 0
+    assert unknown_next is None
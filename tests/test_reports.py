@@ -0,0 +1,67 @@
+import asyncio
+
+import sql
+from reports import ReportBuffer
+
+
+def user_reports(service: str):
+    return [status for _, status, _ in sql.get_history_page(service, sql.SOURCE_USER, 0, 2 ** 40, limit=1_000)]
+
+
+def test_reports_are_deduplicated_and_written_in_batches(database):
+    flushes = []
+
+    async def main():
+        buffer = ReportBuffer(flush_interval=3600, dedup_window=3600)
+        await buffer.start(lambda: flushes.append(sql.get_version(sql.VERSION_REPORTS)))
+        accepted = [buffer.submit("A", "1.2.3.4", False), buffer.submit("A", "1.2.3.4", True),
+                    buffer.submit("A", "5.6.7.8", False), buffer.submit("B", "1.2.3.4", True)]
+        pending = len(buffer)
+        await buffer.flush()
+        accepted.append(buffer.submit("A", "1.2.3.4", True))  # Still within the window once written
+        await buffer.stop()
+        return buffer, accepted, pending
+
+    buffer, accepted, pending = asyncio.run(main())
+    assert accepted == [True, False, True, True, False]
+    assert (pending, buffer.accepted, buffer.duplicates, buffer.dropped) == (3, 3, 2, 0)
+    assert user_reports("A") == [0, 0]
+    assert user_reports("B") == [1]
+    # Each batch starts a new version of the reports, even if no user status changed
+    assert flushes == [1]
+
+
+def test_client_can_report_again_after_the_window(database):
+    async def main():
+        buffer = ReportBuffer(flush_interval=3600, dedup_window=0.01)
+        accepted = [buffer.submit("A", "1.2.3.4", False)]
+        await asyncio.sleep(0.02)
+        accepted.append(buffer.submit("A", "1.2.3.4", False))
+        await buffer.flush()
+        return accepted
+
+    assert asyncio.run(main()) == [True, True]
+    assert user_reports("A") == [0, 0]
+
+
+def test_lost_reports_are_not_deduplicated(database, monkeypatch):
+    def fail(reports):
+        raise OSError("disk I/O error")
+
+    async def main():
+        buffer = ReportBuffer(flush_interval=3600, dedup_window=3600, max_size=2)
+        accepted = [buffer.submit("A", "1.2.3.4", False), buffer.submit("B", "1.2.3.4", False),
+                    buffer.submit("C", "1.2.3.4", False)]
+        with monkeypatch.context() as patch:
+            patch.setattr(sql, "insert_user_reports", fail)
+            await buffer.flush()
+        # The reports were not written: the client may send them again
+        accepted.append(buffer.submit("A", "1.2.3.4", False))
+        await buffer.flush()
+        return buffer, accepted
+
+    buffer, accepted = asyncio.run(main())
+    assert accepted == [True, True, False, True]
+    assert buffer.dropped == 3  # The report of C, over the size of the buffer, and the 2 that were not written
+    assert user_reports("A") == [0]
+    assert user_reports("B") == []
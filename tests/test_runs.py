@@ -0,0 +1,64 @@
+import random
+
+import pytest
+
+import runs
+
+
+def jittered_probes(count: int, spacing: int = 60, jitter: int = 2, flip_every: int = 50, seed: int = 0):
+    """(timestamp, status) probes about `spacing` seconds apart, whose status flips every `flip_every` probes."""
+    rng = random.Random(seed)
+    ts, probes = 1_790_000_000, []
+    for i in range(count):
+        probes.append((ts + rng.randint(-jitter, jitter), int(i // flip_every % 2 == 0)))
+        ts += spacing
+    return probes
+
+
+def test_round_trip_is_within_tolerance():
+    probes = jittered_probes(1_000)
+    encoded = runs.encode(probes)
+    reconstructed = [(ts, run.status) for run in encoded for ts in runs.decode(run.start_ts, run.end_ts, run.samples)]
+
+    count, deviation = runs.compare(probes, reconstructed)
+    assert count == len(probes)
+    assert deviation <= runs.RUN_TOLERANCE
+    assert len(encoded) < len(probes) / 10
+    # The bounds of the runs are exact
+    timestamps = {ts for ts, _ in probes}
+    assert all(run.start_ts in timestamps and run.end_ts in timestamps for run in encoded)
+
+
+def test_change_of_status_starts_a_new_run():
+    encoded = runs.encode([(0, 1), (60, 1), (120, 0), (180, 0), (240, 1)])
+    assert [(run.start_ts, run.end_ts, run.status, run.samples) for run in encoded] == \
+           [(0, 60, 1, 2), (120, 180, 0, 2), (240, 240, 1, 1)]
+
+
+def test_change_of_spacing_starts_a_new_run():
+    probes = [(60 * i, 1) for i in range(10)] + [(540 + 90 * i, 1) for i in range(1, 10)]
+    encoded = runs.encode(probes)
+    assert len(encoded) == 2
+    assert runs.compare(probes, [(ts, run.status) for run in encoded
+                                 for ts in runs.decode(run.start_ts, run.end_ts, run.samples)])[1] == 0
+
+
+def test_compare_detects_a_mismatch():
+    with pytest.raises(ValueError):
+        runs.compare([(0, 1), (60, 1)], [(0, 1), (60, 0)])
+    with pytest.raises(ValueError):
+        runs.compare([(0, 1), (60, 1)], [(0, 1)])
+    with pytest.raises(ValueError):
+        runs.compare([(0, 1), (60, 1)], [(0, 1), (60 + runs.RUN_TOLERANCE + 1, 1)])
+
+
+def test_count_matches_decode():
+    rng = random.Random(1)
+    for _ in range(10_000):
+        samples = rng.randint(1, 40)
+        start = rng.randint(0, 100)
+        end = start if samples == 1 else start + rng.randint(samples - 1, 60 * samples)
+        after = rng.randint(start - 10, end + 10)
+        until = rng.randint(after, end + 20)
+        expected = sum(after < ts <= until for ts in runs.decode(start, end, samples))
+        assert runs.count(start, end, samples, after, until) == expected
@@ -0,0 +1,38 @@
+import asyncio
+import dataclasses
+import datetime as dt
+import json
+
+import pytest
+
+from probe import ProbeResult
+from snapshots import ApiSnapshot
+
+
+def test_snapshot_bodies_match_the_models(services):
+    snapshot = ApiSnapshot.build(services)
+
+    assert json.loads(snapshot.overview) == ["A", "B"]
+    assert json.loads(snapshot.statuses) == {"A": True, "B": False}
+    assert json.loads(snapshot.details) == services.model_dump(mode="json", by_alias=True)
+    assert {name: json.loads(body) for name, body in snapshot.service_statuses.items()} == {"A": True, "B": False}
+    assert json.loads(snapshot.service_details["B"]) == services.root["B"].model_dump(mode="json", by_alias=True)
+    # Never shared yet: the responses were last modified by the last check
+    assert (snapshot.generation, snapshot.last_modified) == (0, dt.datetime(2026, 3, 1, 12))
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        snapshot.statuses = b"{}"
+
+
+def test_snapshot_is_built_again_for_each_generation(services):
+    before = ApiSnapshot.build(services)
+    services.root["B"].record_probe(ProbeResult(name="B", is_up=True, checked_at=dt.datetime(2026, 3, 1, 12, 5)))
+    asyncio.run(services.save_snapshot())
+    after = ApiSnapshot.build(services)
+
+    # The snapshot served meanwhile is unchanged
+    assert json.loads(before.statuses) == {"A": True, "B": False}
+    assert json.loads(after.statuses) == {"A": True, "B": True}
+    assert json.loads(after.service_details["B"])["last_checked"] == "2026-03-01T12:05:00"
+    assert after.service_details["A"] == before.service_details["A"]
+    assert after.generation != before.generation
+    assert after.last_modified > before.last_modified
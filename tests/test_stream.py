@@ -0,0 +1,77 @@
+import asyncio
+import threading
+
+from stream import STREAM_RETRY, StatusBroadcaster, encode_event
+
+
+async def read(stream, count: int):
+    return [await anext(stream) for _ in range(count)]
+
+
+def test_events_follow_the_snapshot():
+    async def main():
+        broadcaster = StatusBroadcaster(heartbeat=3600)
+        await broadcaster.start()
+        stream = broadcaster.subscribe(lambda: encode_event("snapshot", {"A": True}))
+        first = await anext(stream)
+
+        broadcaster.publish("status", {"name": "A", "is_up": False})
+        # From the probe threads too
+        thread = threading.Thread(target=broadcaster.publish, args=("status", {"name": "B", "is_up": True}))
+        thread.start()
+        thread.join()
+        events = await asyncio.wait_for(read(stream, 2), 1)
+
+        await broadcaster.stop()
+        return first, events, [message async for message in stream]
+
+    first, events, rest = asyncio.run(main())
+    assert first == f"retry: {STREAM_RETRY}\n\n".encode() + b'event: snapshot\ndata: {"A":true}\n\n'
+    assert events == [b'event: status\ndata: {"name":"A","is_up":false}\n\n',
+                      b'event: status\ndata: {"name":"B","is_up":true}\n\n']
+    # The stream ends with the broadcaster
+    assert rest == []
+
+
+def test_slow_client_is_dropped():
+    async def main():
+        broadcaster = StatusBroadcaster(buffer=4, heartbeat=3600)
+        await broadcaster.start()
+        slow, fast = broadcaster.subscribe(), broadcaster.subscribe()
+        await anext(slow)
+        await anext(fast)
+
+        received = []
+        for i in range(10):
+            broadcaster.publish("status", i)
+            received.append(await anext(fast))
+        remaining = [message async for message in slow]
+        subscribers = len(broadcaster)
+        await broadcaster.stop()
+        return received, remaining, subscribers, broadcaster.dropped
+
+    received, remaining, subscribers, dropped = asyncio.run(main())
+    assert received == [encode_event("status", i) for i in range(10)]
+    # The slow client filled its buffer on the 5th event: its pending events are discarded and its stream ends
+    assert remaining == []
+    assert (subscribers, dropped) == (1, 1)
+
+
+def test_heartbeats_keep_the_clients_alive():
+    async def main():
+        broadcaster = StatusBroadcaster(heartbeat=0.01)
+        await broadcaster.start()
+        stream = broadcaster.subscribe()
+        await anext(stream)
+        messages = await asyncio.wait_for(read(stream, 2), 1)
+        await broadcaster.stop()
+        return messages
+
+    assert asyncio.run(main()) == [b": keep-alive\n\n"] * 2
+
+
+def test_subscribe_before_start_ends_at_once():
+    async def main():
+        return [message async for message in StatusBroadcaster().subscribe()]
+
+    assert asyncio.run(main()) == [f"retry: {STREAM_RETRY}\n\n".encode()]
@@ -1,3 +1,6 @@
+import os
+import tempfile
+
 # Note: argon2 is the pip package 'argon2-cffi'!
 from argon2 import PasswordHasher
 from argon2.exceptions import InvalidHashError, VerifyMismatchError
@@ -32,4 +35,30 @@ def verify_password(hashed_pwd: str, pwd: str) -> bool:
     except (VerifyMismatchError, InvalidHashError):
         return False
 
+# File handling ########################################################################################################
+
+
+def atomic_write(filename: str, data: str) -> None:
+    """
+    Write `data` to `filename` atomically: the data is first written to a temporary file in the same directory, which
+    then replaces `filename`. A crash mid-write thus never leaves a truncated file behind.
+
+    :param filename: the file to (over)write
+    :param data: the text to write to the file
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_filename = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(filename)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        try:
+            os.remove(tmp_filename)
+        except OSError:
+            pass
+        raise
+
 ########################################################################################################################